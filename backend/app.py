@@ -1,27 +1,105 @@
 import os
+import sys
 import json
 import asyncio
-import re
-import httpx
+import time
+import logging
 import openai
 
+from contextlib import asynccontextmanager
 from typing import List, Optional
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from exa_py import Exa
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, ValidationError, field_validator
+
+# Provider plumbing shared with the batch enricher lives at the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import http_pool
+import metrics
+import payloads
+import people_index
+import ratelimit
+import resilience
+import tag_index
+from cache import LRUCache, SingleFlight, mixrank_cache
+from geo import UNKNOWN, client_ip, geo_cache, get_ip_location
+from jobs import Job, JobManager
+import llm_json
+from llm_json import JSONArrayStreamParser, complete_structured
+from logging_setup import configure_logging
+from normalize import normalize_name
+from payloads import compact_payload
+from pipeline import PipelineError, ProfilePipeline, ProfileResult
+from store import store
+from prerank import PRERANK_MAX_CLUSTERS, clear_winner, prerank
 
 # Load environment
 load_dotenv()
 EXA_API_KEY = os.getenv("EXA_API_KEY")
 MIXRANK_API_KEY = os.getenv("MIXRANK_API_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+MAX_CANDIDATES = 5
+ENRICH_CACHE_TTL = float(os.getenv("ENRICH_CACHE_TTL", "3600"))
+ENRICH_CACHE_ENTRIES = int(os.getenv("ENRICH_CACHE_ENTRIES", "5000"))
+# Request budgets (see resilience.py): optional stages are cut rather than blow through them
+ENRICH_DEADLINE = float(os.getenv("ENRICH_DEADLINE", "15"))
+PROFILE_DEADLINE = float(os.getenv("PROFILE_DEADLINE", "60"))
+# keep above BREAKER_IP_API_SLOW_SECONDS, or lookups cut here never count against the breaker
+GEO_STAGE_BUDGET = float(os.getenv("GEO_STAGE_BUDGET", "1.5"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "10000"))
+BATCH_MAX_JOBS = int(os.getenv("BATCH_MAX_JOBS", "1000"))
+BATCH_JOB_TTL = float(os.getenv("BATCH_JOB_TTL", "86400"))
+INDEX_SYNC_SECONDS = float(os.getenv("INDEX_SYNC_SECONDS", os.getenv("TAG_INDEX_SYNC_SECONDS", "10")))
+
 
+configure_logging()
+logger = logging.getLogger("delphi.api")
+
+# Tag search and local people indexes: loaded from the database at startup, then kept up with
+# whatever the batch job writes by reading past their watermarks every INDEX_SYNC_SECONDS
+async def sync_indexes():
+    tables = None
+    while True:
+        try:
+            if tables is None:
+                tables = await asyncio.to_thread(lambda: store.tables)
+            connection_table, enrichment_table = tables
+            read = await asyncio.to_thread(tag_index.index.sync, store.engine, enrichment_table)
+            if read:
+                logger.info("tag index synced %d enrichment rows", read, extra=tag_index.index.stats())
+            read = await asyncio.to_thread(people_index.index.sync, store.engine, connection_table, enrichment_table)
+            if read:
+                logger.info("people index synced %d connections", read, extra=people_index.index.stats())
+        except Exception:
+            logger.exception("index sync failed")
+        await asyncio.sleep(INDEX_SYNC_SECONDS)
 
 # FastAPI setup
 origins = ["http://localhost:3000", "https://gentle-elegance-production.up.railway.app"]
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled, keep-alive HTTP client for Mixrank/Exa/ip-api per worker process
+    await http_pool.open_async_client()
+    syncing = asyncio.create_task(sync_indexes()) if store is not None else None
+    yield
+    if syncing is not None:
+        syncing.cancel()
+    await http_pool.close_async_client()
+
+app = FastAPI(lifespan=lifespan)
+
+# A provider whose circuit breaker is open: tell the client when to come back
+@app.exception_handler(resilience.CircuitOpenError)
+async def circuit_open(request: Request, exc: resilience.CircuitOpenError):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"{exc.provider} is temporarily unavailable, please try again shortly"},
+        headers={"Retry-After": str(max(1, round(exc.retry_in)))},
+    )
 app.add_middleware(
   CORSMiddleware,
   allow_origins=origins,
@@ -49,41 +127,87 @@ class ConfirmProfileRequest(BaseModel):
     name: str
     linkedin_url: str
 
+# Structured LLM outputs
+class CandidateList(BaseModel):
+    # items are validated one by one (to_candidate) so one bad entry doesn't sink the rest
+    candidates: List[dict]
+
+class LinkedInGuess(BaseModel):
+    linkedin_url: str
+
+    @field_validator("linkedin_url")
+    @classmethod
+    def must_be_linkedin_profile(cls, value: str) -> str:
+        value = value.strip()
+        if not value.lower().startswith(("http://", "https://")) or "linkedin.com/in/" not in value.lower():
+            raise ValueError("not a LinkedIn profile URL")
+        return value
+
 
 # Clients
-exa = Exa(EXA_API_KEY)
+# Base URLs are overridable so bench/ can point every provider at local stand-ins
+# (the OpenAI client reads OPENAI_BASE_URL itself)
+EXA_SEARCH_URL = os.getenv("EXA_BASE_URL", "https://api.exa.ai").rstrip("/") + "/search"
 openai.api_key = OPENAI_API_KEY
-client = openai.AsyncOpenAI()
+# Retries are owned by ratelimit so 429s back off against the shared OpenAI bucket; the timeout
+# bounds a hung completion (stage timeouts and deadlines cut the wait sooner where they apply)
+client = openai.AsyncOpenAI(max_retries=0, timeout=OPENAI_TIMEOUT)
+
+# /api/enrich caches: Exa results only depend on the name, so they're keyed on it alone and the
+# search can still run alongside geolocation; the LLM's candidate list is keyed on name + location.
+search_cache = LRUCache(ENRICH_CACHE_ENTRIES, ENRICH_CACHE_TTL)
+candidate_cache = LRUCache(ENRICH_CACHE_ENTRIES, ENRICH_CACHE_TTL)
+inflight = SingleFlight()
+
+for _name, _cache in (("exa_search", search_cache), ("candidates", candidate_cache), ("mixrank", mixrank_cache),
+                      ("geo", geo_cache), ("inflight", inflight)):
+    metrics.register_collector(metrics.cache_collector(_name, _cache))
+metrics.register_collector(metrics.dict_collector("delphi_llm_json", llm_json.stats))
+metrics.register_collector(metrics.dict_collector("delphi_prompt", payloads.totals))
+for _prefix, _index in (("delphi_tag_index", tag_index.index), ("delphi_people_index", people_index.index)):
+    metrics.register_collector(lambda prefix=_prefix, index=_index: (
+        (f"{prefix}_{stat}", {}, value) for stat, value in index.stats().items()
+    ))
 
 # Helpers
 
-def extract_location_info(data: dict):
-    city = data.get('city', '')
-    region = data.get('regionName', '')
-    country = data.get('country', '')
-    display = ", ".join(filter(None, [city, region, country]))
-    return {'display': display or 'Unknown', 'city': city.lower()}
+async def search_exa(query: str) -> List[dict]:
+    # Exa's REST API directly: the SDK is synchronous and would block the event loop.
+    # A search is idempotent, so a slow one gets hedged (resilience.hedged)
+    resp = await resilience.hedged("exa", lambda: ratelimit.call_async(
+        "exa",
+        http_pool.async_client().post,
+        EXA_SEARCH_URL,
+        json={"query": query, "type": "keyword", "category": "linkedin profiles"},
+        headers={"x-api-key": EXA_API_KEY},
+        timeout=10
+    ))
+    resp.raise_for_status()
+    return resp.json().get("results", [])
 
-def get_ip_location(ip: str) -> dict:
-    if ip.startswith(("127.", "192.168.", "10.", "172.")):
-        return {"display": "Unknown", "city": ""}
-    try:
-        resp = httpx.get(f"http://ip-api.com/json/{ip}?fields=status,city,regionName,country", timeout=5)
-        data = resp.json()
-        if data.get("status") == "success":
-            return extract_location_info(data)
-    except Exception:
-        pass
-    return {"display": "Unknown", "city": ""}
+def locate(request: Request):
+    # Geolocation only sharpens the ranking: past its share of the budget we go without it
+    return resilience.optional("geo", get_ip_location(client_ip(request)), UNKNOWN, limit=GEO_STAGE_BUDGET)
+
+async def timed_stage(endpoint: str, stage: str, awaitable):
+    with metrics.timed("delphi_stage_seconds", endpoint=endpoint, stage=stage):
+        return await awaitable
+
+async def cached_call(cache: LRUCache, key: tuple, fn, *args):
+    value = cache.get(key)
+    if value is None:
+        # identical concurrent requests share one in-flight call
+        value = await inflight.do(key, fn, *args)
+        cache.set(key, value)
+    return value
 
 # Process all results
-async def process_all_results(results: List[dict], query_name: str, ip_display: str) -> List[dict]:
+def build_candidates_prompt(results: List[dict], query_name: str, ip_display: str) -> List[dict]:
     entries = []
     for idx, r in enumerate(results, start=1):
-        title = r.title
-        text = r.text
-        url = r.url
-        highlights = r.highlights
+        title = r.get('title')
+        url = r.get('url')
+        highlights = r.get('highlights')
         entries.append(
             f"Result {idx}:\n"
             f"Title: {title}\n"
@@ -98,25 +222,103 @@ async def process_all_results(results: List[dict], query_name: str, ip_display:
                 "Below are raw search result entries. Identify each unique person, then for each person return an object with 'summary' (which can be incredibly short), 'url', and 'score' (0-10). "
                 "The summary should include whatever identifying information you can find about the person. (School, company, etc.)"
                 "If there are multiple results that are probably the same person, return a single result with higher score."
-                "Output strictly valid JSON: an array of {summary: string, url: string, score: number}."
+                "Output strictly valid JSON: an object {\"candidates\": [{summary: string, url: string, score: number}, ...]}."
             )
         },
         {"role": "system", "content": "\n".join(entries)}
     ]
-    resp = await client.chat.completions.create(
+    return prompt
+
+async def process_all_results(results: List[dict], query_name: str, ip_display: str) -> List[dict]:
+    try:
+        parsed = await complete_structured(
+            client, CandidateList, build_candidates_prompt(results, query_name, ip_display)
+        )
+    except (ValueError, ValidationError):
+        raise HTTPException(status_code=500, detail="Invalid JSON from LLM")
+    return parsed.candidates
+
+async def stream_all_results(results: List[dict], query_name: str, ip_display: str):
+    # Same prompt as process_all_results, but yields each person as soon as its object is complete
+    stream = await ratelimit.call_async(
+        "openai",
+        client.chat.completions.create,
         model="gpt-4o-mini",
-        messages=prompt,
+        messages=build_candidates_prompt(results, query_name, ip_display),
+        response_format={"type": "json_object"},
+        stream=True,
     )
-    raw_content = resp.choices[0].message.content
-    match = re.search(r"```(?:json)?(.*)```", raw_content, re.S)
-    text = match.group(1).strip() if match else raw_content.strip()
+    parser = JSONArrayStreamParser()
+    async for chunk in stream:
+        if not chunk.choices or not chunk.choices[0].delta.content:
+            continue
+        for item in parser.feed(chunk.choices[0].delta.content):
+            yield item
+    llm_json.stats["calls"] += 1
+    if parser.failures:
+        llm_json.stats["parse_failures"] += 1
+
+def shortlist(results: List[dict], query_name: str, location_info: dict):
+    # Local dedupe + pre-score: (candidate, None) when one person clearly wins, else the top
+    # clusters for the LLM to summarise and score
+    clusters = prerank(results, query_name, location_info['city'])
+    winner = clear_winner(clusters)
+    if winner:
+        return winner.as_candidate(), None
+    return None, [c.representative() for c in clusters[:PRERANK_MAX_CLUSTERS]]
+
+async def rank_candidates(results: List[dict], query_name: str, location_info: dict) -> List[dict]:
+    winner, shortlisted = shortlist(results, query_name, location_info)
+    if winner:
+        return [winner]
+    if not shortlisted:
+        return []
+    return await process_all_results(shortlisted, query_name, location_info['display'])
+
+def to_candidate(item: dict) -> Optional[Candidate]:
+    if not isinstance(item, dict):
+        return None
     try:
-        return json.loads(text)
-    except json.JSONDecodeError:
-        raise HTTPException(status_code=500, detail="Invalid JSON from LLM")
-    
+        candidate = Candidate.model_validate({'score': 0, **item})
+    except ValidationError:
+        return None
+    candidate.summary, candidate.url = candidate.summary.strip(), candidate.url.strip()
+    if candidate.summary and candidate.url:
+        return candidate
+    return None
+
+# Local-first: people we have already enriched answer /api/enrich without Exa or the LLM.
+# may_know is the name-only check that decides whether to wait for geolocation before searching.
+def may_know(name: str) -> bool:
+    index = people_index.index
+    return index.ready and any(score >= people_index.PEOPLE_INDEX_MIN_SCORE for score, _ in index.lookup(name))
+
+def local_candidates(name: str, location_info: dict) -> List[dict]:
+    matches = people_index.index.confident(name, location_info['city'], MAX_CANDIDATES)
+    metrics.inc("delphi_people_index_lookups_total", outcome="hit" if matches else "miss")
+    return [
+        {'summary': person.describe(), 'url': person.url, 'score': round(score * 10, 1)}
+        for score, person in matches
+    ]
+
+# Not confident (no city, or too many namesakes): the people we know by this name are ranked
+# together with the Exa results, so they still get a chance to be the candidate
+def with_local_results(raw_results: List[dict], name: str, location_info: dict) -> List[dict]:
+    if not people_index.index.ready:
+        return raw_results
+    known = people_index.index.lookup(name, location_info['city'])[:PRERANK_MAX_CLUSTERS]
+    return [person.as_result() for _, person in known] + raw_results
+
+async def replay(items: List[dict]):
+    for item in items:
+        yield item
+
+def sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 # API endpoints
 @app.post('/api/enrich')
+@resilience.within(ENRICH_DEADLINE)
 async def enrich(body: EnrichRequest, request: Request):
     # Extract and validate
     name = body.name.strip()
@@ -127,29 +329,39 @@ async def enrich(body: EnrichRequest, request: Request):
         return {'social_url': body.social_url}
 
 
-    # Parallel IP + search
-    client_ip = request.headers.get('X-Forwarded-For', request.client.host)
-    location_info = get_ip_location(client_ip)
+    # Parallel IP + search, unless this may be someone we already know about
     query = f"{name}"
-    exa_resp = exa.search(
-        query, 
-        type="keyword",
-        category="linkedin profiles"
-    )
-    # LLM handles dedupe, summary, scoring
-    raw_results = exa_resp.results
-    candidates_data = await process_all_results(raw_results, name, location_info['display'])
+    query_key = normalize_name(name)
+    geo = timed_stage("enrich", "geo", locate(request))
+    if may_know(name):
+        location_info = await geo
+        local = local_candidates(name, location_info)
+        if local:
+            return {'candidates': local, 'location': location_info['display']}
+        raw_results = await timed_stage(
+            "enrich", "exa", cached_call(search_cache, ("exa", query_key), search_exa, query)
+        )
+    else:
+        location_info, raw_results = await asyncio.gather(
+            geo,
+            timed_stage("enrich", "exa", cached_call(search_cache, ("exa", query_key), search_exa, query)),
+        )
+    raw_results = with_local_results(raw_results, name, location_info)
+    # Local pre-ranking dedupes; the LLM only summarises and scores the shortlist
+    candidates_data = await timed_stage("enrich", "candidates", cached_call(
+        candidate_cache,
+        ("candidates", query_key, location_info['display']),
+        rank_candidates, raw_results, name, location_info,
+    ))
     candidates: List[Candidate] = []
     for item in candidates_data:
-        if len(candidates) >= 5:
+        if len(candidates) >= MAX_CANDIDATES:
             break
-        summary = item.get('summary', '').strip()
-        url = item.get('url', '').strip()
-        score = float(item.get('score', 0))
-        if summary and url:
-            candidates.append(Candidate(summary=summary, url=url, score=score))
+        candidate = to_candidate(item)
+        if candidate:
+            candidates.append(candidate)
 
-    if not candidates or len(candidates) > 5:
+    if not candidates or len(candidates) > MAX_CANDIDATES:
         return {
             'require_social_url': True,
             'message': "Please provide a direct social URL for disambiguation."
@@ -160,34 +372,120 @@ async def enrich(body: EnrichRequest, request: Request):
         'location': location_info['display']
     }
 
+# Server-Sent Events flavour of /api/enrich: `location` as soon as geolocation resolves, one
+# `candidate` per person as the LLM finishes writing it, then `done` (with the time to first
+# candidate) or `require_social_url`. Failures arrive as an `error` event.
+@app.post('/api/enrich/stream')
+async def enrich_stream(body: EnrichRequest, request: Request):
+    name = body.name.strip()
+    if not name:
+        raise HTTPException(status_code=400, detail="Name is required")
+
+    async def events():
+        if body.social_url:
+            yield sse('social_url', {'social_url': body.social_url})
+            return
+        with resilience.deadline(ENRICH_DEADLINE):
+            started = time.perf_counter()
+            first_candidate_ms = None
+            query_key = normalize_name(name)
+            known = may_know(name)
+            # the search only waits for geolocation when local matches might make it unnecessary
+            search = None if known else asyncio.ensure_future(
+                cached_call(search_cache, ("exa", query_key), search_exa, name)
+            )
+            cached = local = None
+            try:
+                location_info = await timed_stage("enrich_stream", "geo", locate(request))
+                location = location_info['display']
+                yield sse('location', {'location': location})
+
+                local = local_candidates(name, location_info) if known else None
+                if not local and search is None:
+                    search = asyncio.ensure_future(cached_call(search_cache, ("exa", query_key), search_exa, name))
+                cache_key = ("candidates", query_key, location)
+                if local:
+                    items = replay(local)
+                elif (cached := candidate_cache.get(cache_key)) is not None:
+                    search.cancel()   # the cached candidates already cover this search
+                    items = replay(cached)
+                else:
+                    raw_results = with_local_results(
+                        await timed_stage("enrich_stream", "exa", search), name, location_info
+                    )
+                    winner, shortlisted = shortlist(raw_results, name, location_info)
+                    if winner:
+                        items = replay([winner])
+                    elif shortlisted:
+                        items = stream_all_results(shortlisted, name, location)
+                    else:
+                        items = replay([])
+                seen, sent = [], 0
+                async for item in items:
+                    seen.append(item)
+                    candidate = to_candidate(item)
+                    if candidate is None or sent >= MAX_CANDIDATES:
+                        continue
+                    if first_candidate_ms is None:
+                        first_candidate_ms = round((time.perf_counter() - started) * 1000, 1)
+                        metrics.observe("delphi_time_to_first_candidate_seconds", first_candidate_ms / 1000)
+                    sent += 1
+                    yield sse('candidate', candidate.dict())
+                if cached is None and not local:
+                    candidate_cache.set(cache_key, seen)
+            except Exception:
+                logger.exception("enrich stream failed")
+                yield sse('error', {'detail': "Enrichment failed"})
+                return
+            finally:
+                # also runs when the client disconnects (GeneratorExit / CancelledError)
+                if search is not None and not search.done():
+                    search.cancel()
+
+            logger.info("enrich stream: %d candidates, time_to_first_candidate_ms=%s", sent, first_candidate_ms)
+            if not sent:
+                yield sse('require_social_url', {
+                    'message': "Please provide a direct social URL for disambiguation.",
+                    'location': location,
+                })
+                return
+            yield sse('done', {'count': sent, 'time_to_first_candidate_ms': first_candidate_ms})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # Quick Summary
-async def get_quick_summary(data):
+async def get_quick_summary(data: dict, exa_results: Optional[List[dict]] = None):
     system_prompt = f"""
     You are given a JSON object of a person's LinkedIn profile. Create a brief summary of the person's background and bio. Don't include any fancy formatting.
     """
+    # Only the fields worth summarising, capped to the prompt token budget
+    projection = compact_payload(data, exa_results)
+    logger.info("summary prompt: ~%d tokens (~%d saved by compaction)", projection.tokens, projection.saved_tokens)
     user_prompt = f"""
-    {data.json()}
+    {projection.mixrank}
+    {projection.exa}
     """
-    summary = await client.chat.completions.create(
+    summary = await ratelimit.call_async(
+        "openai",
+        client.chat.completions.create,
         model="gpt-4o-mini",
         messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}],
     )
+    llm_json.record_usage("gpt-4o-mini", summary)
     try:
         summary = summary.choices[0].message.content
         return summary
     except Exception as e:
         raise HTTPException(status_code=500, detail="Failed to generate summary")
-    
-# Once a user confirms a profile, we can enrich them directly
+
 # Automated guessing :)
-@app.post('/api/full_profile')
-async def full_profile(request: FullProfileRequest):
-    name, summary, url = request.name.strip(), request.summary.strip(), request.url.strip()
-    if not name:
-        raise HTTPException(status_code=400, detail="Name is required")
-    if not summary or not url:
-        raise HTTPException(status_code=400, detail="Summary and URL are required")
-    system_prompt = f"""
+def guess_linkedin_url_messages(name: str, summary: str = "", url: str = "") -> List[dict]:
+    # not an f-string: the example output's braces are literal
+    system_prompt = """
     You are given:
     - The full name being searched for
     - The URL of the profile being searched for
@@ -196,7 +494,7 @@ async def full_profile(request: FullProfileRequest):
     You are an expert at guessing the LinkedIn URL for a given person.
 
     Based on the given information and what you can find on the web, return the most likely LinkedIn URL for the person.
-    ONLY return the LinkedIn URL, nothing else. An example output is "https://www.linkedin.com/in/johndoe". Do not include any other text. Do not include explanations. Only the URL.
+    ONLY return a JSON object with the LinkedIn URL, nothing else. An example output is {"linkedin_url": "https://www.linkedin.com/in/johndoe"}. Do not include any other text. Do not include explanations. Only the JSON.
 
     """
     user_prompt = f"""
@@ -204,33 +502,95 @@ async def full_profile(request: FullProfileRequest):
     Summary: {summary}
     URL: {url}
     """
+    return [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}]
+
+async def guess_linkedin_url(name: str, summary: str = "", url: str = "") -> str:
+    # search-preview models don't take response_format; the JSON is validated (and repaired) instead
+    guess = await complete_structured(
+        client,
+        LinkedInGuess,
+        guess_linkedin_url_messages(name, summary, url),
+        model="gpt-4o-mini-search-preview",
+        json_mode=False,
+    )
+    return guess.linkedin_url
+
+async def search_name(name: str) -> List[dict]:
+    return await cached_call(search_cache, ("exa", normalize_name(name)), search_exa, name)
+
+profile_pipeline = ProfilePipeline(resolve_url=guess_linkedin_url, search=search_name, summarize=get_quick_summary)
+
+async def run_profile_pipeline(name: str, linkedin_url: Optional[str] = None, **hints) -> ProfileResult:
     try:
-        resp = await client.chat.completions.create(
-                model="gpt-4o-mini-search-preview",
-                messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}],
-        )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail="Failed to generate LinkedIn URL, but it's not you–it's us. Please try again!")
-    raw = resp.choices[0].message.content
-    match_url = re.search(r"https?://[\w./%-]+", raw)
-    social_url = match_url.group(0) if match_url else None
-    if not social_url or "linkedin.com/in/" not in social_url.lower():
-        raise HTTPException(status_code=500, detail="Failed to generate LinkedIn URL, but it's not you–it's us. Please try again!")
-
-    # Enrich via Mixrank
-    params = {"name": name, "social_url": social_url}
-    async with httpx.AsyncClient() as clint:
-        mix_resp = await clint.get(
-            f"https://api.mixrank.com/v2/json/{MIXRANK_API_KEY}/person/match",
-            params=params,
-            timeout=20
-        )
-    if mix_resp.status_code != 200:
+        return await profile_pipeline.run(name, linkedin_url, **hints)
+    except PipelineError as e:
+        if e.stage == "resolve":
+            raise HTTPException(status_code=500, detail="Failed to generate LinkedIn URL, but it's not you–it's us. Please try again!")
         raise HTTPException(status_code=500, detail="Mixrank enrichment failed")
-    summary = await get_quick_summary(mix_resp)
-    return {
-        "summary": summary
-    }
+
+# Stored enrichments: the store is optional, so database trouble only costs us the shortcut
+async def load_stored(linkedin_url: str) -> Optional[dict]:
+    if store is None:
+        return None
+    try:
+        return await asyncio.to_thread(store.fresh_enrichment, linkedin_url)
+    except Exception:
+        logger.exception("stored enrichment lookup failed")
+        return None
+
+async def save_stored(result: ProfileResult) -> None:
+    if store is None or not result.mixrank or "mixrank" in result.partial:
+        return
+    try:
+        written = await asyncio.to_thread(store.save, result.url, result.mixrank, result.summary)
+        logger.info("stored enrichment for %s on %d connections", result.url, written)
+    except Exception:
+        logger.exception("storing enrichment failed")
+
+async def summarize_stored(stored: dict, linkedin_url: str) -> Optional[str]:
+    try:
+        summary = await get_quick_summary(stored["profile"])
+    except Exception:
+        logger.exception("summarising stored enrichment failed")
+        return None
+    if summary:
+        try:
+            await asyncio.to_thread(store.add_summary, linkedin_url, summary)
+        except Exception:
+            logger.exception("storing summary failed")
+    return summary
+
+# Once a user confirms a profile, we can enrich them directly
+@app.post('/api/full_profile')
+@resilience.within(PROFILE_DEADLINE)
+async def full_profile(request: FullProfileRequest):
+    name, summary, url = request.name.strip(), request.summary.strip(), request.url.strip()
+    if not name:
+        raise HTTPException(status_code=400, detail="Name is required")
+    if not summary or not url:
+        raise HTTPException(status_code=400, detail="Summary and URL are required")
+    result = await run_profile_pipeline(name, summary=summary, url=url)
+    return result.to_response()
+
+# Confirmed name + LinkedIn URL -> profile response; shared by /api/confirm_profile and batch jobs
+@resilience.within(PROFILE_DEADLINE)
+async def enrich_confirmed(name: str, linkedin_url: str) -> dict:
+    # A recently stored enrichment of this profile is just a database read
+    stored = await load_stored(linkedin_url)
+    if stored and not stored.get("summary"):
+        # the batch job's: summarise the stored fields, no Mixrank or Exa call needed
+        stored["summary"] = await summarize_stored(stored, linkedin_url)
+    if stored and stored.get("summary"):
+        return {
+            "summary": stored["summary"],
+            "linkedin_url": stored.get("linkedin_url", linkedin_url),
+            "corroborated": False,
+            "partial": [],
+            "stored": True,
+        }
+    result = await run_profile_pipeline(name, linkedin_url)
+    await save_stored(result)
+    return result.to_response()
 
 # If a user gives us their linkedin url, we can enrich them directly
 @app.post('/api/confirm_profile')
@@ -238,24 +598,129 @@ async def confirm_profile(request: ConfirmProfileRequest):
     name, linkedin_url = request.name.strip(), request.linkedin_url.strip()
     if not name or not linkedin_url:
         raise HTTPException(status_code=400, detail="Name and LinkedIn URL are required")
+    return await enrich_confirmed(name, linkedin_url)
 
-    # Enrich via Mixrank
-    params = {"name": name, "social_url": linkedin_url}
-    async with httpx.AsyncClient() as clint:
-        mix_resp = await clint.get(
-            f"https://api.mixrank.com/v2/json/{MIXRANK_API_KEY}/person/match",
-            params=params,
-            timeout=20
-        )
-    if mix_resp.status_code != 200:
-        raise HTTPException(status_code=500, detail="Mixrank enrichment failed")
-    # create a summary of the data with gpt-4o-mini
-    summary = await get_quick_summary(mix_resp)
-    return {
-        "summary": summary
-    }
-    
-        
-        
+# Bulk confirm_profile: items run in the background, bounded by BATCH_CONCURRENCY across all jobs
+batch_jobs = JobManager(
+    enrich_confirmed,
+    concurrency=BATCH_CONCURRENCY,
+    max_jobs=BATCH_MAX_JOBS,
+    ttl=BATCH_JOB_TTL,
+    result_cache=LRUCache(ENRICH_CACHE_ENTRIES, ENRICH_CACHE_TTL),
+)
+metrics.register_collector(metrics.cache_collector("batch_results", batch_jobs.result_cache))
+metrics.register_collector(metrics.cache_collector("batch_inflight", batch_jobs.inflight))
+
+async def ndjson_lines(request: Request):
+    # Lines as they arrive, so items start enriching while the rest of the upload is in flight
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+    if buffer.strip():
+        yield buffer
+
+async def add_batch_item(job: Job, raw) -> None:
+    try:
+        item = ConfirmProfileRequest.model_validate_json(raw) if isinstance(raw, bytes) \
+            else ConfirmProfileRequest.model_validate(raw)
+    except ValidationError:
+        await batch_jobs.add_invalid(job, "Invalid item: expected {\"name\", \"linkedin_url\"}")
+        return
+    name, linkedin_url = item.name.strip(), item.linkedin_url.strip()
+    if not name or not linkedin_url:
+        await batch_jobs.add_invalid(job, "Name and LinkedIn URL are required", name, linkedin_url)
+        return
+    await batch_jobs.add(job, name, linkedin_url)
+
+# Accepts a JSON list of confirm_profile items ({"items": [...]} or a bare list), or an
+# application/x-ndjson upload with one item per line
+@app.post('/api/enrich/batch', status_code=202)
+async def enrich_batch(request: Request):
+    job = batch_jobs.create()
+    try:
+        if request.headers.get("content-type", "").startswith(("application/x-ndjson", "application/jsonl")):
+            async for line in ndjson_lines(request):
+                if len(job.items) >= BATCH_MAX_ITEMS:
+                    raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_ITEMS} items per batch")
+                await add_batch_item(job, line)
+        else:
+            try:
+                body = await request.json()
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Body must be JSON or NDJSON")
+            items = body.get("items") if isinstance(body, dict) else body
+            if not isinstance(items, list) or not items:
+                raise HTTPException(status_code=400, detail="Expected a non-empty list of items")
+            if len(items) > BATCH_MAX_ITEMS:
+                raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_ITEMS} items per batch")
+            for item in items:
+                await add_batch_item(job, item)
+        if not job.items:
+            raise HTTPException(status_code=400, detail="Expected a non-empty list of items")
+    except BaseException:
+        # rejected (or the client went away) before it got a job_id: nothing may keep running
+        batch_jobs.discard(job)
+        raise
+    await job.close_input()
+    summary = job.summary()
+    del summary["results"]
+    return summary
+
+def get_job(job_id: str) -> Job:
+    job = batch_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    return job
+
+# Poll: results completed since `offset` (pass back `next_offset` to page through them)
+@app.get('/api/enrich/batch/{job_id}')
+async def batch_status(job_id: str, offset: int = 0):
+    return get_job(job_id).summary(max(offset, 0))
+
+# Follow: one NDJSON line per result as it completes, closing when the job is done
+@app.get('/api/enrich/batch/{job_id}/results')
+async def batch_results(job_id: str, offset: int = 0):
+    job = get_job(job_id)
+
+    async def lines():
+        async for result in job.follow(max(offset, 0)):
+            yield json.dumps(result) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+# Connections by tag: q is tags joined by AND/OR (e.g. "software engineer AND (meta OR google)"),
+# ranked by how many (and how rare) of the query's tags each connection has
+@app.get('/api/tags/search')
+async def search_tags(q: str, limit: int = 50, offset: int = 0):
+    if not tag_index.index.ready:
+        raise HTTPException(status_code=503, detail="Tag index is still loading")
+    limit, offset = min(max(limit, 1), 500), max(offset, 0)
+    started = time.perf_counter()
+    try:
+        found = tag_index.index.search(q, limit, offset)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    took_ms = round((time.perf_counter() - started) * 1000, 2)
+    metrics.observe("delphi_tag_search_seconds", took_ms / 1000)
+
+    if found["results"]:
+        try:
+            cards = await asyncio.to_thread(store.connection_cards, [r["connection_id"] for r in found["results"]])
+        except Exception:
+            logger.exception("loading tag search results failed")
+            cards = {}
+        for result in found["results"]:
+            result.update(cards.get(result["connection_id"], {}))
+    return {"query": q, "took_ms": took_ms, **found}
+
+# Prometheus scrape target: provider latencies/errors/retries, per-stage timings, cache hit rates,
+# LLM parse stats and token usage
+@app.get('/metrics')
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 # run with uvicorn backend:app --reload
\ No newline at end of file
@@ -0,0 +1,211 @@
+"""
+IP geolocation for /api/enrich.
+
+Lookups go through an LRU+TTL cache keyed on the exact IP and on its /24 (IPv6: /64) prefix,
+since neighbouring addresses almost always geolocate to the same city.  On a miss we either ask
+ip-api.com or, when GEOIP_DB_PATH points at a range table built with `geo.py build`, we
+binary-search a memory-mapped CIDR -> location table in-process.  Build one from the repo root:
+
+    PYTHONPATH=. python backend/geo.py build ranges.csv geoip.bin
+
+    GEO_CACHE_TTL            seconds a lookup is reused (default 1 day)
+    GEO_CACHE_ENTRIES        LRU size
+    GEOIP_DB_PATH            offline range table; enables offline mode
+    GEOIP_ONLINE_FALLBACK    "1" to still ask ip-api for addresses the table doesn't cover
+"""
+import array
+import bisect
+import csv
+import ipaddress
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from typing import Optional
+
+import http_pool
+import metrics
+import ratelimit
+import resilience
+from cache import LRUCache
+
+
+GEO_CACHE_TTL = float(os.getenv("GEO_CACHE_TTL", "86400"))
+GEO_CACHE_ENTRIES = int(os.getenv("GEO_CACHE_ENTRIES", "50000"))
+GEOIP_DB_PATH = os.getenv("GEOIP_DB_PATH")
+GEOIP_ONLINE_FALLBACK = os.getenv("GEOIP_ONLINE_FALLBACK", "").lower() in ("1", "true", "yes")
+IP_API_BASE_URL = os.getenv("IP_API_BASE_URL", "http://ip-api.com").rstrip("/")
+
+UNKNOWN = {"display": "Unknown", "city": ""}
+
+geo_cache = LRUCache(GEO_CACHE_ENTRIES, GEO_CACHE_TTL)
+
+
+def extract_location_info(data: dict):
+    city = data.get('city', '')
+    region = data.get('regionName', '')
+    country = data.get('country', '')
+    display = ", ".join(filter(None, [city, region, country]))
+    return {'display': display or 'Unknown', 'city': city.lower()}
+
+
+def client_ip(request) -> str:
+    """First hop of X-Forwarded-For (the original client), else the peer address."""
+    forwarded = request.headers.get('X-Forwarded-For')
+    if forwarded:
+        return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else ""
+
+
+def is_public_ip(ip: str) -> bool:
+    """Proper CIDR check: private, loopback, link-local, CGNAT, reserved etc. are not routable."""
+    try:
+        return ipaddress.ip_address(ip).is_global
+    except ValueError:
+        return False
+
+
+def _prefix_key(ip: str) -> str:
+    addr = ipaddress.ip_address(ip)
+    prefix = 24 if addr.version == 4 else 64
+    return str(ipaddress.ip_network(f"{addr}/{prefix}", strict=False))
+
+
+class IPRangeDB:
+    """
+    Read-only IPv4 range table, memory-mapped from disk.  Layout (native byte order):
+
+        8s magic | B byteorder | 3x | I count | Q locations_offset
+        count x uint32 range starts (sorted) | count x uint32 range ends | count x uint32 location ids
+        JSON array of location dicts
+
+    A lookup is one bisect over the starts column, i.e. ~20 probes into the page cache.
+    """
+
+    MAGIC = b"DLPHGEO1"
+    HEADER = struct.Struct("=8sB3xIQ")
+
+    def __init__(self, path: str):
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, byteorder, count, locations_offset = self.HEADER.unpack_from(self._mm, 0)
+        if magic != self.MAGIC:
+            raise ValueError(f"{path} is not a geo range table")
+        if byteorder != (1 if sys.byteorder == "little" else 0):
+            raise ValueError(f"{path} was built on a machine with different byte order")
+        view = memoryview(self._mm)
+        column = 4 * count
+        start = self.HEADER.size
+        self._starts = view[start:start + column].cast("I")
+        self._ends = view[start + column:start + 2 * column].cast("I")
+        self._location_ids = view[start + 2 * column:start + 3 * column].cast("I")
+        self._locations = json.loads(bytes(self._mm[locations_offset:]))
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def lookup(self, ip: str) -> Optional[dict]:
+        try:
+            addr = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        if addr.version != 4:
+            return None
+        value = int(addr)
+        i = bisect.bisect_right(self._starts, value) - 1
+        if i < 0 or self._ends[i] < value:
+            return None
+        return self._locations[self._location_ids[i]]
+
+    @classmethod
+    def build(cls, csv_path: str, out_path: str) -> int:
+        """
+        Build a table from a CSV with `network,city,regionName,country` columns (e.g. a MaxMind
+        GeoLite2 City blocks file joined with its locations file).  Returns the range count.
+        """
+        ranges, locations, location_index = [], [], {}
+        with open(csv_path, newline="") as f:
+            for row in csv.DictReader(f):
+                try:
+                    network = ipaddress.ip_network(row["network"].strip(), strict=False)
+                except (KeyError, ValueError):
+                    continue
+                if network.version != 4:
+                    continue
+                location = extract_location_info(row)
+                key = (location["display"], location["city"])
+                if key not in location_index:
+                    location_index[key] = len(locations)
+                    locations.append(location)
+                ranges.append((int(network.network_address), int(network.broadcast_address), location_index[key]))
+        ranges.sort()
+        starts = array.array("I", (r[0] for r in ranges))
+        ends = array.array("I", (r[1] for r in ranges))
+        ids = array.array("I", (r[2] for r in ranges))
+        locations_offset = cls.HEADER.size + 12 * len(ranges)
+        with open(out_path, "wb") as out:
+            out.write(cls.HEADER.pack(cls.MAGIC, 1 if sys.byteorder == "little" else 0, len(ranges), locations_offset))
+            for column in (starts, ends, ids):
+                out.write(column.tobytes())
+            out.write(json.dumps(locations).encode())
+        return len(ranges)
+
+
+offline_db = IPRangeDB(GEOIP_DB_PATH) if GEOIP_DB_PATH else None
+
+
+async def _lookup_ip_api(ip: str) -> Optional[dict]:
+    # Geolocation is optional: rather than queue behind ip-api's quota, skip it
+    # (or behind a circuit breaker that has seen it failing)
+    breaker = resilience.breaker("ip-api")
+    if breaker.allow():
+        return None
+    bucket = ratelimit.limiter("ip-api")
+    if not bucket.try_acquire():
+        breaker.record(None, 0.0)
+        return None
+    started = time.perf_counter()
+    failed = None
+    try:
+        with metrics.timed("delphi_provider_request_seconds", provider="ip-api"):
+            resp = await http_pool.async_client().get(
+                f"{IP_API_BASE_URL}/json/{ip}?fields=status,city,regionName,country", timeout=5
+            )
+        throttled, retry_after = ratelimit.throttle_signal(resp)
+        if throttled:
+            bucket.penalize(ratelimit.backoff_delay(0, retry_after))
+        failed = None if throttled else resp.status_code >= 500
+        data = resp.json()
+        if data.get("status") == "success":
+            return extract_location_info(data)
+    except Exception:
+        failed = True
+    finally:
+        breaker.record(failed, time.perf_counter() - started)
+    return None
+
+
+async def get_ip_location(ip: str) -> dict:
+    if not is_public_ip(ip):
+        return UNKNOWN
+    prefix = _prefix_key(ip)
+    location = geo_cache.get(ip) or geo_cache.get(prefix)
+    if location is not None:
+        return location
+    if offline_db is not None:
+        location = offline_db.lookup(ip)
+    if location is None and (offline_db is None or GEOIP_ONLINE_FALLBACK):
+        location = await _lookup_ip_api(ip)
+    if location is None:
+        return UNKNOWN
+    geo_cache.set(ip, location)
+    geo_cache.set(prefix, location)
+    return location
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] != "build":
+        sys.exit("usage: PYTHONPATH=. python backend/geo.py build <ranges.csv> <out.bin>")
+    print(f"Wrote {IPRangeDB.build(sys.argv[2], sys.argv[3])} ranges to {sys.argv[3]}")
@@ -0,0 +1,152 @@
+"""
+Background jobs for /api/enrich/batch.
+
+A job is a list of (name, LinkedIn URL) items that can keep growing while an NDJSON upload is
+still streaming in; each item starts as soon as it is added.  Items for the same person
+(normalized name + canonical URL) are run once per job and the result is fanned out to every
+index that asked for it.  Successful results go into a cache shared by all jobs, and concurrent
+jobs asking for the same person share one in-flight call, so a re-upload of yesterday's CSV
+costs nothing.  One semaphore bounds how many items run at once across all jobs, so a big upload
+can't starve the interactive endpoints of provider quota.
+
+Jobs are kept in an LRU with a TTL; results are polled with an offset or followed as a stream.
+"""
+import asyncio
+import logging
+import time
+import uuid
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from fastapi import HTTPException
+
+from cache import LRUCache, SingleFlight
+from normalize import normalize_linkedin_url, normalize_name
+
+
+logger = logging.getLogger("delphi.jobs")
+
+
+class Job:
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.created_at = time.time()
+        self.items: List[dict] = []
+        self.results: List[dict] = []
+        self.input_closed = False
+        self._waiting: Dict[tuple, List[int]] = {}   # person key -> indexes still waiting on it
+        self._tasks = set()
+        self._changed = asyncio.Condition()
+
+    @property
+    def done(self) -> bool:
+        return self.input_closed and len(self.results) == len(self.items)
+
+    def summary(self, offset: int = 0) -> dict:
+        return {
+            "job_id": self.id,
+            "status": "done" if self.done else "running",
+            "total": len(self.items),
+            "unique": len({item["key"] for item in self.items if item["key"]}),
+            "completed": len(self.results),
+            "failed": sum(1 for r in self.results if r["status"] == "error"),
+            "results": self.results[offset:],
+            "next_offset": len(self.results),
+        }
+
+    async def _notify(self) -> None:
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def record(self, index: int, result: dict) -> None:
+        item = self.items[index]
+        self.results.append({"index": index, "name": item["name"], "linkedin_url": item["linkedin_url"], **result})
+        await self._notify()
+
+    async def close_input(self) -> None:
+        self.input_closed = True
+        await self._notify()
+
+    async def follow(self, offset: int = 0) -> AsyncIterator[dict]:
+        """Results from `offset` on, as they complete, until the job is done."""
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: len(self.results) > offset or self.done)
+                batch, finished = self.results[offset:], self.done
+            offset += len(batch)
+            for result in batch:
+                yield result
+            if finished and offset >= len(self.results):
+                return
+
+
+class JobManager:
+    """`process(name, linkedin_url)` does the work for one person and returns its result dict."""
+
+    def __init__(self, process: Callable[[str, str], Awaitable[dict]], concurrency: int,
+                 max_jobs: int, ttl: float, result_cache: LRUCache):
+        self.process = process
+        self.concurrency = concurrency
+        self.jobs = LRUCache(max_jobs, ttl)
+        self.result_cache = result_cache
+        self.inflight = SingleFlight()
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def create(self) -> Job:
+        job = Job()
+        self.jobs.set(job.id, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def discard(self, job: Job) -> None:
+        """Drop a job the client never got an ID for, cancelling whatever it had started."""
+        self.jobs.delete(job.id)
+        for task in list(job._tasks):
+            task.cancel()
+
+    async def add(self, job: Job, name: str, linkedin_url: str) -> None:
+        index = len(job.items)
+        key = (normalize_name(name), normalize_linkedin_url(linkedin_url))
+        job.items.append({"name": name, "linkedin_url": linkedin_url, "key": key})
+        cached = self.result_cache.get(key)
+        if cached is not None:
+            await job.record(index, {"status": "ok", "cached": True, **cached})
+            return
+        if key in job._waiting:
+            job._waiting[key].append(index)   # duplicate within this batch: share the first one's result
+            return
+        job._waiting[key] = [index]
+        task = asyncio.create_task(self._run(job, key, name, linkedin_url))
+        job._tasks.add(task)
+        task.add_done_callback(job._tasks.discard)
+
+    async def add_invalid(self, job: Job, detail: str, name: Optional[str] = None,
+                          linkedin_url: Optional[str] = None) -> None:
+        """Keep a slot for an item we couldn't parse, so indexes still line up with the upload."""
+        index = len(job.items)
+        job.items.append({"name": name, "linkedin_url": linkedin_url, "key": None})
+        await job.record(index, {"status": "error", "detail": detail})
+
+    async def _process_cached(self, key: tuple, name: str, linkedin_url: str) -> dict:
+        cached = self.result_cache.get(key)
+        if cached is not None:
+            return cached
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        async with self._slots:
+            value = await self.process(name, linkedin_url)
+        self.result_cache.set(key, value)
+        return value
+
+    async def _run(self, job: Job, key: tuple, name: str, linkedin_url: str) -> None:
+        try:
+            # jobs running at the same time share one call per person
+            result = {"status": "ok", **await self.inflight.do(key, self._process_cached, key, name, linkedin_url)}
+        except HTTPException as e:
+            result = {"status": "error", "detail": e.detail}
+        except Exception:
+            logger.exception("batch item failed", extra={"job_id": job.id})
+            result = {"status": "error", "detail": "Enrichment failed"}
+        for index in job._waiting.pop(key, []):
+            await job.record(index, result)
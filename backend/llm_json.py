@@ -0,0 +1,170 @@
+"""
+Helpers for getting JSON out of LLM completions.
+"""
+import json
+import re
+from typing import List, Type
+
+from pydantic import BaseModel, ValidationError
+
+import metrics
+import ratelimit
+
+
+class JSONArrayStreamParser:
+    """
+    Incrementally pulls complete objects out of a JSON array while the completion is still
+    streaming, so callers can act on the first element long before the last token arrives.
+
+    Every object that is a direct element of an array is emitted once its closing brace has
+    been seen, wherever that array sits (a bare `[...]`, `{"candidates": [...]}`, inside a code
+    fence).  Text outside of JSON containers is ignored.  Objects that still fail to parse are
+    counted in `failures` and skipped.
+    """
+
+    def __init__(self):
+        self._stack = []          # open containers: "[" or "{"
+        self._in_string = False
+        self._escape = False
+        self._current = None      # chars of the array element being collected
+        self._element_depth = 0   # stack depth at which that element started
+        self.failures = 0
+
+    def feed(self, chunk: str) -> List[dict]:
+        objects = []
+        for ch in chunk:
+            if self._current is not None:
+                self._current.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            if not self._stack and ch not in "[{":
+                continue
+            if ch == '"':
+                self._in_string = True
+            elif ch in "[{":
+                if ch == "{" and self._current is None and self._stack and self._stack[-1] == "[":
+                    self._current = [ch]
+                    self._element_depth = len(self._stack)
+                self._stack.append(ch)
+            elif ch in "]}":
+                if self._stack:
+                    self._stack.pop()
+                if self._current is not None and len(self._stack) == self._element_depth:
+                    text, self._current = "".join(self._current), None
+                    try:
+                        value = json.loads(text)
+                    except json.JSONDecodeError:
+                        self.failures += 1
+                        continue
+                    if isinstance(value, dict):
+                        objects.append(value)
+        return objects
+
+
+# ---------------------------------------------------------------------- #
+# Structured (JSON-mode) completions validated against Pydantic models
+# ---------------------------------------------------------------------- #
+_FENCE = re.compile(r"```(?:json)?\s*(.*?)```", re.S)
+_TRAILING_COMMA = re.compile(r",\s*([\]}])")
+
+# parse outcomes across every structured completion in this process
+stats = {"calls": 0, "parse_failures": 0, "repaired": 0, "repair_failures": 0}
+
+
+def parse_failure_rate() -> float:
+    return stats["parse_failures"] / stats["calls"] if stats["calls"] else 0.0
+
+
+def record_usage(model: str, resp) -> None:
+    """Token counts from an OpenAI completion's `usage`, when it has one."""
+    usage = getattr(resp, "usage", None)
+    if usage is not None:
+        metrics.record_tokens("openai", model, usage.prompt_tokens or 0, usage.completion_tokens or 0)
+
+
+def extract_json(text: str):
+    """
+    json.loads with the cheap local repairs for the usual formatting glitches: code fences,
+    prose around the JSON and trailing commas.  Raises ValueError if nothing parses.
+    """
+    text = (text or "").strip()
+    fenced = _FENCE.search(text)
+    if fenced:
+        text = fenced.group(1).strip()
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+    if not starts:
+        raise ValueError("no JSON found in completion")
+    start = min(starts)
+    end = text.rfind("}" if text[start] == "{" else "]")
+    candidate = _TRAILING_COMMA.sub(r"\1", text[start:end + 1])
+    try:
+        return json.loads(candidate)
+    except json.JSONDecodeError as exc:
+        raise ValueError(f"invalid JSON in completion: {exc}") from exc
+
+
+def parse_model(text: str, schema: Type[BaseModel]) -> BaseModel:
+    data = extract_json(text)
+    fields = list(schema.model_fields)
+    # a bare array for a single-list envelope (e.g. {"candidates": [...]}) is unambiguous
+    if isinstance(data, list) and len(fields) == 1:
+        data = {fields[0]: data}
+    return schema.model_validate(data)
+
+
+async def complete_structured(client, schema: Type[BaseModel], messages: List[dict],
+                              model: str = "gpt-4o-mini", json_mode: bool = True, **kwargs) -> BaseModel:
+    """
+    Run a chat completion and validate its output against `schema`.  When the output doesn't
+    parse or validate, only the broken output and the validation error go back to gpt-4o-mini in
+    JSON mode for a repair, instead of re-running the whole (much larger) original prompt.
+    """
+    if json_mode:
+        kwargs["response_format"] = {"type": "json_object"}
+    resp = await ratelimit.call_async(
+        "openai", client.chat.completions.create, model=model, messages=messages, **kwargs
+    )
+    record_usage(model, resp)
+    raw = resp.choices[0].message.content or ""
+    stats["calls"] += 1
+    try:
+        return parse_model(raw, schema)
+    except (ValueError, ValidationError) as exc:
+        stats["parse_failures"] += 1
+        error = str(exc)
+
+    repair = await ratelimit.call_async(
+        "openai",
+        client.chat.completions.create,
+        model="gpt-4o-mini",
+        response_format={"type": "json_object"},
+        messages=[
+            {
+                "role": "system",
+                "content": (
+                    "Rewrite the given output as a JSON object matching this JSON schema. "
+                    "Keep the content, only fix the structure. Return only the JSON.\n"
+                    f"{json.dumps(schema.model_json_schema())}"
+                ),
+            },
+            {"role": "user", "content": f"Output:\n{raw}\n\nError:\n{error}"},
+        ],
+    )
+    record_usage("gpt-4o-mini", repair)
+    try:
+        result = parse_model(repair.choices[0].message.content or "", schema)
+    except (ValueError, ValidationError):
+        stats["repair_failures"] += 1
+        raise
+    stats["repaired"] += 1
+    return result
@@ -0,0 +1,138 @@
+"""
+The profile enrichment pipeline behind /api/full_profile and /api/confirm_profile.
+
+    resolve      the LinkedIn URL: given by the caller, or guessed by the search model
+    mixrank      /linkedin/profile through the client shared with the batch enricher, while an
+                 Exa search for the name runs alongside it to corroborate the URL
+    summary      gpt-4o-mini over the compacted profile (or the corroborating Exa results when
+                 Mixrank came back empty)
+
+Every stage runs under its own timeout, cut short by the request's deadline (resilience.deadline);
+every stage but the summary leaves PIPELINE_SUMMARY_RESERVE seconds of that budget for it.
+Resolution is required; past that, a stage that times out or fails is listed in
+`ProfileResult.partial` and the pipeline answers with what it has.
+
+    PIPELINE_RESOLVE_TIMEOUT      seconds (default 45, the search model is slow)
+    PIPELINE_MIXRANK_TIMEOUT      seconds (default 25)
+    PIPELINE_CORROBORATE_TIMEOUT  seconds (default 10)
+    PIPELINE_SUMMARY_TIMEOUT      seconds (default 20)
+    PIPELINE_SUMMARY_RESERVE      seconds of the request budget kept for the summary (default 5)
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, List, Optional
+
+import metrics
+import mixrank
+import resilience
+from normalize import normalize_linkedin_url
+
+
+STAGE_TIMEOUTS = {
+    "resolve": float(os.getenv("PIPELINE_RESOLVE_TIMEOUT", "45")),
+    "mixrank": float(os.getenv("PIPELINE_MIXRANK_TIMEOUT", "25")),
+    "corroborate": float(os.getenv("PIPELINE_CORROBORATE_TIMEOUT", "10")),
+    "summary": float(os.getenv("PIPELINE_SUMMARY_TIMEOUT", "20")),
+}
+PIPELINE_SUMMARY_RESERVE = float(os.getenv("PIPELINE_SUMMARY_RESERVE", "5"))
+
+logger = logging.getLogger("delphi.pipeline")
+
+
+class PipelineError(Exception):
+    def __init__(self, stage: str, detail: str):
+        super().__init__(f"{stage}: {detail}")
+        self.stage = stage
+        self.detail = detail
+
+
+class ProfileResult:
+    def __init__(self):
+        self.url: Optional[str] = None
+        self.mixrank: dict = {}
+        self.corroboration: List[dict] = []
+        self.summary: Optional[str] = None
+        self.partial: List[str] = []
+        self.timings: dict = {}
+
+    @property
+    def corroborated(self) -> bool:
+        return bool(self.corroboration)
+
+    def to_response(self) -> dict:
+        return {
+            "summary": self.summary,
+            "linkedin_url": self.url,
+            "corroborated": self.corroborated,
+            "partial": self.partial,
+        }
+
+
+def _fallback_summary(result: ProfileResult) -> str:
+    # Used when the summary stage didn't finish: the headline is better than nothing
+    profile = result.mixrank
+    parts = [profile.get("name") or profile.get("full_name"), profile.get("headline"), profile.get("locality")]
+    if not any(parts) and result.corroboration:
+        parts = [result.corroboration[0].get("title")]
+    return " — ".join(p for p in parts if p)
+
+
+class ProfilePipeline:
+    """
+    `resolve_url(name, **hints)` guesses a LinkedIn URL, `search(name)` returns Exa results and
+    `summarize(mixrank_data, exa_results)` writes the summary; the API wires in its own.
+    """
+
+    def __init__(self, resolve_url: Callable[..., Awaitable[str]], search: Callable[[str], Awaitable[list]],
+                 summarize: Callable[[dict, Optional[list]], Awaitable[str]], timeouts: Optional[dict] = None):
+        self.resolve_url = resolve_url
+        self.search = search
+        self.summarize = summarize
+        self.timeouts = {**STAGE_TIMEOUTS, **(timeouts or {})}
+
+    async def _stage(self, result: ProfileResult, stage: str, coro, required: bool = False):
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            reserve = 0.0 if stage == "summary" else PIPELINE_SUMMARY_RESERVE
+            return await asyncio.wait_for(coro, resilience.stage_timeout(self.timeouts[stage], reserve))
+        except Exception as exc:
+            outcome = "timeout" if isinstance(exc, asyncio.TimeoutError) else "error"
+            detail = "timed out" if isinstance(exc, asyncio.TimeoutError) else str(exc) or type(exc).__name__
+            if required:
+                raise PipelineError(stage, detail) from exc
+            logger.warning("profile pipeline: %s stage skipped (%s)", stage, detail)
+            result.partial.append(stage)
+            return None
+        finally:
+            elapsed = time.perf_counter() - started
+            result.timings[stage] = round(elapsed * 1000, 1)
+            metrics.observe("delphi_stage_seconds", elapsed, endpoint="profile", stage=stage, outcome=outcome)
+
+    async def run(self, name: str, linkedin_url: Optional[str] = None, **hints) -> ProfileResult:
+        result = ProfileResult()
+        if not linkedin_url:
+            linkedin_url = await self._stage(result, "resolve", self.resolve_url(name, **hints), required=True)
+        result.url = linkedin_url.strip()
+
+        mixrank_data, search_results = await asyncio.gather(
+            self._stage(result, "mixrank", mixrank.fetch_profile_async(result.url)),
+            self._stage(result, "corroborate", self.search(name)),
+        )
+        result.mixrank = mixrank_data or {}
+        # only results for this exact profile corroborate it; the rest are other people
+        canonical = normalize_linkedin_url(result.url)
+        result.corroboration = [
+            r for r in search_results or [] if r.get("url") and normalize_linkedin_url(r["url"]) == canonical
+        ]
+        if not result.mixrank and not result.corroboration:
+            raise PipelineError("mixrank", "no profile data")
+
+        summary = await self._stage(
+            result, "summary", self.summarize(result.mixrank, None if result.mixrank else result.corroboration)
+        )
+        result.summary = summary or _fallback_summary(result)
+        logger.info("profile pipeline: %s partial=%s timings_ms=%s", result.url, result.partial, result.timings)
+        return result
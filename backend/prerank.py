@@ -0,0 +1,145 @@
+"""
+Local pre-ranking of Exa results before the /api/enrich LLM call.
+
+Raw results are canonicalised (scheme, host, trailing slash and locale of LinkedIn URLs) and
+duplicates are clustered: the same profile URL, or a non-profile page whose title names the same
+person at the same company as the cluster.  Two different LinkedIn profiles are never merged, even
+when their slugs only differ in LinkedIn's namesake suffix ("john-smith-1a2b3c" vs
+"john-smith-98765"): those are different people.  Each cluster is scored on how well it matches
+the query name and the caller's geolocated city.  Only the top clusters go to the LLM, and
+when one cluster clearly wins the LLM is skipped altogether.
+
+    PRERANK_MAX_CLUSTERS    clusters forwarded to the LLM
+    PRERANK_SKIP_SCORE      minimum top score (0-1) to answer without the LLM
+    PRERANK_SKIP_MARGIN     ...and its lead over the runner-up
+"""
+import os
+import re
+from difflib import SequenceMatcher
+from typing import List, Optional
+
+from normalize import normalize_linkedin_url, normalize_name
+
+
+PRERANK_MAX_CLUSTERS = int(os.getenv("PRERANK_MAX_CLUSTERS", "6"))
+PRERANK_SKIP_SCORE = float(os.getenv("PRERANK_SKIP_SCORE", "0.9"))
+PRERANK_SKIP_MARGIN = float(os.getenv("PRERANK_SKIP_MARGIN", "0.4"))
+TITLE_SIMILARITY = 0.9
+
+_TITLE_SITE = re.compile(r"\s*[|\-–]\s*linkedin\s*$", re.I)
+# "Jane Doe - Staff Engineer - Acme", "Jane Doe | Acme", "Jane Doe, CTO at Acme"
+_TITLE_PARTS = re.compile(r"\s+[-–|@]\s+|\s+at\s+|,\s+", re.I)
+
+
+def slug_key(url: str) -> str:
+    """The profile slug of a LinkedIn URL, suffix and all ("" for other pages)."""
+    canonical = normalize_linkedin_url(url)
+    return canonical.rsplit("/", 1)[-1] if is_profile(canonical) else ""
+
+
+def is_profile(canonical_url: str) -> bool:
+    return canonical_url.startswith(("https://www.linkedin.com/in/", "https://www.linkedin.com/pub/"))
+
+
+def clean_title(title: str) -> str:
+    return _TITLE_SITE.sub("", (title or "").strip())
+
+
+def title_company(title: str) -> str:
+    """The organisation a result title puts the person at (its last part), or ""."""
+    parts = _TITLE_PARTS.split(clean_title(title))
+    return normalize_name(parts[-1]) if len(parts) > 1 else ""
+
+
+class Cluster:
+    def __init__(self, result: dict):
+        self.results = [result]
+        self.url = normalize_linkedin_url(result.get("url", ""))
+        self.slug = slug_key(result.get("url", ""))
+        self.title = clean_title(result.get("title"))
+        self.company = title_company(self.title)
+        self.score = self.name_score = self.location_score = 0.0
+
+    def matches(self, result: dict) -> bool:
+        url = normalize_linkedin_url(result.get("url", ""))
+        if url == self.url:
+            return True
+        if is_profile(url) and is_profile(self.url):
+            return False   # two profiles are two people, however alike their names and slugs
+        # a page about someone (not their profile) joins them only when it names the same company
+        title = clean_title(result.get("title"))
+        if not self.company or title_company(title) != self.company:
+            return False
+        return SequenceMatcher(None, normalize_name(title), normalize_name(self.title)).ratio() >= TITLE_SIMILARITY
+
+    @property
+    def highlights(self) -> List[str]:
+        seen = []
+        for r in self.results:
+            for h in r.get("highlights") or []:
+                if h and h not in seen:
+                    seen.append(h)
+        return seen
+
+    def text(self) -> str:
+        parts = [self.title, self.slug.replace("-", " ")]
+        for r in self.results:
+            parts.extend([r.get("title") or "", r.get("text") or ""])
+        return " ".join(parts + self.highlights)
+
+    def representative(self) -> dict:
+        """One merged result for the LLM prompt."""
+        return {"title": self.title, "url": self.url, "highlights": self.highlights[:3]}
+
+    def as_candidate(self) -> dict:
+        highlight = self.highlights[0].strip() if self.highlights else ""
+        summary = f"{self.title} — {highlight[:160]}" if highlight else self.title
+        return {"summary": summary, "url": self.url, "score": round(self.score * 10, 1)}
+
+
+def cluster_results(results: List[dict]) -> List[Cluster]:
+    clusters: List[Cluster] = []
+    for r in results:
+        if not r.get("url"):
+            continue
+        for cluster in clusters:
+            if cluster.matches(r):
+                cluster.results.append(r)
+                break
+        else:
+            clusters.append(Cluster(r))
+    return clusters
+
+
+def name_score(query_name: str, text: str) -> float:
+    """Share of the query's name tokens present, with full credit only for the exact phrase."""
+    query = normalize_name(query_name)
+    haystack = f" {normalize_name(text)} "
+    tokens = query.split()
+    if not tokens:
+        return 0.0
+    found = sum(1 for t in tokens if f" {t} " in haystack)
+    score = found / len(tokens)
+    return score if f" {query} " in haystack else score * 0.8
+
+
+def prerank(results: List[dict], query_name: str, city: str = "") -> List[Cluster]:
+    """Cluster the raw results and sort clusters by name (and, if known, location) match."""
+    city = normalize_name(city)
+    clusters = cluster_results(results)
+    for cluster in clusters:
+        text = cluster.text()
+        cluster.name_score = name_score(query_name, text)
+        cluster.location_score = 1.0 if city and f" {city} " in f" {normalize_name(text)} " else 0.0
+        cluster.score = 0.7 * cluster.name_score + 0.3 * cluster.location_score if city else cluster.name_score
+    clusters.sort(key=lambda c: c.score, reverse=True)
+    return clusters
+
+
+def clear_winner(clusters: List[Cluster]) -> Optional[Cluster]:
+    """The top cluster when it is good enough, and far enough ahead, to skip the LLM."""
+    if not clusters or clusters[0].score < PRERANK_SKIP_SCORE:
+        return None
+    if len(clusters) > 1 and clusters[0].score - clusters[1].score < PRERANK_SKIP_MARGIN:
+        return None
+    return clusters[0]
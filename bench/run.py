@@ -0,0 +1,244 @@
+"""
+Offline benchmarks against the provider stand-ins in bench/stubs.py.
+
+    api     drives /api/enrich, /api/confirm_profile and /api/full_profile in-process (ASGI) at a
+            fixed concurrency
+    batch   seeds connections into a scratch database and times `_enrich_connections` over them
+
+Both report throughput, p50/p95/p99 latency, peak traced memory and the top allocation sites
+(tracemalloc), followed by the metrics summary (per-provider and per-stage timings).  Each run
+gets its own Mixrank cache file and rate limits high enough not to be the bottleneck, unless set
+in the environment.  From the repo root:
+
+    python bench/run.py api --requests 500 --concurrency 50 --latency openai=800:200 --errors exa=0.05
+    PYTHONPATH=/path/to/flask/project python bench/run.py batch \\
+        --database-url postgresql://localhost/delphi_bench --connections 200 --workers 8
+
+`batch` needs the Flask app and models (`app.create_app`, `app.models.*`) importable and a
+database you don't mind writing to: it only touches the rows it seeds, but `_enrich_connections`
+claims any pending connection it finds.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from stubs import StubServer, add_behaviour_args, create_stub_app, parse_behaviours, provider_env  # noqa: E402
+
+
+FIRST_NAMES = ["Ada", "Grace", "Alan", "Edsger", "Barbara", "Donald", "Frances", "Ken", "Radia", "Leslie"]
+LAST_NAMES = ["Lovelace", "Hopper", "Turing", "Dijkstra", "Liskov", "Knuth", "Allen", "Thompson", "Perlman", "Lamport"]
+
+
+def _names(count: int) -> List[str]:
+    return [f"{FIRST_NAMES[i % 10]} {LAST_NAMES[(i // 10) % 10]}" + (f" {i // 100}" if i >= 100 else "")
+            for i in range(count)]
+
+
+def _slug(name: str) -> str:
+    return "-".join(name.lower().split())
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _report(title: str, latencies: List[float], elapsed: float, errors: Dict[str, int]) -> None:
+    print(f"\n== {title} ==")
+    print(f"requests     {len(latencies)}  ({sum(errors.values())} failed: {dict(errors) or '-'})")
+    print(f"throughput   {len(latencies) / elapsed:.1f}/s over {elapsed:.2f}s")
+    print("latency ms   " + "  ".join(
+        f"p{int(q * 100)}={_percentile(latencies, q) * 1000:.1f}" for q in (0.5, 0.95, 0.99)
+    ) + f"  max={max(latencies, default=0) * 1000:.1f}")
+
+
+def _report_allocations(snapshot: "tracemalloc.Snapshot", peak: int, top: int) -> None:
+    print(f"\n== allocations ==\npeak traced   {peak / 1024 / 1024:.1f} MiB")
+    ours = snapshot.filter_traces([tracemalloc.Filter(True, os.path.join(REPO_ROOT, "*"))])
+    for stat in ours.statistics("lineno")[:top]:
+        frame = stat.traceback[0]
+        print(f"  {stat.size / 1024:8.1f} KiB  {stat.count:6d} blocks  "
+              f"{os.path.relpath(frame.filename, REPO_ROOT)}:{frame.lineno}")
+
+
+def _configure_env(base_url: str, args) -> None:
+    os.environ.update(provider_env(base_url))
+    os.environ.setdefault("MIXRANK_CACHE_PATH", os.path.join(tempfile.mkdtemp(prefix="delphi-bench-"), "mixrank.sqlite3"))
+    for provider in ("MIXRANK", "EXA", "OPENAI", "GEMINI", "IP_API"):
+        os.environ.setdefault(f"RATE_LIMIT_{provider}_RPS", "10000")
+        os.environ.setdefault(f"RATE_LIMIT_{provider}_BURST", "10000")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+
+# ---------------------------------------------------------------------- #
+# API
+# ---------------------------------------------------------------------- #
+async def _drive(client, make_request, total: int, concurrency: int):
+    latencies, errors = [], {}
+    queue = asyncio.Queue()
+    for i in range(total):
+        queue.put_nowait(i)
+
+    async def worker():
+        while True:
+            try:
+                i = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            method, path, body, headers = make_request(i)
+            started = time.perf_counter()
+            try:
+                resp = await client.request(method, path, json=body, headers=headers)
+                if resp.status_code >= 400:
+                    errors[str(resp.status_code)] = errors.get(str(resp.status_code), 0) + 1
+            except Exception as exc:
+                errors[type(exc).__name__] = errors.get(type(exc).__name__, 0) + 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - started, errors
+
+
+async def _bench_api(args) -> None:
+    import httpx
+
+    sys.path.insert(0, os.path.join(REPO_ROOT, "backend"))
+    import http_pool
+    import metrics
+    from app import app
+
+    names = _names(args.names)
+
+    def client_ip(i):
+        return f"203.0.{(i // 250) % 250}.{i % 250 + 1}"
+
+    requests = {
+        "enrich": lambda i: (
+            "POST", "/api/enrich", {"name": names[i % len(names)]}, {"X-Forwarded-For": client_ip(i)},
+        ),
+        "confirm_profile": lambda i: (
+            "POST", "/api/confirm_profile",
+            {"name": names[i % len(names)], "linkedin_url": f"https://www.linkedin.com/in/{_slug(names[i % len(names)])}"},
+            {},
+        ),
+        "full_profile": lambda i: (
+            "POST", "/api/full_profile",
+            {"name": names[i % len(names)], "summary": "Senior software engineer at Northwind Labs",
+             "url": f"https://www.linkedin.com/in/{_slug(names[i % len(names)])}"},
+            {},
+        ),
+    }
+
+    await http_pool.open_async_client()
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            for endpoint in args.endpoints:
+                metrics.reset()
+                tracemalloc.start(args.traceback_frames)
+                latencies, elapsed, errors = await _drive(client, requests[endpoint], args.requests, args.concurrency)
+                snapshot = tracemalloc.take_snapshot()
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                _report(f"/api/{endpoint} x{args.requests} @ {args.concurrency}", latencies, elapsed, errors)
+                _report_allocations(snapshot, peak, args.top_allocations)
+                print("\n" + metrics.summary_table())
+    finally:
+        await http_pool.close_async_client()
+
+
+# ---------------------------------------------------------------------- #
+# Batch enrichment
+# ---------------------------------------------------------------------- #
+def _bench_batch(args) -> None:
+    os.environ["DATABASE_URL"] = args.database_url
+    from app import create_app
+    from app.database import db
+    from app.models.connection import Connection
+    from app.models.enrichment import Enrichment
+
+    import metrics
+    from enrichment import _enrich_connections
+
+    flask_app = create_app()
+    run_id = f"{int(time.time())}-{random.getrandbits(16):04x}"
+    with flask_app.app_context():
+        seeded = [
+            Connection(full_name=name, profile_url=f"https://www.linkedin.com/in/bench-{run_id}-{_slug(name)}")
+            for name in _names(args.connections)
+        ]
+        db.session.add_all(seeded)
+        db.session.commit()
+        ids = [c.id for c in seeded]
+        try:
+            metrics.reset()
+            tracemalloc.start(args.traceback_frames)
+            started = time.perf_counter()
+            _enrich_connections(workers=args.workers)
+            elapsed = time.perf_counter() - started
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            per_connection = metrics.snapshot()["latency_ms"]
+            enriched = Connection.query.filter(Connection.id.in_(ids), Connection.latest_enrichment.has_key("version")).count()
+            print(f"\n== _enrich_connections: {args.connections} connections, {args.workers} workers ==")
+            print(f"enriched     {enriched}/{len(ids)}")
+            print(f"throughput   {enriched / elapsed:.2f} connections/s over {elapsed:.2f}s")
+            for series, stats in per_connection.items():
+                if series.startswith("delphi_connection_seconds"):
+                    print(f"{series}  p50={stats['p50']}  p95={stats['p95']}  p99={stats['p99']} ms (bucket estimates)")
+            _report_allocations(snapshot, peak, args.top_allocations)
+            print("\n" + metrics.summary_table())
+        finally:
+            Enrichment.query.filter(Enrichment.connection_id.in_(ids)).delete(synchronize_session=False)
+            Connection.query.filter(Connection.id.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Offline Delphi benchmarks")
+    parser.add_argument("--top-allocations", type=int, default=10)
+    parser.add_argument("--traceback-frames", type=int, default=1)
+    sub = parser.add_subparsers(dest="mode", required=True)
+
+    api = sub.add_parser("api", help="benchmark the FastAPI endpoints")
+    api.add_argument("--requests", type=int, default=200, help="requests per endpoint")
+    api.add_argument("--concurrency", type=int, default=20)
+    api.add_argument("--names", type=int, default=50, help="distinct people (smaller = more cache hits)")
+    api.add_argument("--endpoints", type=lambda s: s.split(","), default=["enrich", "confirm_profile", "full_profile"])
+    add_behaviour_args(api)
+
+    batch = sub.add_parser("batch", help="benchmark _enrich_connections")
+    batch.add_argument("--database-url", required=True, help="scratch database (the Flask app's schema)")
+    batch.add_argument("--connections", type=int, default=100)
+    batch.add_argument("--workers", type=int, default=8)
+    add_behaviour_args(batch)
+
+    args = parser.parse_args(argv)
+    stub_app = create_stub_app(parse_behaviours(args.latency, args.errors, args.throttle), args.fixtures)
+    with StubServer(stub_app) as stubs:
+        _configure_env(stubs.base_url, args)
+        if args.mode == "api":
+            asyncio.run(_bench_api(args))
+        else:
+            _bench_batch(args)
+        print(f"\nstub requests: {stub_app.state.requests}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+"""
+Local stand-ins for every provider, for offline benchmarks.
+
+One FastAPI app serves all of them under path prefixes, replaying the recorded payloads in
+bench/fixtures (names and URLs are templated from the request) after a configurable latency,
+and failing a configurable share of requests with a 500 or a throttling 429 + Retry-After:
+
+    /mixrank/{key}/linkedin/profile                 MIXRANK_BASE_URL=<base>/mixrank
+    /exa/search                                     EXA_BASE_URL=<base>/exa
+    /openai/v1/chat/completions   (incl. stream)    OPENAI_BASE_URL=<base>/openai/v1
+    /gemini/v1beta/models/{model}:generateContent   GEMINI_API_ENDPOINT=<base>/gemini
+    /ip-api/json/{ip}                               IP_API_BASE_URL=<base>/ip-api
+
+`provider_env(base_url)` returns exactly those variables.  Run standalone to point a dev server
+at the stubs:
+
+    python bench/stubs.py --port 8900 --latency openai=800:200 --errors exa=0.05 --throttle mixrank=0.02
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import threading
+import time
+from typing import Dict, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+PROVIDERS = ("mixrank", "exa", "openai", "gemini", "ip-api")
+
+# Rough production medians (ms, jitter ms); override per run
+DEFAULT_LATENCY = {
+    "mixrank": (900, 300),
+    "exa": (450, 150),
+    "openai": (1200, 400),
+    "gemini": (1500, 500),
+    "ip-api": (60, 20),
+}
+
+
+class ProviderBehaviour:
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0, error_rate: float = 0, throttle_rate: float = 0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+
+    async def delay(self) -> None:
+        seconds = max(0.0, random.gauss(self.latency_ms, self.jitter_ms)) / 1000
+        if seconds:
+            await asyncio.sleep(seconds)
+
+    def failure(self) -> Optional[JSONResponse]:
+        roll = random.random()
+        if roll < self.throttle_rate:
+            return JSONResponse({"error": "rate limited"}, status_code=429, headers={"Retry-After": "1"})
+        if roll < self.throttle_rate + self.error_rate:
+            return JSONResponse({"error": "injected failure"}, status_code=500)
+        return None
+
+
+def default_behaviours() -> Dict[str, ProviderBehaviour]:
+    return {p: ProviderBehaviour(*DEFAULT_LATENCY[p]) for p in PROVIDERS}
+
+
+def _load(fixtures_dir: str, name: str) -> str:
+    with open(os.path.join(fixtures_dir, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def _render(template: str, name: str) -> str:
+    slug = re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-") or "someone"
+    # the templates are JSON, so the substituted values have to be JSON-escaped
+    return template.replace("{name}", json.dumps(name)[1:-1]).replace("{slug}", slug)
+
+
+def _name_from_slug(url: str) -> str:
+    slug = url.rstrip("/").rsplit("/", 1)[-1]
+    return " ".join(part.capitalize() for part in slug.split("-") if not part.isdigit()) or "Someone"
+
+
+def _completion(content: str, model: str, prompt: str) -> dict:
+    return {
+        "id": f"chatcmpl-bench-{random.getrandbits(32):x}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {
+            "prompt_tokens": len(prompt) // 4,
+            "completion_tokens": len(content) // 4,
+            "total_tokens": (len(prompt) + len(content)) // 4,
+        },
+    }
+
+
+def _stream(content: str, model: str, behaviour: ProviderBehaviour):
+    async def chunks():
+        # spread the latency over the stream, the way tokens actually trickle in
+        pieces = [content[i:i + 24] for i in range(0, len(content), 24)] or [""]
+        per_piece = ProviderBehaviour(behaviour.latency_ms / len(pieces), behaviour.jitter_ms / len(pieces))
+        for piece in pieces:
+            await per_piece.delay()
+            chunk = {
+                "id": "chatcmpl-bench",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+    return StreamingResponse(chunks(), media_type="text/event-stream")
+
+
+def create_stub_app(behaviours: Optional[Dict[str, ProviderBehaviour]] = None, fixtures_dir: str = FIXTURES_DIR) -> FastAPI:
+    behaviours = {**default_behaviours(), **(behaviours or {})}
+    fixtures = {
+        name: _load(fixtures_dir, f"{name}.json")
+        for name in ("mixrank_profile", "exa_search", "ip_api", "gemini_tags", "openai")
+    }
+    app = FastAPI()
+    app.state.requests = {p: 0 for p in PROVIDERS}
+
+    async def gate(provider: str) -> Optional[JSONResponse]:
+        app.state.requests[provider] += 1
+        behaviour = behaviours[provider]
+        await behaviour.delay()
+        return behaviour.failure()
+
+    @app.get("/mixrank/{key}/linkedin/profile")
+    async def mixrank_profile(key: str, url: str):
+        failed = await gate("mixrank")
+        if failed:
+            return failed
+        return json.loads(_render(fixtures["mixrank_profile"], _name_from_slug(url)))
+
+    @app.post("/exa/search")
+    async def exa_search(request: Request):
+        failed = await gate("exa")
+        if failed:
+            return failed
+        body = await request.json()
+        # batch queries are "<name> <profile url> <school>"; the API sends the bare name
+        query = body.get("query", "")
+        match = re.search(r"linkedin\.com/in/[^\s/]+", query)
+        name = _name_from_slug(match.group(0)) if match else query.strip()
+        return json.loads(_render(fixtures["exa_search"], name))
+
+    @app.get("/ip-api/json/{ip}")
+    async def ip_api(ip: str):
+        failed = await gate("ip-api")
+        return failed or json.loads(fixtures["ip_api"])
+
+    @app.post("/openai/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        prompt = "\n".join(str(m.get("content", "")) for m in body.get("messages", []))
+        model = body.get("model", "gpt-4o-mini")
+        behaviour = behaviours["openai"]
+        app.state.requests["openai"] += 1
+        failed = behaviour.failure()
+        if failed:
+            await behaviour.delay()
+            return failed
+        answers = json.loads(fixtures["openai"])
+        name_match = re.search(r"(?:query name '|Name: )([^'\n]+)", prompt)
+        name = name_match.group(1).strip() if name_match else "Someone"
+        if "Identify each unique person" in prompt:
+            urls = list(dict.fromkeys(re.findall(r"URL: (\S+)", prompt)))
+            titles = re.findall(r"Title: (.+)", prompt)
+            content = json.dumps({"candidates": [
+                {"summary": title, "url": url, "score": round(9 - 1.5 * i, 1)}
+                for i, (title, url) in enumerate(zip(titles, urls))
+            ]})
+        elif "LinkedIn URL" in prompt:
+            content = json.dumps({"linkedin_url": _render(answers["linkedin_url"], name)})
+        elif "Rewrite the given output" in prompt:
+            content = prompt.split("Output:\n", 1)[-1].split("\n\nError:", 1)[0]
+        else:
+            profile_name = re.search(r'"name":"([^"]+)"', prompt)
+            content = _render(answers["summary"], profile_name.group(1) if profile_name else name)
+        if body.get("stream"):
+            return _stream(content, model, behaviour)
+        await behaviour.delay()
+        return _completion(content, model, prompt)
+
+    @app.post("/gemini/v1beta/models/{model}:generateContent")
+    async def gemini_generate(model: str, request: Request):
+        failed = await gate("gemini")
+        if failed:
+            return failed
+        body = await request.json()
+        prompt = "\n".join(
+            part.get("text", "") for content in body.get("contents", []) for part in content.get("parts", [])
+        )
+        tags = json.loads(fixtures["gemini_tags"])
+        entries = [
+            {"id": person_id, "tags": random.sample(tags, k=min(len(tags), 5))}
+            for person_id in re.findall(r"Person ID: (\S+)", prompt)
+        ]
+        text = json.dumps(entries)
+        return {
+            "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP", "index": 0}],
+            "usageMetadata": {
+                "promptTokenCount": len(prompt) // 4,
+                "candidatesTokenCount": len(text) // 4,
+                "totalTokenCount": (len(prompt) + len(text)) // 4,
+            },
+        }
+
+    return app
+
+
+def provider_env(base_url: str) -> Dict[str, str]:
+    base_url = base_url.rstrip("/")
+    return {
+        "MIXRANK_BASE_URL": f"{base_url}/mixrank",
+        "EXA_BASE_URL": f"{base_url}/exa",
+        "OPENAI_BASE_URL": f"{base_url}/openai/v1",
+        "GEMINI_API_ENDPOINT": f"{base_url}/gemini",
+        "IP_API_BASE_URL": f"{base_url}/ip-api",
+        "MIXRANK_API_KEY": "bench",
+        "EXA_API_KEY": "bench",
+        "OPENAI_API_KEY": "bench",
+        "GEMINI_API_KEY": "bench",
+    }
+
+
+class StubServer:
+    """The stub app on a uvicorn server in a background thread."""
+
+    def __init__(self, app: FastAPI, host: str = "127.0.0.1", port: int = 0):
+        import uvicorn
+
+        self.app = app
+        self.server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning", lifespan="off"))
+        self.thread = threading.Thread(target=self.server.run, name="bench-stubs", daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        sock = self.server.servers[0].sockets[0]
+        host, port = sock.getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "StubServer":
+        self.thread.start()
+        deadline = time.monotonic() + 10
+        while not self.server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError("stub server did not start")
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.server.should_exit = True
+        self.thread.join(timeout=5)
+
+
+def parse_behaviours(latency=(), errors=(), throttle=()) -> Dict[str, ProviderBehaviour]:
+    """From CLI specs: latency `provider=ms[:jitter]`, errors/throttle `provider=rate`."""
+    behaviours = default_behaviours()
+
+    def pairs(specs):
+        for spec in specs:
+            provider, _, value = spec.partition("=")
+            if provider not in behaviours:
+                raise ValueError(f"unknown provider {provider!r}; expected one of {', '.join(PROVIDERS)}")
+            yield behaviours[provider], value
+
+    for behaviour, value in pairs(latency):
+        mean, _, jitter = value.partition(":")
+        behaviour.latency_ms, behaviour.jitter_ms = float(mean), float(jitter or 0)
+    for behaviour, value in pairs(errors):
+        behaviour.error_rate = float(value)
+    for behaviour, value in pairs(throttle):
+        behaviour.throttle_rate = float(value)
+    return behaviours
+
+
+def add_behaviour_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency", action="append", default=[], metavar="PROVIDER=MS[:JITTER]")
+    parser.add_argument("--errors", action="append", default=[], metavar="PROVIDER=RATE")
+    parser.add_argument("--throttle", action="append", default=[], metavar="PROVIDER=RATE")
+    parser.add_argument("--fixtures", default=FIXTURES_DIR, help="directory of recorded payloads")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve local provider stand-ins")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    add_behaviour_args(parser)
+    args = parser.parse_args()
+    app = create_stub_app(parse_behaviours(args.latency, args.errors, args.throttle), args.fixtures)
+    with StubServer(app, args.host, args.port) as server:
+        for key, value in provider_env(server.base_url).items():
+            print(f"export {key}={value}")
+        try:
+            server.thread.join()
+        except KeyboardInterrupt:
+            pass
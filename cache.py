@@ -0,0 +1,260 @@
+"""
+Response caches for provider lookups.
+
+`LRUCache` is an in-process, thread-safe LRU with a TTL.  `PersistentCache` puts one in front of
+a local SQLite file so entries survive restarts and are shared by every process on the host.
+Both keep hit/miss counters (`stats()`).  The SQLite tier is best effort: a locked or broken file
+counts as a miss (or a skipped write), never as a failed lookup, and event-loop callers reach it
+through `get_async` / `set_async` so a busy file never blocks the loop.
+
+`mixrank_cache` is the shared Mixrank cache used by the API and the batch enricher.  Its TTL
+defaults to MIXRANK_MAXAGE, the same `maxage` we ask Mixrank for, so we never serve anything
+older than Mixrank itself would have.
+
+    MIXRANK_CACHE_PATH            SQLite file (default .cache/mixrank.sqlite3)
+    MIXRANK_CACHE_TTL             seconds (default MIXRANK_MAXAGE)
+    MIXRANK_CACHE_MEMORY_ENTRIES  in-process LRU size
+    MIXRANK_CACHE_DISK_ENTRIES    on-disk row cap, oldest-accessed rows are evicted first
+
+`SingleFlight` coalesces concurrent async calls for the same key onto a single in-flight task.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from normalize import normalize_linkedin_url, normalize_name
+
+
+MIXRANK_MAXAGE = 1192000  # seconds; sent as `maxage` on every Mixrank request
+
+logger = logging.getLogger("delphi.cache")
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe LRU with per-entry expiry."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires_at, value = entry
+                if expires_at > time.time():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl: Optional[float] = None, expires_at: Optional[float] = None) -> None:
+        if expires_at is None:
+            expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._data),
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class PersistentCache:
+    """
+    Two-tier cache: an `LRUCache` in memory backed by a SQLite table on local disk.
+    Values must be JSON-serialisable.
+    """
+
+    PRUNE_EVERY = 256  # writes between on-disk eviction passes
+
+    def __init__(self, path: str, ttl: float, memory_entries: int = 1024, disk_entries: int = 100_000):
+        self.path = path
+        self.ttl = ttl
+        self.disk_entries = disk_entries
+        self.memory = LRUCache(memory_entries, ttl)
+        self.disk_hits = self.misses = self.evictions = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._db = None
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)")
+            self._db = db
+        return self._db
+
+    def get(self, key: str, default=None):
+        value = self.memory.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        now = time.time()
+        with self._lock:
+            try:
+                db = self._conn()
+                row = db.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+                if row is not None and row[1] > now:
+                    db.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+            except sqlite3.Error as exc:
+                # locked by another process past the busy timeout, or a broken file: just a miss
+                logger.warning("cache read failed: %s", exc, extra={"cache": self.path})
+                row = None
+            if row is None or row[1] <= now:
+                self.misses += 1
+                return default
+            self.disk_hits += 1
+        value = json.loads(row[0])
+        self.memory.set(key, value, expires_at=row[1])
+        return value
+
+    def set(self, key: str, value) -> None:
+        now = time.time()
+        expires_at = now + self.ttl
+        self.memory.set(key, value, expires_at=expires_at)
+        with self._lock:
+            try:
+                self._conn().execute(
+                    "INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value), expires_at, now),
+                )
+                self._writes += 1
+                if self._writes % self.PRUNE_EVERY == 0:
+                    self._prune(now)
+            except sqlite3.Error as exc:
+                logger.warning("cache write failed: %s", exc, extra={"cache": self.path})
+
+    async def get_async(self, key: str, default=None):
+        """`get` for the event loop: memory hits stay inline, the SQLite tier runs in a thread."""
+        value = self.memory.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        return await asyncio.to_thread(self.get, key, default)
+
+    async def set_async(self, key: str, value) -> None:
+        await asyncio.to_thread(self.set, key, value)
+
+    def _prune(self, now: float) -> None:
+        db = self._conn()
+        self.evictions += db.execute("DELETE FROM cache WHERE expires_at <= ?", (now,)).rowcount
+        overflow = db.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.disk_entries
+        if overflow > 0:
+            self.evictions += db.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed_at LIMIT ?)",
+                (overflow,),
+            ).rowcount
+
+    def delete(self, key: str) -> None:
+        self.memory.delete(key)
+        with self._lock:
+            try:
+                self._conn().execute("DELETE FROM cache WHERE key = ?", (key,))
+            except sqlite3.Error as exc:
+                logger.warning("cache delete failed: %s", exc, extra={"cache": self.path})
+
+    def stats(self) -> dict:
+        memory = self.memory.stats()
+        lookups = memory["hits"] + self.disk_hits + self.misses
+        hits = memory["hits"] + self.disk_hits
+        return {
+            "memory_hits": memory["hits"],
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": memory["evictions"] + self.evictions,
+            "memory_size": memory["size"],
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class SingleFlight:
+    """
+    Concurrent callers asking for the same key share one in-flight call instead of each making
+    their own.  The shared task is shielded, so one caller disconnecting doesn't cancel it for
+    the others; it is only cancelled once every caller waiting on it has been.  Exceptions
+    propagate to every waiter and nothing is remembered afterwards.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self._waiters = {}   # shared task -> callers still awaiting it
+        self.calls = self.coalesced = 0
+
+    def _forget(self, key, task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        self._waiters.pop(task, None)
+
+    async def do(self, key, fn, *args, **kwargs):
+        task = self._inflight.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._forget(key, task))
+        else:
+            self.coalesced += 1
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters.get(task) == 1 and not task.done():
+                task.cancel()   # nobody else wants the result: stop spending provider quota on it
+            raise
+        finally:
+            if task in self._waiters:
+                self._waiters[task] -= 1
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._inflight)}
+
+
+def mixrank_key(endpoint: str, url: str, name: Optional[str] = None) -> str:
+    """Cache key for a Mixrank lookup: endpoint + normalized LinkedIn URL (+ name if sent)."""
+    return "|".join((endpoint, normalize_linkedin_url(url), normalize_name(name) if name else ""))
+
+
+mixrank_cache = PersistentCache(
+    path=os.getenv("MIXRANK_CACHE_PATH", os.path.join(".cache", "mixrank.sqlite3")),
+    ttl=float(os.getenv("MIXRANK_CACHE_TTL", MIXRANK_MAXAGE)),
+    memory_entries=int(os.getenv("MIXRANK_CACHE_MEMORY_ENTRIES", "2048")),
+    disk_entries=int(os.getenv("MIXRANK_CACHE_DISK_ENTRIES", "200000")),
+)
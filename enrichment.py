@@ -4,321 +4,684 @@ from app.models.connection import Connection
 from app.models.user_connection import UserConnection
 from app.models.enrichment import Enrichment
 from app.database import db
-import time
 import requests
 import os
+import json
+import logging
+import threading
+import time
+import http_pool
+import metrics
+import ratelimit
+import mixrank
+import payload_archive
+import payloads
+import people_index
+import tag_index
+from cache import mixrank_cache
+from logging_setup import configure_logging
+from payloads import compact_payload, content_hash
+from store import SUMMARY_COLUMNS, backlog_counts, enrichment_blob, in_shard, leased, needs_enrichment
 import google.generativeai as genai
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import and_, update
+from typing import NamedTuple, Optional, TypedDict
+
+
+# Batch engine tuning.  ENRICH_WORKERS bounds how many connections are in flight at once;
+# the per-provider limits cap concurrent calls to each upstream across all workers, so adding
+# workers scales throughput until one of those limits becomes the bottleneck.
+ENRICH_WORKERS = int(os.getenv("ENRICH_WORKERS", "8"))
+PROVIDER_CONCURRENCY = {
+    "mixrank": int(os.getenv("MIXRANK_MAX_IN_FLIGHT", "4")),
+    "exa": int(os.getenv("EXA_MAX_IN_FLIGHT", "4")),
+    "gemini": int(os.getenv("GEMINI_MAX_IN_FLIGHT", "4")),
+}
+_provider_slots = {
+    provider: threading.BoundedSemaphore(limit)
+    for provider, limit in PROVIDER_CONCURRENCY.items()
+}
+
+# Work-queue claiming: rows per claim (and per commit), how long a claim is honoured before
+# another worker may take the row over, and how often live workers renew the claims they hold.
+ENRICH_BATCH_SIZE = int(os.getenv("ENRICH_BATCH_SIZE", "25"))
+ENRICH_LEASE_SECONDS = int(os.getenv("ENRICH_LEASE_SECONDS", "300"))
+ENRICH_HEARTBEAT_SECONDS = float(os.getenv("ENRICH_HEARTBEAT_SECONDS", ENRICH_LEASE_SECONDS / 3))
+
+# Gemini tagging: connections packed into one structured-output prompt, and how many times the
+# entries that come back missing or malformed are retried on their own.
+GEMINI_TAG_BATCH_SIZE = int(os.getenv("GEMINI_TAG_BATCH_SIZE", "8"))
+GEMINI_TAG_RETRIES = int(os.getenv("GEMINI_TAG_RETRIES", "2"))
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "60"))
+
+# Provider endpoints; overridable so bench/ can run against local stand-ins
+EXA_SEARCH_URL = os.getenv("EXA_BASE_URL", "https://api.exa.ai").rstrip("/") + "/search"
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")
+
+# One INFO record per connection (outcome, fields updated, tags, timing); LOG_LEVEL=DEBUG adds
+# the per-stage and per-field detail.  See logging_setup.py.
+logger = logging.getLogger("delphi.enrichment")
+
+metrics.register_collector(metrics.cache_collector("mixrank", mixrank_cache))
+metrics.register_collector(metrics.dict_collector("delphi_prompt", payloads.totals))
+
+
+def _enrich_connections(workers: int = None, shard: tuple = None, stop_event: threading.Event = None,
+                        refresh_age: float = None):
+    """
+    Pull every Connection that has never been enriched (latest_enrichment->'version' IS NULL) or
+    was stored by the API without tags (latest_enrichment->'tagged' = false), fetch Mixrank
+    data, copy the interesting bits onto the record, enrich metadata with Exa and Gemini, create
+    an Enrichment row, and bump latest_enrichment.
+
+    With `refresh_age` (seconds), connections whose latest_enrichment is older than that are
+    re-enriched too.  Each Enrichment row records a content hash of the normalized Mixrank + Exa
+    inputs; when a refresh finds the same hash, tagging and the Connection field writes are
+    skipped and only the latest_enrichment timestamp is bumped.
+
+    The backlog is worked as a queue: each of `workers` threads (default ENRICH_WORKERS) claims
+    keyset-paginated batches of ENRICH_BATCH_SIZE rows with FOR UPDATE SKIP LOCKED, stamping
+    is_enriching plus a lease that expires after ENRICH_LEASE_SECONDS, so several enricher processes
+    can share the backlog and rows held by a crashed process are picked up again once the lease runs
+    out.  Each connection is written inside its own savepoint, so a failure never poisons the rest
+    of the batch, and the batch is committed once.
+
+    `shard=(index, count)` restricts this run to connections with id % count == index, which is
+    how enrichment_worker.py splits the backlog across processes and hosts.  A heartbeat thread
+    keeps the leases of in-flight rows alive, and setting `stop_event` makes workers finish their
+    current batch and exit; any lease still held on the way out is handed back.
+    """
+    configure_logging()
+    now = datetime.utcnow()
+    refresh_before = now - timedelta(seconds=refresh_age) if refresh_age else None
+    total = _pending_query(now, shard, refresh_before).count()
+    logger.info("%d connections need enrichment", total, extra={"stage": "start", "pending": total})
+
+    if not total:
+        return
+
+    workers = max(1, workers or ENRICH_WORKERS)
+    app = current_app._get_current_object()
+    progress = _Progress(total)
+    stop_event = stop_event or threading.Event()
+    heartbeat = _LeaseHeartbeat(app)
+    logger.info(
+        "enriching with %d workers", workers,
+        extra={
+            "stage": "start", "workers": workers, "batch_size": ENRICH_BATCH_SIZE,
+            "shard": shard or "all", "provider_limits": PROVIDER_CONCURRENCY,
+        },
+    )
+
+    heartbeat.start()
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="enrich") as pool:
+            futures = [
+                pool.submit(_enrich_worker, app, progress, heartbeat, shard, stop_event, refresh_before)
+                for _ in range(workers)
+            ]
+            for future in futures:
+                future.result()
+    finally:
+        stop_event.set()
+        heartbeat.stop()
+        if payload_archive.archive is not None:
+            payload_archive.archive.close()
+    logger.info(
+        "done: %d connections processed", progress.completed,
+        extra={"stage": "done", **progress.counts()},
+    )
+    # Where the run's time went: provider waits/latencies, DB commits, per-connection totals
+    logger.info("run metrics\n%s", metrics.summary_table(), extra={"stage": "metrics", "metrics": metrics.snapshot()})
+
+
+class _Progress:
+    def __init__(self, total: int):
+        self.total = total
+        self.completed = self.succeeded = self.unchanged = 0
+        self._lock = threading.Lock()
+
+    def record(self, succeeded: bool, unchanged: bool = False) -> None:
+        with self._lock:
+            self.completed += 1
+            self.succeeded += 1 if succeeded and not unchanged else 0
+            self.unchanged += 1 if succeeded and unchanged else 0
+            report = self.completed % 5 == 0
+        if report:
+            logger.info("progress", extra={"stage": "progress", **self.counts()})
+
+    def counts(self) -> dict:
+        return {
+            "completed": self.completed, "total": self.total,
+            "enriched": self.succeeded, "unchanged": self.unchanged,
+        }
+
+
+# The backlog predicates live in store.py so the API and the tests share them
+def _needs_enrichment(refresh_before: Optional[datetime] = None):
+    return needs_enrichment(Connection, refresh_before)
+
+
+def _leased(now: datetime):
+    return leased(Connection, now)
+
+
+def _in_shard(shard):
+    return in_shard(Connection, shard)
+
+
+def _pending_query(now: datetime, shard: tuple = None, refresh_before: datetime = None):
+    """Connections that still need enriching (or refreshing) and aren't leased to a live worker."""
+    return Connection.query.filter(_needs_enrichment(refresh_before), ~_leased(now), _in_shard(shard))
+
+
+def enrichment_progress(shard: tuple = None, refresh_before: datetime = None) -> dict:
+    """Backlog counts (enriched / in progress / pending) across every worker, in one query."""
+    counts = backlog_counts(db.session, Connection.__table__, refresh_before=refresh_before, shard=shard)
+    db.session.commit()
+    return counts
+
+
+def _claim_batch(after_id, size: int, shard: tuple = None, refresh_before: datetime = None) -> list:
+    """
+    Atomically lease the next `size` pending connections with id > after_id.  Rows locked by
+    another claimer are skipped rather than waited on.  Commits the claim and returns the
+    connections, ordered by id.
+    """
+    now = datetime.utcnow()
+    candidates = (
+        _pending_query(now, shard, refresh_before)
+        .filter(Connection.id > after_id)
+        .with_entities(Connection.id)
+        .order_by(Connection.id)
+        .limit(size)
+        .with_for_update(skip_locked=True)
+    )
+    with metrics.timed("delphi_db_seconds", op="claim"):
+        claimed_ids = db.session.execute(
+            update(Connection)
+            .where(Connection.id.in_(candidates.scalar_subquery()))
+            .values(
+                is_enriching=True,
+                enrichment_lease_expires_at=now + timedelta(seconds=ENRICH_LEASE_SECONDS),
+            )
+            .returning(Connection.id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+        db.session.commit()
+    if not claimed_ids:
+        return []
+    return Connection.query.filter(Connection.id.in_(claimed_ids)).order_by(Connection.id).all()
 
 
+def _latest_versions(connection_ids) -> dict:
+    """connection_id -> newest Enrichment.version, in one grouped query."""
+    rows = (
+        db.session.query(Enrichment.connection_id, db.func.max(Enrichment.version))
+        .filter(Enrichment.connection_id.in_(connection_ids))
+        .group_by(Enrichment.connection_id)
+        .all()
+    )
+    return dict(rows)
 
 
-def _enrich_connections():
+def _release(connection) -> None:
+    connection.is_enriching = False
+    connection.enrichment_lease_expires_at = None
+
+
+class _LeaseHeartbeat(threading.Thread):
     """
-    Pull every Connection that has never been enriched (latest_enrichment->'version' IS NULL),
-    fetch Mixrank data, copy the interesting bits onto the record, enrich metadata with Exa and Gemini, 
-    create an Enrichment row, and bump latest_enrichment.  Runs in a single transaction per connection so 
-    failures never poison the rest of the batch.
+    Renews the leases on every row this process is currently working on, so only rows whose
+    worker has actually died (and stopped heartbeating) become claimable again.  On stop, any
+    row still tracked is released straight away instead of waiting for its lease to lapse.
     """
-    # Get all connections that have never been enriched, connections that haven't been enriched will have an empty latest_enrichment
-    connections = Connection.query.filter(
-        ~Connection.latest_enrichment.has_key('version')   # noqa: E711
-        | Connection.latest_enrichment.is_(None)
-    ).all()
-    print(f"Found {len(connections)} connections needing enrichment")
-
-    if not connections:
-        print("No connections need enrichment.")
-        return
 
-    for index, connection in enumerate(connections, start=1):
+    def __init__(self, app):
+        super().__init__(name="enrich-heartbeat", daemon=True)
+        self.app = app
+        self._held = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def track(self, connection_ids) -> None:
+        with self._lock:
+            self._held.update(connection_ids)
+
+    def untrack(self, connection_ids) -> None:
+        with self._lock:
+            self._held.difference_update(connection_ids)
+
+    def _update_held(self, **values) -> None:
+        with self._lock:
+            held = list(self._held)
+        if not held:
+            return
         try:
-            print(f"\n=== Processing connection {index}/{len(connections)} ===")
-            print(f"Connection ID: {connection.id}")
-            print(f"Current state - Name: {connection.full_name}, Company: {connection.current_company}, Location: {connection.location}")
-
-            # ------------------------------------------------------------------ #
-            # 1)  Fetch newest version number for this connection
-            # ------------------------------------------------------------------ #
-            latest_version = (
-                db.session.query(db.func.max(Enrichment.version))
-                .filter(Enrichment.connection_id == connection.id)
-                .scalar()
-            ) or 0
-            new_version = latest_version + 1
-            print(f"Current version: {latest_version}, New version: {new_version}")
-
-            connection.is_enriching = True
-            db.session.commit()
-
+            with metrics.timed("delphi_db_seconds", op="heartbeat"):
+                db.session.execute(
+                    update(Connection)
+                    .where(Connection.id.in_(held), Connection.is_enriching.is_(True))
+                    .values(**values)
+                    .execution_options(synchronize_session=False)
+                )
+                db.session.commit()
+        except Exception as exc:
+            logger.error("lease heartbeat failed: %s", exc, extra={"stage": "heartbeat"})
+            db.session.rollback()
 
-            # ------------------------------------------------------------------ #
-            # 2)  MIXRANK – basic person/company + LinkedIn scrape
-            # ------------------------------------------------------------------ #
-            print(f"\nFetching Mixrank data for URL: {connection.profile_url}")
-            mixrank_data = process_basic_enrichment(connection.profile_url)
+    def run(self) -> None:
+        with self.app.app_context():
+            while not self._stopped.wait(ENRICH_HEARTBEAT_SECONDS):
+                self._update_held(
+                    enrichment_lease_expires_at=datetime.utcnow() + timedelta(seconds=ENRICH_LEASE_SECONDS)
+                )
 
-            if not mixrank_data:
-                print("❌ Mixrank returned empty payload")
-                continue
+    def stop(self) -> None:
+        self._stopped.set()
+        if self.is_alive():
+            self.join()
+        with self.app.app_context():
+            self._update_held(is_enriching=False, enrichment_lease_expires_at=None)
 
-            print("✅ Received Mixrank data:")
-            print(f"LinkedIn data present: {'linkedin' in mixrank_data}")
-            print(f"Company data present: {'company' in mixrank_data}")
 
-            # ------------------------------------------------------------------ #
-            # 3)  Map Mixrank fields onto our Connection object
-            # ------------------------------------------------------------------ #
-            print("\nApplying Mixrank data to connection...")
-            _apply_mixrank_to_connection(connection, mixrank_data)
+def _enrich_worker(app, progress: _Progress, heartbeat: _LeaseHeartbeat, shard: tuple,
+                   stop_event: threading.Event, refresh_before: datetime = None) -> None:
+    """
+    One worker thread: claim a batch, enrich it, commit, repeat until the backlog is drained.
+    Runs in its own app context, so it has its own scoped session.  The keyset cursor only moves
+    forward, so connections that fail are released for a later run instead of retried forever.
+    """
+    with app.app_context():
+        after_id = 0
+        while not stop_event.is_set():
+            try:
+                batch = _claim_batch(after_id, ENRICH_BATCH_SIZE, shard, refresh_before)
+            except Exception as exc:
+                logger.error("claiming connections failed: %s", exc, extra={"stage": "claim"})
+                db.session.rollback()
+                return
+            if not batch:
+                return
+            after_id = batch[-1].id
+            batch_ids = [c.id for c in batch]
+            heartbeat.track(batch_ids)
+            with metrics.timed("delphi_db_seconds", op="latest_versions"):
+                latest_versions = _latest_versions(batch_ids)
+
+            # Mixrank + Exa per connection, then Gemini tags for the whole batch in a few prompts;
+            # refreshed connections whose inputs hash the same skip tagging altogether
+            staged, results, unchanged = {}, {}, set()
+            started, errors, versions = {}, {}, {}
+            for connection_id, connection in zip(batch_ids, batch):
+                started[connection_id] = time.perf_counter()
+                try:
+                    with metrics.timed("delphi_enrich_stage_seconds", stage="fetch"):
+                        fetched = _fetch_connection_data(connection)
+                except Exception as exc:
+                    logger.debug("fetch failed", exc_info=True, extra={"connection_id": connection_id, "stage": "fetch"})
+                    errors[connection_id] = f"fetch: {exc}"
+                    fetched = None
+                if fetched is None:
+                    db.session.expire(connection)  # drop any half-applied Mixrank fields
+                    _release(connection)
+                    results[connection_id] = False
+                else:
+                    staged[connection_id] = fetched
+                    if fetched.unchanged:
+                        unchanged.add(connection_id)
+
+            to_tag = {cid: (f.exa_data, f.mixrank_data) for cid, f in staged.items() if cid not in unchanged}
+            with metrics.timed("delphi_enrich_stage_seconds", stage="tags"):
+                tags_by_id = process_tags_batch(to_tag) if to_tag else {}
+            if payload_archive.archive is not None:
+                # archived before the commit: the payloads are paid for even if the write fails
+                for connection_id, connection in zip(batch_ids, batch):
+                    if connection_id in to_tag:
+                        fetched = staged[connection_id]
+                        payload_archive.archive.append(
+                            connection_id, connection.profile_url, fetched.mixrank_data, fetched.exa_data,
+                            tags_by_id.get(connection_id, []), fetched.content_hash,
+                        )
+            for connection_id, connection in zip(batch_ids, batch):
+                if connection_id not in staged:
+                    continue
+                try:
+                    with db.session.begin_nested():
+                        if connection_id in unchanged:
+                            _touch_enrichment(connection)
+                        else:
+                            versions[connection_id] = _write_enrichment(
+                                connection,
+                                latest_versions.get(connection_id) or 0,
+                                tags_by_id.get(connection_id, []),
+                                staged[connection_id].content_hash,
+                                mapped=staged[connection_id].mapped,
+                            )
+                    results[connection_id] = True
+                except Exception as exc:
+                    errors[connection_id] = f"save: {exc}"
+                    _release(connection)
+                    results[connection_id] = False
 
-            # ------------------------------------------------------------------ #
-            # 4)  Build tags from Exa and Mixrank data
-            # ------------------------------------------------------------------ #
+            try:
+                with metrics.timed("delphi_db_seconds", op="commit"):
+                    db.session.commit()
+                logger.debug("committed batch", extra={"stage": "commit", "batch_size": len(batch)})
+                for connection_id, connection in zip(batch_ids, batch):
+                    if connection_id in versions:
+                        tag_index.record(connection_id, tags_by_id.get(connection_id, []))
+                        people_index.record(connection)
+            except Exception as exc:
+                logger.error("committing batch failed: %s", exc, extra={"stage": "commit", "batch_size": len(batch)})
+                db.session.rollback()
+                results = dict.fromkeys(batch_ids, False)
+                errors = dict.fromkeys(batch_ids, f"commit: {exc}")
+            heartbeat.untrack(batch_ids)
+            for connection_id, ok in results.items():
+                fetched = staged.get(connection_id)
+                _log_outcome(
+                    connection_id,
+                    "failed" if not ok and connection_id in errors else
+                    "no_data" if not ok else
+                    "unchanged" if connection_id in unchanged else "enriched",
+                    time.perf_counter() - started[connection_id],
+                    error=errors.get(connection_id),
+                    version=versions.get(connection_id),
+                    fields_updated=fetched.updated if fetched else None,
+                    tags=len(tags_by_id.get(connection_id, [])) if connection_id in tags_by_id else None,
+                )
+                progress.record(ok, connection_id in unchanged)
+
+
+def _log_outcome(connection_id: int, outcome: str, seconds: float, **details) -> None:
+    """The one INFO (WARNING on failure) record each connection gets."""
+    metrics.observe("delphi_connection_seconds", seconds, outcome=outcome)
+    logger.log(
+        logging.WARNING if outcome == "failed" else logging.INFO,
+        "connection %s %s", connection_id, outcome,
+        extra={
+            "connection_id": connection_id, "stage": "outcome", "outcome": outcome,
+            "duration_ms": round(seconds * 1000, 1),
+            **{k: v for k, v in details.items() if v is not None},
+        },
+    )
+
+
+class _Fetched(NamedTuple):
+    exa_data: dict
+    mixrank_data: dict
+    content_hash: str
+    unchanged: bool
+    updated: list
+    mapped: dict
+
+
+def _fetch_connection_data(connection) -> Optional[_Fetched]:
+    """
+    Fetch Mixrank data for one claimed connection, map it onto the record and run the Exa search.
+    Returns the payloads ready for tagging, or None when Mixrank had nothing.  When a previously
+    enriched connection's inputs hash the same as last time, nothing is mapped and the result is
+    flagged `unchanged`.
+    """
+    log = {"connection_id": connection.id}
+    logger.debug(
+        "processing", extra={**log, "stage": "start", "name": connection.full_name,
+                             "company": connection.current_company, "location": connection.location},
+    )
+
+    # ------------------------------------------------------------------ #
+    # 1)  MIXRANK – basic person/company + LinkedIn scrape
+    # ------------------------------------------------------------------ #
+    with _provider_slots["mixrank"]:
+        mixrank_data = process_basic_enrichment(connection.profile_url)
+
+    if not mixrank_data:
+        logger.debug("Mixrank returned empty payload", extra={**log, "stage": "mixrank", "url": connection.profile_url})
+        return None
+    logger.debug("Mixrank data received", extra={**log, "stage": "mixrank", "fields": len(mixrank_data)})
+
+    # ------------------------------------------------------------------ #
+    # 2)  Refresh: same inputs as last time means nothing to map or tag
+    # ------------------------------------------------------------------ #
+    previous_hash = (connection.latest_enrichment or {}).get("content_hash")
+    if previous_hash:
+        # an enriched record already has its fields, so the Exa query comes out as it did then
+        with _provider_slots["exa"]:
             exa_data = process_exa(connection)
-            tags = process_tags(exa_data, mixrank_data)
-            #print that tags have been generated if the length of tags is greater than 0
-            if len(tags) > 0:
-                print("✅ Tags generated successfully")
-            else:
-                print("❌ No tags generated")
-
-            # ------------------------------------------------------------------ #
-            # 5)  Build the latest_enrichment blob (store only essential data)
-            # ------------------------------------------------------------------ #
-            print("\nUpdating latest_enrichment with summary...")
-            connection.latest_enrichment = {
-                "version": new_version,
-                "source": "mixrank",
-                "timestamp": datetime.utcnow().isoformat(),
-                "enrichment_summary": {
-                    "headline": connection.headline,
-                    "current_company": connection.current_company,
-                    "location": connection.location,
-                    "skills_count": len(connection.skills) if connection.skills else 0,
-                    "education_count": len(connection.education) if connection.education else 0,
-                    "previous_companies_count": len(connection.previous_companies) if connection.previous_companies else 0
-                }
-            }
-
-
-
-            # ------------------------------------------------------------------ #
-            # 6)  Create an Enrichment history row
-            # ------------------------------------------------------------------ #
-            enrichment = Enrichment(
-                connection_id=connection.id,
-                version=new_version,
-                tags=tags
-            )
-            db.session.add(enrichment)
-
-            # ------------------------------------------------------------------ #
-            # 7)  Persist everything
-            # ------------------------------------------------------------------ #
-            print("\nCommitting changes to database...")
-            connection.is_enriching = False
+        digest = content_hash(mixrank_data, exa_data)
+        if digest == previous_hash:
+            logger.debug("inputs unchanged, skipping mapping and tagging", extra={**log, "stage": "hash"})
+            return _Fetched(exa_data, mixrank_data, digest, True, [], {})
+        # the provider's data changed: its new values replace the ones it gave us last time,
+        # but not values edited or imported since
+        mapped = (connection.latest_enrichment or {}).get("mapped") or {}
+        updated = _apply_mixrank_to_connection(connection, mixrank_data, mapped=mapped)
+        return _Fetched(exa_data, mixrank_data, digest, False, updated, _mapped_hashes(connection, mixrank_data))
+
+    # ------------------------------------------------------------------ #
+    # 3)  Map Mixrank fields onto our Connection object
+    # ------------------------------------------------------------------ #
+    updated = _apply_mixrank_to_connection(connection, mixrank_data)
+
+    # ------------------------------------------------------------------ #
+    # 4)  Exa search for extra context; tags are generated per batch
+    # ------------------------------------------------------------------ #
+    with _provider_slots["exa"]:
+        exa_data = process_exa(connection)
+    return _Fetched(
+        exa_data, mixrank_data, content_hash(mixrank_data, exa_data), False, updated,
+        _mapped_hashes(connection, mixrank_data),
+    )
+
+
+def _write_enrichment(connection, latest_version: int, tags: list, digest: str = None,
+                      source: str = "mixrank", mapped: dict = None) -> int:
+    """
+    Stage the latest_enrichment blob, a new Enrichment history row and the lease release for one
+    connection (the caller owns the transaction).  `mapped` (see _mapped_hashes) is kept in the
+    blob for the next refresh.  Returns the new version.
+    """
+    new_version = latest_version + 1
+    logger.debug(
+        "writing version %d", new_version,
+        extra={"connection_id": connection.id, "stage": "write", "tags": len(tags)},
+    )
+
+    # ------------------------------------------------------------------ #
+    # 1)  Build the latest_enrichment blob (store only essential data)
+    # ------------------------------------------------------------------ #
+    connection.latest_enrichment = enrichment_blob(
+        new_version, source, {column: getattr(connection, column) for column in SUMMARY_COLUMNS},
+        content_hash=digest, mapped=mapped or {},
+    )
+
+    # ------------------------------------------------------------------ #
+    # 2)  Create an Enrichment history row
+    # ------------------------------------------------------------------ #
+    enrichment = Enrichment(
+        connection_id=connection.id,
+        version=new_version,
+        tags=tags,
+        content_hash=digest,
+    )
+    db.session.add(enrichment)
+
+    # ------------------------------------------------------------------ #
+    # 3)  Release the lease; the batch commit persists everything
+    # ------------------------------------------------------------------ #
+    _release(connection)
+    return new_version
+
+
+def _touch_enrichment(connection) -> None:
+    """A refresh that found nothing new: keep the version, restamp it and release the lease."""
+    connection.latest_enrichment = {**connection.latest_enrichment, "timestamp": datetime.utcnow().isoformat()}
+    _release(connection)
+
+
+# ---------------------------------------------------------------------- #
+# Archive replay
+# ---------------------------------------------------------------------- #
+def replay_archive(directory: str, retag: bool = False, batch_size: int = 500, include_open: bool = False) -> dict:
+    """
+    Rebuild Connection fields and tags from the raw payload archive (payload_archive.py) without
+    calling Mixrank or Exa.  Records stream in archive order and are applied `batch_size`
+    connections per commit, so a connection's later fetch lands after its earlier ones.  Fields
+    are re-mapped with the current `profile_fields` mapping, replacing what the old mapping wrote
+    where the column still holds it (values edited or imported since are kept); the archived tags are re-cleaned, or with `retag` regenerated by Gemini from the
+    archived inputs.  Only connections whose fields or tags actually change get a new Enrichment
+    version (source "replay"), and rows a live worker holds are skipped.
+    """
+    configure_logging()
+    counts = {"records": 0, "replayed": 0, "unchanged": 0, "skipped": 0, "failed": 0}
+    logger.info("replaying payload archive", extra={"stage": "replay", "archive": directory, "retag": retag})
+
+    def apply(pending: dict) -> None:
+        ids = list(pending)
+        connections = {
+            c.id: c for c in Connection.query.filter(Connection.id.in_(ids), ~_leased(datetime.utcnow()))
+            .with_for_update(skip_locked=True).all()
+        }
+        counts["skipped"] += len(ids) - len(connections)
+        latest = _latest_tags(list(connections))
+        retagged = {}
+        if retag and connections:
+            with metrics.timed("delphi_enrich_stage_seconds", stage="tags"):
+                retagged = process_tags_batch(
+                    {cid: (pending[cid].get("exa") or [], pending[cid].get("mixrank") or {}) for cid in connections}
+                )
+        written = []
+        for cid, connection in connections.items():
+            record = pending[cid]
+            mixrank_data = record.get("mixrank") or {}
+            mapped = (connection.latest_enrichment or {}).get("mapped") or {}
+            updated = _apply_mixrank_to_connection(connection, mixrank_data, mapped=mapped)
+            # a failed re-tag keeps what Gemini said at fetch time
+            tags = retagged.get(cid) or _clean_tags(record.get("tags") or [])
+            version, previous_tags = latest.get(cid, (0, None))
+            if not updated and tags == previous_tags:
+                counts["unchanged"] += 1
+                continue
+            with db.session.begin_nested():
+                _write_enrichment(
+                    connection, version, tags, record.get("content_hash"), source="replay",
+                    mapped=_mapped_hashes(connection, mixrank_data),
+                )
+            written.append((connection, tags))
+        with metrics.timed("delphi_db_seconds", op="commit"):
             db.session.commit()
-            print("✅ Changes committed successfully")
-
-            if index % 5 == 0:
-                print(f"\nProgress: {index}/{len(connections)} connections processed")
-                time.sleep(2)  # gentle throttle to keep Mixrank happy
+        counts["replayed"] += len(written)
+        for connection, tags in written:
+            tag_index.record(connection.id, tags)
+            people_index.record(connection)
 
+    def flush(pending: dict) -> None:
+        try:
+            apply(pending)
         except Exception as exc:
-            print(f"\n❌ Error processing connection: {str(exc)}")
+            logger.error("replaying batch failed: %s", exc, extra={"stage": "replay", "batch_size": len(pending)})
             db.session.rollback()
-
-def _apply_mixrank_to_connection(conn: Connection, data: dict) -> None:
+            counts["failed"] += len(pending)
+
+    pending = {}
+    for record in payload_archive.iter_records(directory, include_open):
+        counts["records"] += 1
+        pending[record["connection_id"]] = record   # a later record for the same connection wins
+        if len(pending) >= batch_size:
+            flush(pending)
+            pending = {}
+            if counts["records"] % 100_000 < batch_size:
+                logger.info("replay progress", extra={"stage": "replay", **counts})
+    if pending:
+        flush(pending)
+    logger.info("replay done", extra={"stage": "replay", **counts})
+    return counts
+
+
+def _latest_tags(connection_ids) -> dict:
+    """connection_id -> (newest Enrichment.version, its tags)."""
+    if not connection_ids:
+        return {}
+    newest = (
+        db.session.query(Enrichment.connection_id, db.func.max(Enrichment.version).label("version"))
+        .filter(Enrichment.connection_id.in_(connection_ids))
+        .group_by(Enrichment.connection_id)
+        .subquery()
+    )
+    rows = (
+        db.session.query(Enrichment.connection_id, Enrichment.version, Enrichment.tags)
+        .join(newest, and_(Enrichment.connection_id == newest.c.connection_id, Enrichment.version == newest.c.version))
+        .all()
+    )
+    return {connection_id: (version, tags) for connection_id, version, tags in rows}
+
+
+def _mapped_hashes(conn: Connection, data: dict) -> dict:
+    """Column -> field_hash, for the columns holding what _apply_mixrank_to_connection mapped from `data`."""
+    hashes = {}
+    for column, value in mixrank.profile_fields(data).items():
+        if column == "previous_companies":
+            value = [c for c in value if c != conn.current_company]
+        if value and getattr(conn, column) == value:
+            hashes[column] = payloads.field_hash(value)
+    return hashes
+
+
+def _apply_mixrank_to_connection(conn: Connection, data: dict, mapped: dict = None) -> list:
     """
     Map Mixrank data to Connection fields. Only update fields if they're empty or if we have new data.
+    Returns the names of the fields that were filled in.  `mapped` (refreshes whose inputs
+    changed, archive replays) is the previous blob's _mapped_hashes: a column still holding what
+    Mixrank gave us then takes the new value, anything edited or imported since is left alone.
     """
     if not data:
-        print("❌ No data provided to _apply_mixrank_to_connection")
-        return
+        return []
+
+    updated = []
+    debug = logger.isEnabledFor(logging.DEBUG)
+    # Field mapping is shared with the API's store (see mixrank.profile_fields)
+    for column, value in mixrank.profile_fields(data).items():
+        if column == "previous_companies":
+            value = [c for c in value if c != conn.current_company]
+            if not value:
+                continue
+        current = getattr(conn, column)
+        provided = mapped is not None and current != value and mapped.get(column) == payloads.field_hash(current)
+        if not current or provided:
+            setattr(conn, column, value)
+            updated.append(column)
+        elif debug:
+            logger.debug("%s already set, skipping", column, extra={"connection_id": conn.id, "stage": "apply"})
 
-    print("\n=== Applying Mixrank data to connection fields ===")
-    
-    # Basic profile info
-    if data.get("headline"):
-        print(f"Found headline: {data['headline']}")
-        if not conn.headline:
-            conn.headline = data["headline"]
-            print("✅ Updated headline")
-        else:
-            print("⚠️ Headline already exists, skipping")
-    
-    if data.get("locality"):
-        print(f"Found location: {data['locality']}")
-        if not conn.location:
-            conn.location = data["locality"]
-            print("✅ Updated location")
-        else:
-            print("⚠️ Location already exists, skipping")
-    
-    # Profile image
-    if data.get("picture_url_orig"):
-        print(f"Found profile image URL: {data['picture_url_orig']}")
-        if not conn.profile_image_url:
-            conn.profile_image_url = data["picture_url_orig"]
-            print("✅ Updated profile image URL")
-        else:
-            print("⚠️ Profile image URL already exists, skipping")
-    
-    # Skills
-    if data.get("skills"):
-        print(f"Found {len(data['skills'])} skills")
-        if not conn.skills:
-            conn.skills = data["skills"]
-            print("✅ Updated skills")
-        else:
-            print("⚠️ Skills already exist, skipping")
-
-    # Volunteering
-    if data.get("volunteering"):
-        print(f"Found {len(data['volunteering'])} volunteering entries")
-        if not conn.volunteering:
-            conn.volunteering = data["volunteering"]
-            print("✅ Updated volunteering")
-        else:
-            print("⚠️ Volunteering already exists, skipping")
-
-    # Publications
-    if data.get("publications"):
-        print(f"Found {len(data['publications'])} publications")
-        if not conn.publications:
-            conn.publications = data["publications"]
-            print("✅ Updated publications")
-        else:
-            print("⚠️ Publications already exist, skipping")
-            
-    # Awards
-    if data.get("awards"):
-        print(f"Found {len(data['awards'])} awards")
-        if not conn.awards:
-            conn.awards = data["awards"]
-            print("✅ Updated awards")
-        else:
-            print("⚠️ Awards already exist, skipping")
-    
-    
-    # Education
-    if data.get("education"):
-        print(f"Found {len(data['education'])} education entries")
-        if not conn.education:
-            # Transform education data to match our schema
-            education_data = []
-            for edu in data["education"]:
-                education_data.append({
-                    "school_name": edu.get("school_name"),
-                    "field_of_study": None,  # Not available in this API
-                    "degree": edu.get("degree"),
-                    "start_date": edu.get("start_date"),
-                    "end_date": edu.get("end_date"),
-                    "activities": edu.get("activities")
-                })
-            conn.education = education_data
-            print("✅ Updated education")
-        else:
-            print("⚠️ Education already exists, skipping")
-    
-    # Work experience
-    experience = data.get("experience", [])
-    print(f"Found {len(experience)} positions")
-    if experience:
-        # Current position
-        current_pos = next((p for p in experience if p.get("is_current")), experience[0])
-        if current_pos.get("company"):
-            print(f"Found current company: {current_pos['company']}")
-            if not conn.current_company:
-                conn.current_company = current_pos["company"]
-                print("✅ Updated current company")
-            else:
-                print("⚠️ Current company already exists, skipping")
-        
-        # Previous companies
-        if not conn.previous_companies:
-            company_names = {p.get("company") for p in experience if p.get("company")}
-            if conn.current_company in company_names:
-                company_names.remove(conn.current_company)
-            if company_names:
-                conn.previous_companies = sorted(company_names)
-                print(f"✅ Updated previous companies: {company_names}")
-        else:
-            print("⚠️ Previous companies already exist, skipping")
-    
-    # Certifications
-    if data.get("certifications"):
-        print(f"Found {len(data['certifications'])} certifications")
-        if not conn.certifications:
-            # Transform certifications data to match our schema
-            cert_data = []
-            for cert in data["certifications"]:
-                cert_data.append({
-                    "title": cert.get("title"),
-                    "company_name": cert.get("company_name"),
-                    "date": cert.get("date")
-                })
-            conn.certifications = cert_data
-            print("✅ Updated certifications")
-        else:
-            print("⚠️ Certifications already exist, skipping")
-    
-    # Date of birth
-    if data.get("dob"):
-        print(f"Found date of birth: {data['dob']}")
-        if not conn.date_of_birth:
-            try:
-                conn.date_of_birth = datetime.strptime(data["dob"], "%Y-%m-%d").date()
-                print("✅ Updated date of birth")
-            except (ValueError, TypeError) as e:
-                print(f"❌ Error parsing date of birth: {str(e)}")
-        else:
-            print("⚠️ Date of birth already exists, skipping")
-    
-    # Company data
-    if data.get("company_name") and not conn.current_company:
-        print(f"Found company name: {data['company_name']}")
-        conn.current_company = data["company_name"]
-        print("✅ Updated current company from company data")
-    
     # Industries (not directly available in this API)
     if not conn.industries:
         conn.industries = []  # Initialize empty list since we don't have industry data
-        print("⚠️ No industry data available in this API")
-    
-    print("\n=== Final connection state ===")
-    print(f"Headline: {conn.headline}")
-    print(f"Current Company: {conn.current_company}")
-    print(f"Location: {conn.location}")
-    print(f"Skills count: {len(conn.skills) if conn.skills else 0}")
-    print(f"Education count: {len(conn.education) if conn.education else 0}")
-    print(f"Previous companies count: {len(conn.previous_companies) if conn.previous_companies else 0}")
-    print(f"Profile image URL: {conn.profile_image_url}")
-    print(f"Date of birth: {conn.date_of_birth}")
-    print("=============================\n")
+
+    if debug:
+        logger.debug(
+            "applied Mixrank fields",
+            extra={
+                "connection_id": conn.id, "stage": "apply", "updated": updated,
+                "headline": conn.headline, "current_company": conn.current_company, "location": conn.location,
+                "skills_count": len(conn.skills) if conn.skills else 0,
+                "education_count": len(conn.education) if conn.education else 0,
+                "previous_companies_count": len(conn.previous_companies) if conn.previous_companies else 0,
+            },
+        )
+    return updated
 
 def process_basic_enrichment(url: str) -> dict:
     """
-    Tiny wrapper around Mixrank's `/person/match` endpoint.
+    Tiny wrapper around Mixrank's `/linkedin/profile` endpoint (see mixrank.py).
     Returns {} on error.  Raises nothing – keep calling code simple.
     """
     try:
         mixrank_api_key = os.getenv('MIXRANK_API_KEY', current_app.config.get('MIXRANK_API_KEY'))
-        endpoint = f"https://api.mixrank.com/v2/json/{mixrank_api_key}/linkedin/profile"
-        resp = requests.get(
-            endpoint,
-            params={
-                "url": url,
-                "strategy": "strict",
-                "maxage": "1192000"
-            },
-            timeout=20,
-        )
-        resp.raise_for_status()
-        return resp.json() or {}
+        return mixrank.fetch_profile(url, api_key=mixrank_api_key)
     except (requests.RequestException, ValueError) as err:
-        current_app.logger.error("Mixrank request failed: %s", str(err))
+        logger.warning("Mixrank request failed: %s", err, extra={"stage": "mixrank", "url": url})
         return {}
     
 
@@ -341,8 +704,10 @@ def process_exa(connection):
 
         # Make request to Exa API
         exa_api_key = os.getenv('EXA_API_KEY', current_app.config.get('EXA_API_KEY'))
-        response = requests.post(
-            'https://api.exa.ai/search',
+        response = ratelimit.call(
+            'exa',
+            http_pool.get_session().post,
+            EXA_SEARCH_URL,
             json={
                 'query': search_query,
                 'numResults': 8,
@@ -358,57 +723,153 @@ def process_exa(connection):
         return response.json()
 
     except (requests.RequestException, ValueError) as err:
-        current_app.logger.error("Exa API request failed: %s", str(err))
+        logger.warning("Exa API request failed: %s", err, extra={"stage": "exa", "connection_id": connection.id})
         return {}
 
-def process_tags(exa_data, mixrank_data):
+_gemini_model = None
+_gemini_lock = threading.Lock()
+
+
+def _get_gemini_model():
+    """Configure Gemini and build the model client once per process."""
+    global _gemini_model
+    if _gemini_model is None:
+        with _gemini_lock:
+            if _gemini_model is None:
+                if GEMINI_API_ENDPOINT:
+                    genai.configure(
+                        api_key=os.getenv('GEMINI_API_KEY'),
+                        transport="rest",
+                        client_options={"api_endpoint": GEMINI_API_ENDPOINT},
+                    )
+                else:
+                    genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
+                _gemini_model = genai.GenerativeModel('gemini-2.0-flash')
+    return _gemini_model
+
 
-    # Feed Gemini the mixrank data and the exa data
-    # Get the tags from Gemini
-    # Initialize Gemini
-    genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
-    model = genai.GenerativeModel('gemini-2.0-flash')
+class TaggedPerson(TypedDict):
+    id: str
+    tags: list[str]
 
-    # Construct prompt with available data
-    prompt = f"""
-    You are a metadata enrichment assistant. Based on the following search results and linkedin profile about a person, generate 50-100 relevant keywords/metadata terms that describe them.
+
+TAGS_PROMPT = """
+    You are a metadata enrichment assistant. For each person below you are given the search results and linkedin profile about them. Generate 50-100 relevant keywords/metadata terms that describe each person.
     Focus on their professional background, skills, interests, and achievements. Make the tags short and concise. Optimize for searchability. Make the majority of the tags one or two words.
 
 
-    Example output for a software engineer who is a product manager at Facebook:
+    Example tags for a software engineer who is a product manager at Facebook:
     ["Facebook," "Meta", "FAANG", "MAANG","Software Engineering", "Product Manager", "Facebook", "Software Development", "Computer Science", "Programming", "Teamwork", "Leadership", "Problem Solving", "Decision Making", "Time Management", "Adaptability", "Teamwork", "Leadership Skills", "Communication Skills", "Leadership", "Team Management", "Project Management", "Problem Solving", "Decision Making", "Time Management", "Adaptability", "Teamwork"]
 
-    Example output for someone who played Lacrosse in college and is now a software engineer at Google:
+    Example tags for someone who played Lacrosse in college and is now a software engineer at Google:
     ["FAANG", "MAANG", "Software Engineering", "Lacrosse", "Google", "Software Development", "Computer Science", "Programming", "Teamwork", "Leadership", "Problem Solving", "Decision Making", "Time Management", "Adaptability", "Teamwork", "Leadership Skills", "Communication Skills", "Leadership", "Team Management", "Project Management", "Problem Solving", "Decision Making", "Time Management", "Adaptability", "Teamwork"]
 
-    Search results:
+    Return a JSON array with exactly one object per person: {{"id": <the person's ID>, "tags": [<tags>]}}.
 
-    LinkedIn Data:
-    {mixrank_data}
+    {people}
+    """
 
-    Exa Data:
-    {exa_data}
 
-    Return only relevant tags, separated by commas.
+def _clean_tags(raw_tags) -> list:
+    # lowercase, strip stray quotes, drop empties and deduplicate (keeping Gemini's order)
+    tags = (tag.strip().strip('"').strip().lower() for tag in raw_tags if isinstance(tag, str))
+    return list(dict.fromkeys(tag for tag in tags if tag))
+
+
+def _generate_tags_chunk(chunk: dict) -> dict:
+    """
+    One structured-output Gemini call for up to GEMINI_TAG_BATCH_SIZE people.
+    Returns {id: tags} for every person whose entry came back well-formed.
     """
+    # Trimmed, deterministic projections of the raw payloads keep the prompt small
+    projections = {
+        person_id: compact_payload(mixrank_data, exa_data)
+        for person_id, (exa_data, mixrank_data) in chunk.items()
+    }
+    people = "\n".join(
+        f"""
+    Person ID: {person_id}
 
+    LinkedIn Data:
+    {projection.mixrank}
+
+    Exa Data:
+    {projection.exa}
+    """
+        for person_id, projection in projections.items()
+    )
+    saved = sum(p.saved_tokens for p in projections.values())
+    prompt_tokens = sum(p.tokens for p in projections.values())
+    logger.debug(
+        "tagging %d connections", len(chunk),
+        extra={"stage": "tags", "prompt_tokens": prompt_tokens, "saved_tokens": saved},
+    )
+    with _provider_slots["gemini"]:
+        response = ratelimit.call(
+            "gemini",
+            _get_gemini_model().generate_content,
+            TAGS_PROMPT.format(people=people),
+            generation_config=genai.GenerationConfig(
+                response_mime_type="application/json",
+                response_schema=list[TaggedPerson],
+            ),
+            request_options={"timeout": GEMINI_TIMEOUT},
+        )
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        metrics.record_tokens(
+            "gemini", "gemini-2.0-flash", getattr(usage, "prompt_token_count", 0), getattr(usage, "candidates_token_count", 0)
+        )
     try:
-        # Generate tags with Gemini
-        response = model.generate_content(prompt)
-        if response.candidates[0].content.parts[0].text:
-            # Split response into individual tags and clean them
-            raw_tags = [tag.strip().lower() for tag in response.candidates[0].content.parts[0].text.split(',')]
-            # Remove any empty strings and deduplicate
-            tags = set(tag for tag in raw_tags if tag)
-            tags = [tag.strip('"') for tag in tags]
-            assert isinstance(tags, list)
-            assert all(isinstance(tag, str) for tag in tags)
-            print(f"Generated {len(tags)} tags from Gemini")
-        else:
-            print("❌ No tags generated from Gemini")
-            tags = []
-    except Exception as e:
-        print(f"❌ Error generating tags with Gemini: {str(e)}")
-        tags = []
-
-    return tags
\ No newline at end of file
+        entries = json.loads(response.text)
+    except (ValueError, AttributeError):
+        return {}
+    wanted = {str(person_id): person_id for person_id in chunk}
+    tags_by_id = {}
+    for entry in entries if isinstance(entries, list) else []:
+        if not isinstance(entry, dict) or not isinstance(entry.get("tags"), list):
+            continue
+        person_id = wanted.get(str(entry.get("id")))
+        if person_id is not None:
+            tags_by_id[person_id] = _clean_tags(entry["tags"])
+    return tags_by_id
+
+
+def process_tags_batch(people: dict) -> dict:
+    """
+    Tag many connections with few Gemini calls.  `people` maps an ID to (exa_data, mixrank_data);
+    returns {id: tags}.  IDs are packed GEMINI_TAG_BATCH_SIZE to a prompt so the instructions and
+    few-shot examples are paid for once per chunk.  Entries missing or malformed in the response
+    are retried on their own (in smaller chunks), never the whole batch; anything still failing
+    after GEMINI_TAG_RETRIES gets [].
+    """
+    tags_by_id = {}
+    pending = dict(people)
+    chunk_size = GEMINI_TAG_BATCH_SIZE
+    for attempt in range(GEMINI_TAG_RETRIES + 1):
+        if not pending:
+            break
+        ids = list(pending)
+        for start in range(0, len(ids), chunk_size):
+            chunk = {person_id: pending[person_id] for person_id in ids[start:start + chunk_size]}
+            try:
+                tags_by_id.update(_generate_tags_chunk(chunk))
+            except Exception as e:
+                logger.warning("generating tags with Gemini failed: %s", e, extra={"stage": "tags"})
+        pending = {person_id: data for person_id, data in pending.items() if person_id not in tags_by_id}
+        if pending:
+            logger.debug("%d tag results missing or malformed, retrying those only", len(pending), extra={"stage": "tags"})
+        chunk_size = max(1, chunk_size // 2)
+
+    for person_id in pending:
+        tags_by_id[person_id] = []
+    logger.debug(
+        "generated tags for %d/%d connections", len(people) - len(pending), len(people),
+        extra={"stage": "tags", "failed": len(pending)},
+    )
+    return tags_by_id
+
+
+def process_tags(exa_data, mixrank_data):
+    """Tags for a single person; see process_tags_batch."""
+    return process_tags_batch({0: (exa_data, mixrank_data)})[0]
@@ -0,0 +1,167 @@
+"""
+Sharded enrichment workers.
+
+One `_enrich_connections` process is bound to a single core, so this entry point fans the
+backlog out over N processes on this host and, with --shard-index/--shard-count, over several
+hosts.  Every process owns the disjoint slice `id % total_shards == shard`, claims rows from it
+with leases (see enrichment.py), heartbeats while it works and hands unfinished rows back on
+SIGTERM/SIGINT.  Rows left behind by a worker that died outright become claimable again once
+their lease lapses, and since no other process claims from that shard, the parent respawns a
+worker that crashed or was killed (up to --max-restarts times) as soon as its shard has claimable
+rows again.  The parent logs aggregate progress for the whole backlog while it waits.
+
+    python enrichment_worker.py --processes 4 --threads 8
+    python enrichment_worker.py --processes 4 --shard-index 1 --shard-count 3   # host 2 of 3
+    python enrichment_worker.py --refresh-age-days 30   # also re-enrich anything older than 30 days
+"""
+import argparse
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+from datetime import datetime, timedelta
+
+from logging_setup import configure_logging
+
+
+logger = logging.getLogger("delphi.enrichment.worker")
+
+
+def _create_app():
+    from app import create_app
+
+    return create_app()
+
+
+def _run_shard(shard_index: int, shard_count: int, threads: int, refresh_age: float = None) -> None:
+    from enrichment import _enrich_connections
+
+    stop_event = threading.Event()
+
+    configure_logging()
+
+    def _stop(signum, frame):
+        logger.info("stopping after the current batch", extra={"shard": f"{shard_index}/{shard_count}"})
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    app = _create_app()
+    with app.app_context():
+        _enrich_connections(
+            workers=threads, shard=(shard_index, shard_count), stop_event=stop_event, refresh_age=refresh_age
+        )
+
+
+def _backlog(app, refresh_before: datetime = None, shard: tuple = None) -> dict:
+    from enrichment import enrichment_progress
+
+    with app.app_context():
+        return enrichment_progress(shard=shard, refresh_before=refresh_before)
+
+
+def _report_progress(app, started: float, baseline: int, refresh_before: datetime = None) -> None:
+    counts = _backlog(app, refresh_before)
+    done = counts["enriched"] - baseline
+    elapsed = time.monotonic() - started
+    rate = done / elapsed if elapsed > 0 else 0.0
+    eta_minutes = round(counts["pending"] / rate / 60, 1) if rate > 0 else None
+    logger.info(
+        "backlog progress",
+        extra={"stage": "progress", **counts, "rate_per_s": round(rate, 2), "eta_minutes": eta_minutes},
+    )
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Run sharded enrichment workers")
+    parser.add_argument("--processes", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--threads", type=int, default=None, help="worker threads per process")
+    parser.add_argument("--shard-index", type=int, default=0, help="this host's index")
+    parser.add_argument("--shard-count", type=int, default=1, help="number of hosts")
+    parser.add_argument("--progress-interval", type=float, default=30.0)
+    parser.add_argument("--max-restarts", type=int, default=5,
+                        help="times a crashed shard worker is respawned before giving up on its shard")
+    parser.add_argument("--refresh-age-days", type=float, default=None,
+                        help="also re-enrich connections enriched more than this many days ago")
+    args = parser.parse_args(argv)
+    if not 0 <= args.shard_index < args.shard_count:
+        parser.error("--shard-index must be in [0, --shard-count)")
+
+    # host h with P processes owns global shards h*P .. h*P + P-1 of shard_count*P
+    total_shards = args.shard_count * args.processes
+    shards = [args.shard_index * args.processes + p for p in range(args.processes)]
+
+    refresh_age = args.refresh_age_days * 86400 if args.refresh_age_days else None
+    refresh_before = datetime.utcnow() - timedelta(seconds=refresh_age) if refresh_age else None
+
+    configure_logging()
+    ctx = multiprocessing.get_context("spawn")
+    stopping = threading.Event()
+
+    def spawn(shard: int):
+        worker = ctx.Process(
+            target=_run_shard, args=(shard, total_shards, args.threads, refresh_age), name=f"enrich-shard-{shard}"
+        )
+        worker.start()
+        return worker
+
+    running = {shard: spawn(shard) for shard in shards}
+
+    def _stop(signum, frame):
+        # children handle SIGINT/SIGTERM themselves; the parent stops respawning and waits for them
+        stopping.set()
+        if signum == signal.SIGTERM:
+            for worker in running.values():
+                if worker.is_alive():
+                    worker.terminate()
+
+    signal.signal(signal.SIGINT, _stop)
+    signal.signal(signal.SIGTERM, _stop)
+
+    app = _create_app()
+    started = time.monotonic()
+    baseline = _backlog(app, refresh_before)["enriched"]
+    restarts = dict.fromkeys(shards, 0)
+    orphaned = set()   # shards whose worker died with work left
+    failed = []
+    while running or orphaned:
+        if running:
+            next(iter(running.values())).join(timeout=args.progress_interval)
+        else:
+            time.sleep(args.progress_interval)
+        _report_progress(app, started, baseline, refresh_before)
+
+        for shard, worker in list(running.items()):
+            if worker.is_alive():
+                continue
+            del running[shard]
+            if not worker.exitcode:
+                continue
+            if stopping.is_set() or restarts[shard] >= args.max_restarts:
+                failed.append(worker.name)
+                continue
+            logger.warning(
+                "%s exited with %s", worker.name, worker.exitcode,
+                extra={"shard": f"{shard}/{total_shards}", "restarts": restarts[shard]},
+            )
+            orphaned.add(shard)
+
+        if stopping.is_set():
+            orphaned.clear()
+        for shard in list(orphaned):
+            counts = _backlog(app, refresh_before, (shard, total_shards))
+            if counts["pending"]:
+                orphaned.discard(shard)
+                restarts[shard] += 1
+                running[shard] = spawn(shard)
+            elif not counts["in_progress"]:
+                orphaned.discard(shard)   # nothing left in the shard after all
+            # else the dead worker's leases haven't lapsed yet: check again next round
+
+    if failed:
+        raise SystemExit(f"Workers exited with errors: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,30 @@ interface Candidate {
 
 type ManualMode = 'enrich' | 'confirm' | null;
 
+// Parse a Server-Sent Events body into { event, data } pairs as frames arrive
+async function* readEvents(body: ReadableStream<Uint8Array>) {
+  const reader = body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let boundary: number;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const frame = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      let event = 'message';
+      const data: string[] = [];
+      for (const line of frame.split('\n')) {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) data.push(line.slice(5).trim());
+      }
+      if (data.length) yield { event, data: JSON.parse(data.join('\n')) };
+    }
+  }
+}
+
 export default function Home() {
   const [name, setName] = useState('');
   const [socialUrl, setSocialUrl] = useState('');
@@ -33,26 +57,36 @@ export default function Home() {
       const payload: any = { name };
       if (url) payload.social_url = url;
 
-      const response = await fetch(`${backendUrl}/api/enrich`, {
+      const response = await fetch(`${backendUrl}/api/enrich/stream`, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', Accept: 'text/event-stream' },
         body: JSON.stringify(payload),
         credentials: 'include',
       });
 
-      const data = await response.json();
-      if (!response.ok) throw new Error(data.error || 'Enrichment failed');
+      if (!response.ok || !response.body) {
+        const data = await response.json().catch(() => ({}));
+        throw new Error(data.detail || data.error || 'Enrichment failed');
+      }
 
-      if (data.require_social_url) {
-        setRequireUrl(true);
-        setManualMode('enrich');
-        setUrlMessage(data.message || 'Please provide a social URL');
-        if (data.location) setLocation(data.location);
-      } else if (data.candidates) {
-        setLocation(data.location || '');
-        setCandidates(data.candidates);
-      } else {
-        setError('Unexpected response from server');
+      // Candidates render as soon as each one arrives over the event stream
+      for await (const { event, data } of readEvents(response.body)) {
+        if (event === 'location') {
+          setLocation(data.location || '');
+        } else if (event === 'candidate') {
+          setCandidates((prev) => [...prev, data]);
+        } else if (event === 'require_social_url') {
+          setRequireUrl(true);
+          setManualMode('enrich');
+          setUrlMessage(data.message || 'Please provide a social URL');
+          if (data.location) setLocation(data.location);
+        } else if (event === 'done') {
+          break;
+        } else if (event === 'error') {
+          throw new Error(data.detail || 'Enrichment failed');
+        } else if (event === 'social_url') {
+          setError('Unexpected response from server');
+        }
       }
     } catch (err: any) {
       setError(err.message || 'An error occurred');
@@ -0,0 +1,111 @@
+"""
+Long-lived, pooled HTTP clients for Mixrank, Exa and ip-api.
+
+Creating a client per call (or using the module-level requests/httpx helpers) pays for a fresh
+TCP + TLS handshake every time.  Instead the batch enricher shares one `requests.Session` across
+its worker threads and the FastAPI backend opens one `httpx.AsyncClient` for the lifetime of the
+app (see the lifespan hook in backend/app.py).  Both are sized from the environment:
+
+    HTTP_POOL_SIZE                max connections per host (requests) / in total (httpx)
+    HTTP_POOL_HOSTS               distinct hosts kept pooled by the requests session
+    HTTP_KEEPALIVE_CONNECTIONS    idle keep-alive connections kept by the async client
+    HTTP_KEEPALIVE_EXPIRY         seconds an idle connection is kept open
+    HTTP2                         "1" to negotiate HTTP/2 on the async client (needs `h2`)
+"""
+import logging
+import os
+import threading
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "32"))
+HTTP_POOL_HOSTS = int(os.getenv("HTTP_POOL_HOSTS", "8"))
+HTTP_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_KEEPALIVE_CONNECTIONS", "16"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP2 = os.getenv("HTTP2", "").lower() in ("1", "true", "yes")
+
+logger = logging.getLogger("delphi.http")
+
+
+# ---------------------------------------------------------------------- #
+# Sync: one requests.Session shared by the batch worker threads
+# ---------------------------------------------------------------------- #
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def close_session() -> None:
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+# ---------------------------------------------------------------------- #
+# Async: one httpx.AsyncClient owned by the FastAPI lifespan
+# ---------------------------------------------------------------------- #
+_async_client = None
+
+
+def _http2_enabled() -> bool:
+    if not HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logger.warning("HTTP2 requested but the `h2` package is not installed; using HTTP/1.1")
+        return False
+    return True
+
+
+def create_async_client():
+    import httpx
+
+    return httpx.AsyncClient(
+        http2=_http2_enabled(),
+        limits=httpx.Limits(
+            max_connections=HTTP_POOL_SIZE,
+            max_keepalive_connections=HTTP_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(20.0, connect=5.0),
+    )
+
+
+async def open_async_client():
+    global _async_client
+    if _async_client is None:
+        _async_client = create_async_client()
+    return _async_client
+
+
+async def close_async_client() -> None:
+    global _async_client
+    if _async_client is not None:
+        client, _async_client = _async_client, None
+        await client.aclose()
+
+
+def async_client():
+    """The shared async client; created lazily when used outside the app lifespan."""
+    global _async_client
+    if _async_client is None:
+        _async_client = create_async_client()
+    return _async_client
@@ -0,0 +1,83 @@
+"""
+Structured, non-blocking logging for everything under the "delphi" logger.
+
+`configure_logging()` puts a QueueHandler on the "delphi" logger, so a worker thread that logs
+only enqueues the record; a QueueListener thread does the formatting and the stdout write.  The
+"delphi" tree doesn't propagate, which keeps Flask's and uvicorn's own handlers out of it.
+
+    LOG_LEVEL     DEBUG / INFO (default) / WARNING ...; DEBUG adds per-field enrichment detail
+    LOG_FORMAT    "json" (default): one object per line, `extra=` fields (connection_id, stage,
+                  ...) as top-level keys; "text" for a plain human-readable line
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+from datetime import datetime, timezone
+
+
+# Attributes every LogRecord has; anything else on a record came in through `extra=`
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+_listener = None
+_lock = threading.Lock()
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update((k, v) for k, v in vars(record).items() if k not in _RECORD_FIELDS and not k.startswith("_"))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The stdlib version pre-formats into `msg` and drops exc_info; keep both for the JSON
+        # formatter, only resolving args (which may not be safe to read from another thread).
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        return record
+
+
+def configure_logging(level: str = None, fmt: str = None) -> None:
+    """Idempotent; safe to call from every entry point."""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return
+        fmt = (fmt or os.getenv("LOG_FORMAT", "json")).lower()
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(
+            JSONFormatter() if fmt == "json"
+            else logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+        )
+        records = queue.SimpleQueue()
+        _listener = logging.handlers.QueueListener(records, handler)
+        logger = logging.getLogger("delphi")
+        logger.handlers = [_QueueHandler(records)]
+        logger.setLevel((level or os.getenv("LOG_LEVEL", "INFO")).upper())
+        logger.propagate = False
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """Flush whatever is still queued."""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
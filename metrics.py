@@ -0,0 +1,211 @@
+"""
+In-process metrics for the API and the batch enricher.
+
+Counters and latency histograms keyed by name + labels, kept in one process-wide registry:
+
+    metrics.inc("delphi_provider_retries_total", provider="exa")
+    with metrics.timed("delphi_stage_seconds", stage="geo"):
+        ...
+
+`timed` adds an `outcome` label ("ok" / "error"), so error rates come from the same series as
+the latencies.  Values that already live elsewhere (cache hit counters, LLM parse stats, prompt
+token totals) are pulled in at scrape time by collectors registered with `register_collector`.
+`render()` produces the Prometheus text format for /metrics; `summary_table()` a human-readable
+p50/p95/p99 table for the end of a batch run.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Tuple
+
+
+# Seconds; wide enough for both ip-api lookups and slow search-model completions
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, tuple], float] = {}
+_histograms: Dict[Tuple[str, tuple], "Histogram"] = {}
+_collectors: List[Callable[[], Iterable[Tuple[str, dict, float]]]] = []
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimated from the buckets by linear interpolation, like Prometheus' histogram_quantile."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+
+def _key(name: str, labels: dict) -> Tuple[str, tuple]:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels) -> None:
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name: str, value: float, **labels) -> None:
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.observe(value)
+
+
+@contextmanager
+def timed(name: str, **labels):
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        observe(name, time.perf_counter() - started, outcome=outcome, **labels)
+
+
+def record_tokens(provider: str, model: str, prompt: int = 0, completion: int = 0) -> None:
+    if prompt:
+        inc("delphi_llm_tokens_total", prompt, provider=provider, model=model, kind="prompt")
+    if completion:
+        inc("delphi_llm_tokens_total", completion, provider=provider, model=model, kind="completion")
+
+
+def register_collector(fn: Callable[[], Iterable[Tuple[str, dict, float]]]) -> None:
+    """`fn()` yields (name, labels, value) gauges, read on every render."""
+    _collectors.append(fn)
+
+
+def cache_collector(name: str, cache) -> Callable:
+    """Collector for anything with a cache-style `stats()` (LRUCache, PersistentCache, SingleFlight)."""
+    def collect():
+        for stat, value in cache.stats().items():
+            if isinstance(value, (int, float)):
+                yield f"delphi_cache_{stat}", {"cache": name}, value
+    return collect
+
+
+def dict_collector(prefix: str, values: dict, **labels) -> Callable:
+    """Collector for a module-level dict of running totals (e.g. llm_json.stats, payloads.totals)."""
+    def collect():
+        for stat, value in list(values.items()):
+            if isinstance(value, (int, float)):
+                yield f"{prefix}_{stat}", labels, value
+    return collect
+
+
+def _labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+def _snapshot():
+    with _lock:
+        counters = dict(_counters)
+        histograms = {
+            key: (h.buckets, list(h.counts), h.sum, h.count, {q: h.quantile(q) for q in (0.5, 0.95, 0.99)})
+            for key, h in _histograms.items()
+        }
+    gauges = {}
+    for collect in list(_collectors):
+        try:
+            for name, labels, value in collect():
+                gauges[_key(name, labels)] = value
+        except Exception:
+            continue   # a broken collector shouldn't take /metrics down with it
+    return counters, histograms, gauges
+
+
+def render() -> str:
+    """Prometheus text exposition format."""
+    counters, histograms, gauges = _snapshot()
+    lines = []
+    for kind, series in (("counter", counters), ("gauge", gauges)):
+        for name in sorted({name for name, _ in series}):
+            lines.append(f"# TYPE {name} {kind}")
+            for (series_name, labels), value in sorted(series.items()):
+                if series_name == name:
+                    lines.append(f"{name}{_labels(labels)} {value}")
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f"# TYPE {name} histogram")
+        for (series_name, labels), (buckets, counts, total, count, _) in sorted(histograms.items()):
+            if series_name != name:
+                continue
+            cumulative = 0
+            for bound, n in zip(list(buckets) + ["+Inf"], counts):
+                cumulative += n
+                lines.append(f"{name}_bucket{_labels(labels, (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {total}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def snapshot() -> dict:
+    """JSON-friendly summary: per-series count/mean/p50/p95/p99 (ms), counters and gauges."""
+    counters, histograms, gauges = _snapshot()
+
+    def label(name, labels):
+        return name + _labels(labels)
+
+    return {
+        "latency_ms": {
+            label(*key): {
+                "count": count,
+                "mean": round(total / count * 1000, 1) if count else 0.0,
+                **{f"p{int(q * 100)}": round(v * 1000, 1) for q, v in quantiles.items()},
+            }
+            for key, (_, _, total, count, quantiles) in sorted(histograms.items())
+        },
+        "counters": {label(*key): value for key, value in sorted(counters.items())},
+        "gauges": {label(*key): value for key, value in sorted(gauges.items())},
+    }
+
+
+def summary_table() -> str:
+    data = snapshot()
+    rows = [("series", "count", "mean ms", "p50 ms", "p95 ms", "p99 ms")]
+    rows += [
+        (series, str(s["count"]), str(s["mean"]), str(s["p50"]), str(s["p95"]), str(s["p99"]))
+        for series, s in data["latency_ms"].items()
+    ]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    lines = ["  ".join(cell.ljust(w) if i == 0 else cell.rjust(w) for i, (cell, w) in enumerate(zip(row, widths)))
+             for row in rows]
+    lines.insert(1, "-" * len(lines[0]))
+    for section in ("counters", "gauges"):
+        if data[section]:
+            lines.append("")
+            lines += [f"{name}  {value:g}" for name, value in data[section].items()]
+    return "\n".join(lines)
+
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
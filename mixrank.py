@@ -0,0 +1,107 @@
+"""
+Mixrank `/linkedin/profile` lookups shared by the batch enricher and the API.
+
+Both paths ask for the same endpoint with the same parameters and go through the shared
+`mixrank_cache`, so a profile fetched by one is a cache hit for the other.  `fetch_profile` is the
+blocking flavour (pooled requests.Session), `fetch_profile_async` the event-loop one (pooled
+httpx client, and the cache's SQLite tier off the loop).  Both raise on HTTP/transport errors and return {} when Mixrank has no profile.
+
+`profile_fields` maps a profile onto our Connection columns; the batch job and the API store
+both apply it with the same fill-only-empty-fields rule.
+"""
+import os
+from datetime import datetime
+from typing import Optional
+
+import http_pool
+import ratelimit
+import resilience
+from cache import MIXRANK_MAXAGE, mixrank_cache, mixrank_key
+
+
+MIXRANK_BASE_URL = os.getenv("MIXRANK_BASE_URL", "https://api.mixrank.com/v2/json").rstrip("/")
+PROFILE_ENDPOINT = "linkedin/profile"
+MIXRANK_TIMEOUT = 20
+
+
+def _profile_request(url: str, api_key: Optional[str]):
+    endpoint = f"{MIXRANK_BASE_URL}/{api_key or os.getenv('MIXRANK_API_KEY')}/{PROFILE_ENDPOINT}"
+    params = {"url": url, "strategy": "strict", "maxage": str(MIXRANK_MAXAGE)}
+    return endpoint, params
+
+
+def fetch_profile(url: str, api_key: Optional[str] = None) -> dict:
+    key = mixrank_key(PROFILE_ENDPOINT, url)
+    cached = mixrank_cache.get(key)
+    if cached:
+        return cached
+    endpoint, params = _profile_request(url, api_key)
+    resp = ratelimit.call("mixrank", http_pool.get_session().get, endpoint, params=params, timeout=MIXRANK_TIMEOUT)
+    resp.raise_for_status()
+    data = resp.json() or {}
+    if data:
+        mixrank_cache.set(key, data)
+    return data
+
+
+async def fetch_profile_async(url: str, api_key: Optional[str] = None) -> dict:
+    key = mixrank_key(PROFILE_ENDPOINT, url)
+    cached = await mixrank_cache.get_async(key)
+    if cached:
+        return cached
+    endpoint, params = _profile_request(url, api_key)
+    # a profile lookup is idempotent, so it may be hedged (HEDGE_PROVIDERS, off by default: it's billed)
+    resp = await resilience.hedged("mixrank", lambda: ratelimit.call_async(
+        "mixrank", http_pool.async_client().get, endpoint, params=params, timeout=MIXRANK_TIMEOUT
+    ))
+    resp.raise_for_status()
+    data = resp.json() or {}
+    if data:
+        await mixrank_cache.set_async(key, data)
+    return data
+
+
+def profile_fields(data: dict) -> dict:
+    """Connection column -> value for every field the profile has data for."""
+    if not data:
+        return {}
+    fields = {
+        "headline": data.get("headline"),
+        "location": data.get("locality"),
+        "profile_image_url": data.get("picture_url_orig"),
+        "skills": data.get("skills"),
+        "volunteering": data.get("volunteering"),
+        "publications": data.get("publications"),
+        "awards": data.get("awards"),
+    }
+    if data.get("education"):
+        fields["education"] = [
+            {
+                "school_name": edu.get("school_name"),
+                "field_of_study": None,  # Not available in this API
+                "degree": edu.get("degree"),
+                "start_date": edu.get("start_date"),
+                "end_date": edu.get("end_date"),
+                "activities": edu.get("activities"),
+            }
+            for edu in data["education"]
+        ]
+    experience = data.get("experience") or []
+    if experience:
+        current_pos = next((p for p in experience if p.get("is_current")), experience[0])
+        fields["current_company"] = current_pos.get("company")
+        fields["previous_companies"] = sorted(
+            {p.get("company") for p in experience if p.get("company")} - {current_pos.get("company")}
+        )
+    fields["current_company"] = fields.get("current_company") or data.get("company_name")
+    if data.get("certifications"):
+        fields["certifications"] = [
+            {"title": cert.get("title"), "company_name": cert.get("company_name"), "date": cert.get("date")}
+            for cert in data["certifications"]
+        ]
+    if data.get("dob"):
+        try:
+            fields["date_of_birth"] = datetime.strptime(data["dob"], "%Y-%m-%d").date()
+        except (ValueError, TypeError):
+            pass
+    return {column: value for column, value in fields.items() if value}
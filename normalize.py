@@ -0,0 +1,41 @@
+"""
+Canonical forms for the identifiers we key caches and lookups on.
+"""
+import re
+import unicodedata
+from urllib.parse import unquote, urlsplit
+
+
+_NON_WORD = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_linkedin_url(url: str) -> str:
+    """
+    Reduce the many spellings of a LinkedIn profile URL to one:
+    "HTTP://uk.LinkedIn.com/in/Jane-Doe/?trk=x"  ->  "https://www.linkedin.com/in/jane-doe".
+    Non-LinkedIn URLs are just trimmed and lowercased.
+    """
+    url = (url or "").strip()
+    if not url:
+        return ""
+    if "://" not in url:
+        url = "https://" + url
+    parts = urlsplit(url)
+    host = parts.netloc.lower().split("@")[-1].split(":")[0]
+    path = unquote(parts.path).lower().rstrip("/")
+    if not (host == "linkedin.com" or host.endswith(".linkedin.com")):
+        return f"{host}{path}"
+    segments = [s for s in path.split("/") if s]
+    # /in/<slug>/details/... and /pub/<slug>/... -> keep the profile root only
+    if len(segments) >= 2 and segments[0] in ("in", "pub"):
+        segments = segments[:2]
+    return "https://www.linkedin.com/" + "/".join(segments)
+
+
+def normalize_name(name: str) -> str:
+    """Lowercase, strip accents and punctuation, collapse whitespace."""
+    name = unicodedata.normalize("NFKD", name or "")
+    name = "".join(ch for ch in name if not unicodedata.combining(ch))
+    name = _NON_WORD.sub(" ", name.lower())
+    return _WHITESPACE.sub(" ", name).strip()
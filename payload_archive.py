@@ -0,0 +1,201 @@
+"""
+Append-only archive of the raw provider payloads behind each enrichment.
+
+Every connection the batch job maps and tags is written as one JSON line: connection ID, profile
+URL, fetch time, the raw Mixrank profile, the Exa results, Gemini's tags and the content hash.
+Lines go into compressed segment files, zstd when the `zstandard` package is installed and gzip
+otherwise.  Each process writes its own segment, named after the time it was opened, as
+`<name>.open`, and renames it once closed.  A segment is closed when it reaches
+PAYLOAD_ARCHIVE_SEGMENT_MB of JSON or when the enrichment run ends.  Nothing is ever rewritten,
+so the archive can be copied or synced while it is written.
+
+The archive makes mapping changes cheap.  `replay` streams every segment and re-applies the
+current `mixrank.profile_fields` mapping and the archived tags to the Connection rows, without
+calling any provider.  With `--retag` it asks Gemini for fresh tags from the archived inputs,
+and still skips Mixrank and Exa:
+
+    python payload_archive.py stats
+    PYTHONPATH=/path/to/flask/project python payload_archive.py replay [--retag] [--include-open]
+
+    PAYLOAD_ARCHIVE_DIR            where segments live; unset disables archiving
+    PAYLOAD_ARCHIVE_SEGMENT_MB     uncompressed MB per segment before rotating (default 256)
+    PAYLOAD_ARCHIVE_COMPRESSION    "zstd", "gzip", or unset for zstd when available
+"""
+import argparse
+import atexit
+import gzip
+import io
+import json
+import logging
+import os
+import threading
+import zlib
+from datetime import datetime
+from typing import Iterator, List, Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+PAYLOAD_ARCHIVE_SEGMENT_MB = float(os.getenv("PAYLOAD_ARCHIVE_SEGMENT_MB", "256"))
+
+_EXTENSIONS = {"zstd": ".jsonl.zst", "gzip": ".jsonl.gz"}
+
+logger = logging.getLogger("delphi.archive")
+
+
+def _compression(requested: Optional[str]) -> str:
+    if requested == "zstd" and zstandard is None:
+        logger.warning("zstd archive compression requested but `zstandard` is not installed; using gzip")
+        return "gzip"
+    if requested in _EXTENSIONS:
+        return requested
+    return "zstd" if zstandard is not None else "gzip"
+
+
+class ArchiveWriter:
+    """Thread-safe appender; one open segment per writer."""
+
+    def __init__(self, directory: str, segment_bytes: int = int(PAYLOAD_ARCHIVE_SEGMENT_MB * 1024 * 1024),
+                 compression: Optional[str] = None):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.compression = _compression(compression)
+        self._lock = threading.Lock()
+        self._raw = self._stream = None
+        self._path = None
+        self._written = 0
+        self._sequence = 0
+        self.records = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_env(cls) -> Optional["ArchiveWriter"]:
+        directory = os.getenv("PAYLOAD_ARCHIVE_DIR")
+        if not directory:
+            return None
+        return cls(directory, compression=os.getenv("PAYLOAD_ARCHIVE_COMPRESSION"))
+
+    def _open(self) -> None:
+        self._sequence += 1
+        name = f"payloads-{datetime.utcnow():%Y%m%dT%H%M%S}-{os.getpid()}-{self._sequence:04d}"
+        self._path = os.path.join(self.directory, name + _EXTENSIONS[self.compression])
+        self._raw = open(self._path + ".open", "wb")
+        if self.compression == "zstd":
+            self._stream = zstandard.ZstdCompressor(level=3).stream_writer(self._raw)
+        else:
+            self._stream = gzip.GzipFile(fileobj=self._raw, mode="wb", compresslevel=6)
+        self._written = 0
+
+    def _close(self) -> None:
+        if self._stream is None:
+            return
+        self._stream.close()   # finishes the frame (and closes the file underneath)
+        if not self._raw.closed:
+            self._raw.close()
+        os.replace(self._path + ".open", self._path)
+        self._raw = self._stream = self._path = None
+
+    def append(self, connection_id: int, profile_url: str, mixrank_data: dict, exa_data: list,
+               tags: List[str], content_hash: Optional[str] = None, fetched_at: Optional[str] = None) -> None:
+        line = json.dumps({
+            "connection_id": connection_id,
+            "profile_url": profile_url,
+            "fetched_at": fetched_at or datetime.utcnow().isoformat(),
+            "mixrank": mixrank_data,
+            "exa": exa_data,
+            "tags": tags,
+            "content_hash": content_hash,
+        }, separators=(",", ":"), default=str).encode() + b"\n"
+        with self._lock:
+            if self._stream is None:
+                self._open()
+            self._stream.write(line)
+            self._written += len(line)
+            self.records += 1
+            if self._written >= self.segment_bytes:
+                self._close()
+
+    def close(self) -> None:
+        """Finish the current segment; the next append starts a new one."""
+        with self._lock:
+            self._close()
+
+
+def segments(directory: str, include_open: bool = False) -> List[str]:
+    """Segment paths in the order they were opened."""
+    if not os.path.isdir(directory):
+        return []
+    names = [
+        name for name in os.listdir(directory)
+        if name.endswith(tuple(_EXTENSIONS.values())) or (include_open and name.endswith(".open"))
+    ]
+    return [os.path.join(directory, name) for name in sorted(names)]
+
+
+def _read_segment(path: str) -> Iterator[bytes]:
+    with open(path, "rb") as raw:
+        if ".jsonl.zst" in path:
+            if zstandard is None:
+                raise RuntimeError(f"{path} is zstd-compressed; install `zstandard` to read it")
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+        else:
+            stream = gzip.GzipFile(fileobj=raw, mode="rb")
+        try:
+            yield from io.BufferedReader(stream, buffer_size=1 << 20)
+        except (EOFError, zlib.error, getattr(zstandard, "ZstdError", EOFError)):
+            # a segment still being written (or cut off by a crash) ends mid-frame
+            logger.warning("segment %s is truncated; stopped at the last complete record", path)
+
+
+def iter_records(directory: str, include_open: bool = False) -> Iterator[dict]:
+    """Every archived record, segment by segment, streamed from disk."""
+    for path in segments(directory, include_open):
+        for line in _read_segment(path):
+            if not line.endswith(b"\n"):
+                break   # partial last line of a truncated segment
+            yield json.loads(line)
+
+
+archive = ArchiveWriter.from_env()
+if archive is not None:
+    atexit.register(archive.close)
+
+
+def main(argv=None) -> None:
+    from logging_setup import configure_logging
+
+    parser = argparse.ArgumentParser(description="Inspect or replay the raw payload archive")
+    parser.add_argument("--dir", default=os.getenv("PAYLOAD_ARCHIVE_DIR"), help="archive directory")
+    parser.add_argument("--include-open", action="store_true", help="also read segments still being written")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("stats", help="count segments, records and connections")
+    replay = sub.add_parser("replay", help="re-map Connection fields and tags from the archive")
+    replay.add_argument("--retag", action="store_true", help="ask Gemini for new tags (no Mixrank/Exa calls)")
+    replay.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args(argv)
+    if not args.dir:
+        parser.error("--dir or PAYLOAD_ARCHIVE_DIR is required")
+
+    configure_logging()
+    if args.command == "stats":
+        paths = segments(args.dir, args.include_open)
+        records, connections = 0, set()
+        for record in iter_records(args.dir, args.include_open):
+            records += 1
+            connections.add(record["connection_id"])
+        size = sum(os.path.getsize(p) for p in paths)
+        print(f"{len(paths)} segments, {size / 1024 / 1024:.1f} MiB, {records} records, {len(connections)} connections")
+        return
+
+    from app import create_app
+    from enrichment import replay_archive
+
+    with create_app().app_context():
+        replay_archive(args.dir, retag=args.retag, batch_size=args.batch_size, include_open=args.include_open)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Compact provider payloads before they go into an LLM prompt.
+
+Raw Mixrank and Exa responses carry picture URLs, internal IDs, scores and long free text, so
+prompt size (and latency, and cost) grows with the size of the profile.  `compact_payload` keeps
+a fixed, deterministic set of fields (headline, experience, education, skills, Exa titles and
+highlights), caps each one and, if the result is still over PROMPT_TOKEN_BUDGET, re-projects with
+tighter caps.  Token counts are estimated at ~4 characters per token; `totals` accumulates the
+raw vs. prompt tokens across calls.
+
+`content_hash` fingerprints everything a refresh could act on: the Connection fields
+`mixrank.profile_fields` maps (uncapped, picture and date of birth included) plus the projections
+the tagger sees.  A refresh can then tell whether anything it would write has changed.
+`field_hash` fingerprints a single column value, so a refresh can tell whether a column still
+holds what the provider gave it last time or has been edited (or imported) since.
+"""
+import hashlib
+import json
+import os
+import threading
+from typing import NamedTuple, Optional
+
+import mixrank
+
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1500"))
+
+# Progressively tighter caps, tried in order until the payload fits the budget
+CAP_LEVELS = [
+    {"text": 400, "items": 8, "skills": 40, "results": 8, "highlights": 3},
+    {"text": 200, "items": 5, "skills": 25, "results": 5, "highlights": 2},
+    {"text": 100, "items": 3, "skills": 15, "results": 3, "highlights": 1},
+]
+
+totals = {"calls": 0, "raw_tokens": 0, "prompt_tokens": 0}
+_totals_lock = threading.Lock()
+
+
+class Projection(NamedTuple):
+    mixrank: str
+    exa: str
+    raw_tokens: int
+    tokens: int
+
+    @property
+    def saved_tokens(self) -> int:
+        return max(0, self.raw_tokens - self.tokens)
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + 3) // 4
+
+
+def _text(value, limit: int) -> Optional[str]:
+    if value is None or value == "":
+        return None
+    value = " ".join(str(value).split())
+    return value if len(value) <= limit else value[:limit - 1] + "…"
+
+
+def _prune(record: dict) -> dict:
+    return {k: v for k, v in record.items() if v not in (None, "", [], {})}
+
+
+def compact_mixrank(data: Optional[dict], caps: dict = CAP_LEVELS[0]) -> dict:
+    """Headline, location, experience, education, skills and credentials from a Mixrank profile."""
+    if not data:
+        return {}
+    # /person/match nests the scraped profile under "linkedin"; /linkedin/profile is flat
+    profile = {**data, **data["linkedin"]} if isinstance(data.get("linkedin"), dict) else data
+    text, items = caps["text"], caps["items"]
+    experience = [
+        _prune({
+            "title": _text(p.get("title"), text),
+            "company": _text(p.get("company") or p.get("company_name"), text),
+            "start": p.get("start_date"),
+            "end": p.get("end_date") or ("present" if p.get("is_current") else None),
+            "description": _text(p.get("description"), text),
+        })
+        for p in (profile.get("experience") or [])[:items] if isinstance(p, dict)
+    ]
+    education = [
+        _prune({
+            "school": _text(e.get("school_name"), text),
+            "degree": _text(e.get("degree"), text),
+            "field": _text(e.get("field_of_study"), text),
+            "end": e.get("end_date"),
+            "activities": _text(e.get("activities"), text),
+        })
+        for e in (profile.get("education") or [])[:items] if isinstance(e, dict)
+    ]
+
+    def titles(key):
+        return [
+            _text(x.get("title") or x.get("name") or x.get("role") if isinstance(x, dict) else x, text)
+            for x in (profile.get(key) or [])[:items]
+        ]
+
+    return _prune({
+        "name": _text(profile.get("name") or profile.get("full_name"), text),
+        "headline": _text(profile.get("headline"), text),
+        "summary": _text(profile.get("summary") or profile.get("about"), text * 2),
+        "location": _text(profile.get("locality") or profile.get("location"), text),
+        "current_company": _text(profile.get("company_name"), text),
+        "experience": [e for e in experience if e],
+        "education": [e for e in education if e],
+        "skills": [_text(s, 60) for s in (profile.get("skills") or [])[:caps["skills"]]],
+        "certifications": titles("certifications"),
+        "awards": titles("awards"),
+        "publications": titles("publications"),
+        "volunteering": titles("volunteering"),
+    })
+
+
+def compact_exa(data, caps: dict = CAP_LEVELS[0]) -> list:
+    """Title, URL and the first few highlights of each Exa result."""
+    results = data.get("results", []) if isinstance(data, dict) else (data or [])
+    compact = []
+    for r in results[:caps["results"]]:
+        if not isinstance(r, dict):
+            continue
+        highlights = r.get("highlights") or ([r["text"]] if r.get("text") else [])
+        compact.append(_prune({
+            "title": _text(r.get("title"), caps["text"]),
+            "url": r.get("url"),
+            "highlights": [_text(h, caps["text"]) for h in highlights[:caps["highlights"]]],
+        }))
+    return compact
+
+
+def _render(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def compact_payload(mixrank_data=None, exa_data=None, token_budget: int = PROMPT_TOKEN_BUDGET) -> Projection:
+    """Project both payloads to the tightest cap level that fits `token_budget`."""
+    raw_tokens = estimate_tokens(str(mixrank_data or "") + str(exa_data or ""))
+    for caps in CAP_LEVELS:
+        mixrank = _render(compact_mixrank(mixrank_data, caps))
+        exa = _render(compact_exa(exa_data, caps)) if exa_data is not None else ""
+        tokens = estimate_tokens(mixrank + exa)
+        if tokens <= token_budget:
+            break
+    else:
+        # still too big at the tightest caps: hard-trim, keeping the budget split proportionally
+        keep = max(1, token_budget * 4)
+        share = len(mixrank) / max(1, len(mixrank) + len(exa))
+        mixrank, exa = mixrank[:int(keep * share)], exa[:keep - int(keep * share)]
+        tokens = estimate_tokens(mixrank + exa)
+    with _totals_lock:
+        totals["calls"] += 1
+        totals["raw_tokens"] += raw_tokens
+        totals["prompt_tokens"] += tokens
+    return Projection(mixrank, exa, raw_tokens, tokens)
+
+
+def _sha256(value) -> str:
+    encoded = json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def field_hash(value) -> str:
+    """Short SHA-256 of one Connection column value."""
+    return _sha256(value)[:16]
+
+
+def content_hash(mixrank_data=None, exa_data=None) -> str:
+    """
+    SHA-256 of the mapped Mixrank fields and the widest-cap projections; Exa results are ordered by
+    URL since their rank drifts.
+    """
+    normalized = {
+        "fields": mixrank.profile_fields(mixrank_data),
+        "mixrank": compact_mixrank(mixrank_data),
+        "exa": sorted(compact_exa(exa_data), key=lambda r: r.get("url") or ""),
+    }
+    return _sha256(normalized)
@@ -0,0 +1,245 @@
+"""
+In-memory index of the people we have already enriched, for answering /api/enrich locally.
+
+Built from Connection rows that have at least one Enrichment row.  People are keyed by canonical
+LinkedIn URL, because the same person is usually imported by many users.  For each person the
+index keeps the normalized name (and the same name without middle names), a phonetic key
+(Soundex of the first and last name, which catches "Jon Smyth" for "John Smith"), and headline,
+company and location for scoring and for the candidate summary.  Like tag_index, it keeps up
+with the enrichment table by reading past an Enrichment.id watermark, and writers in the same
+process can apply their rows straight away with `record()`.
+
+Matches are scored like prerank scores Exa clusters: 0.7 name + 0.3 city when the caller's city
+is known, name alone otherwise.  A name alone never identifies someone, though: `confident()`
+only returns matches whose location also contains the caller's city, that clear
+PEOPLE_INDEX_MIN_SCORE, and that are few enough to show as candidates.  Without a city it returns
+nothing, and the API searches Exa with the `lookup()` hits merged into the results
+(`Person.as_result`).
+
+    PEOPLE_INDEX_MIN_SCORE      minimum match score (0-1) to answer without Exa (default 0.9)
+    PEOPLE_INDEX_SYNC_PAGE      enrichment rows read per sync query (default 5000)
+    PEOPLE_INDEX_SYNC_OVERLAP   IDs below the watermark re-read on each sync (default 1000)
+"""
+import os
+import threading
+from difflib import SequenceMatcher
+from typing import Dict, List, NamedTuple, Set
+
+from sqlalchemy import select
+
+from normalize import normalize_linkedin_url, normalize_name
+
+
+PEOPLE_INDEX_MIN_SCORE = float(os.getenv("PEOPLE_INDEX_MIN_SCORE", "0.9"))
+PEOPLE_INDEX_SYNC_PAGE = int(os.getenv("PEOPLE_INDEX_SYNC_PAGE", "5000"))
+PEOPLE_INDEX_SYNC_OVERLAP = int(os.getenv("PEOPLE_INDEX_SYNC_OVERLAP", "1000"))
+
+PERSON_COLUMNS = ("full_name", "profile_url", "headline", "current_company", "location", "latest_enrichment")
+
+_SOUNDEX_CODES = {
+    **dict.fromkeys("bfpv", "1"), **dict.fromkeys("cgjkqsxz", "2"), **dict.fromkeys("dt", "3"),
+    "l": "4", **dict.fromkeys("mn", "5"), "r": "6",
+}
+
+
+def soundex(word: str) -> str:
+    letters = [ch for ch in word.lower() if "a" <= ch <= "z"]
+    if not letters:
+        return ""
+    code, previous = letters[0].upper(), _SOUNDEX_CODES.get(letters[0], "")
+    for ch in letters[1:]:
+        digit = _SOUNDEX_CODES.get(ch, "")
+        if digit and digit != previous:
+            code += digit
+        if ch not in "hw":   # h and w don't separate letters with the same code
+            previous = digit
+    return (code + "000")[:4]
+
+
+def name_keys(name: str) -> Set[str]:
+    """The full normalized name, plus first + last when there are middle names."""
+    tokens = normalize_name(name).split()
+    if not tokens:
+        return set()
+    keys = {" ".join(tokens)}
+    if len(tokens) > 2:
+        keys.add(f"{tokens[0]} {tokens[-1]}")
+    return keys
+
+
+def phonetic_key(name: str) -> str:
+    tokens = normalize_name(name).split()
+    if len(tokens) < 2:
+        return soundex(tokens[0]) if tokens else ""
+    return f"{soundex(tokens[0])} {soundex(tokens[-1])}"
+
+
+class Person(NamedTuple):
+    url: str
+    name: str
+    headline: str = ""
+    company: str = ""
+    location: str = ""
+    summary: str = ""      # the API's stored summary, when there is one
+
+    def describe(self) -> str:
+        if self.summary:
+            return self.summary
+        role = self.headline or ""
+        if self.company and self.company.lower() not in role.lower():
+            role = f"{role} at {self.company}" if role else f"Works at {self.company}"
+        parts = [part for part in (role, f"based in {self.location}" if self.location else "") if part]
+        return f"{self.name}: {', '.join(parts)}" if parts else self.name
+
+    def as_result(self) -> dict:
+        """This person in the shape of an Exa search result, to rank alongside real ones."""
+        title = " - ".join(part for part in (self.name, self.headline, self.company) if part)
+        description = self.describe()
+        return {"url": self.url, "title": title, "text": description, "highlights": [description]}
+
+
+def in_city(person: Person, city: str) -> bool:
+    """`city` is already normalized; "" is never a match."""
+    return bool(city) and f" {city} " in f" {normalize_name(person.location)} "
+
+
+class PeopleIndex:
+    def __init__(self):
+        self.people: Dict[str, Person] = {}
+        self.by_name: Dict[str, Set[str]] = {}
+        self.by_phonetic: Dict[str, Set[str]] = {}
+        self.watermark = 0
+        self.ready = False
+        self.syncs = 0
+        self._lock = threading.Lock()
+
+    def _unindex(self, person: Person) -> None:
+        for index, keys in ((self.by_name, name_keys(person.name)), (self.by_phonetic, {phonetic_key(person.name)})):
+            for key in keys:
+                urls = index.get(key)
+                if urls is not None:
+                    urls.discard(person.url)
+                    if not urls:
+                        del index[key]
+
+    def _apply(self, row: dict) -> None:
+        url = normalize_linkedin_url(row.get("profile_url") or "")
+        name = (row.get("full_name") or "").strip()
+        if not url or not name:
+            return
+        blob = row.get("latest_enrichment") or {}
+        incoming = Person(
+            url=url,
+            name=name,
+            headline=row.get("headline") or "",
+            company=row.get("current_company") or "",
+            location=row.get("location") or "",
+            summary=(blob.get("summary") or "") if isinstance(blob, dict) else "",
+        )
+        existing = self.people.get(url)
+        if existing is not None:
+            self._unindex(existing)
+            # several users imported this person: newer non-empty fields win, the rest are kept
+            incoming = Person(*(new or old for new, old in zip(incoming, existing)))
+        self.people[url] = incoming
+        for key in name_keys(incoming.name):
+            self.by_name.setdefault(key, set()).add(url)
+        phonetic = phonetic_key(incoming.name)
+        if phonetic:
+            self.by_phonetic.setdefault(phonetic, set()).add(url)
+
+    def record(self, **row) -> None:
+        """Apply a just-written connection (PERSON_COLUMNS as keywords) ahead of the next sync()."""
+        with self._lock:
+            self._apply(row)
+
+    def sync(self, engine, connection_table, enrichment_table, page: int = PEOPLE_INDEX_SYNC_PAGE,
+             overlap: int = PEOPLE_INDEX_SYNC_OVERLAP) -> int:
+        """Re-read the connections enriched since the last sync; returns how many rows were applied."""
+        columns = [connection_table.c[name] for name in PERSON_COLUMNS if name in connection_table.c]
+        # see TagIndex.sync for the overlap
+        cursor = max(self.watermark - overlap, 0) if self.ready else self.watermark
+        applied = 0
+        while True:
+            with engine.connect() as db:
+                enriched = db.execute(
+                    select(enrichment_table.c.id, enrichment_table.c.connection_id)
+                    .where(enrichment_table.c.id > cursor).order_by(enrichment_table.c.id).limit(page)
+                ).all()
+                ids = list({connection_id for _, connection_id in enriched})
+                rows = db.execute(select(*columns).where(connection_table.c.id.in_(ids))).mappings().all() if ids else []
+            with self._lock:
+                for row in rows:
+                    self._apply(dict(row))
+                if enriched:
+                    cursor = enriched[-1][0]
+                self.watermark = max(self.watermark, cursor)
+            applied += len(rows)
+            if len(enriched) < page:
+                break
+        with self._lock:
+            self.ready = True
+            self.syncs += 1
+        return applied
+
+    def lookup(self, name: str, city: str = "") -> List[tuple]:
+        """[(score, Person)] for everyone whose name matches exactly or phonetically, best first."""
+        keys = name_keys(name)
+        if not keys:
+            return []
+        query = normalize_name(name)
+        city = normalize_name(city)
+        with self._lock:
+            exact = set().union(*(self.by_name.get(key, ()) for key in keys))
+            sounds_like = set(self.by_phonetic.get(phonetic_key(name), ())) - exact
+            people = [self.people[url] for url in exact | sounds_like]
+        scored = []
+        for person in people:
+            person_name = normalize_name(person.name)
+            if person_name == query:
+                name_score = 1.0
+            elif person.url in exact:
+                name_score = 0.95   # same first and last name, middle names differ
+            else:
+                name_score = 0.9 * SequenceMatcher(None, query, person_name).ratio()
+            if city:
+                location_score = 1.0 if in_city(person, city) else 0.0
+                score = 0.7 * name_score + 0.3 * location_score
+            else:
+                score = name_score
+            scored.append((round(score, 4), person))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return scored
+
+    def confident(self, name: str, city: str = "", limit: int = 5,
+                  min_score: float = PEOPLE_INDEX_MIN_SCORE) -> List[tuple]:
+        """
+        The confident matches when there are 1..`limit` of them, else [] (nobody we know, too many
+        namesakes to pick from without a search, or no city to tell namesakes apart by).
+        """
+        city = normalize_name(city)
+        if not city:
+            return []
+        matches = [
+            (score, person) for score, person in self.lookup(name, city)
+            if score >= min_score and in_city(person, city)
+        ]
+        return matches if len(matches) <= limit else []
+
+    def stats(self) -> dict:
+        return {
+            "people": len(self.people),
+            "names": len(self.by_name),
+            "watermark": self.watermark,
+            "syncs": self.syncs,
+        }
+
+
+# Process-wide index; the API keeps it in sync, the batch job feeds it whatever it writes
+index = PeopleIndex()
+
+
+def record(connection) -> None:
+    """Hook for writers (any object with the Connection columns): a no-op until the index is loaded."""
+    if index.ready:
+        index.record(**{name: getattr(connection, name, None) for name in PERSON_COLUMNS})
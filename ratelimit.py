@@ -0,0 +1,253 @@
+"""
+Shared rate limiting for every outbound provider call.
+
+Each provider (Mixrank, Exa, OpenAI, Gemini, ip-api) gets one token bucket per process, sized
+from the environment so we can run close to the quota we actually pay for:
+
+    RATE_LIMIT_<PROVIDER>_RPS     sustained requests per second
+    RATE_LIMIT_<PROVIDER>_BURST   bucket capacity
+
+`call` / `call_async` take a token, run the request and, when the provider answers 429 (or 503
+with Retry-After), push the whole bucket back by a jittered exponential delay that honours
+Retry-After before retrying.  The batch enricher uses the sync flavour from its worker threads,
+the FastAPI backend the async one, so both sides share the same limits and backoff rules.
+Every attempt is recorded in `metrics`: time spent waiting for a token, request latency by
+outcome (ok / error / throttled) and retries.  Each attempt also goes through the provider's
+circuit breaker (see resilience.py): `call_async` fails fast while it is open, `call` waits for
+it to reopen.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional, Tuple
+
+import metrics
+import resilience
+
+
+MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", "4"))
+BACKOFF_BASE = float(os.getenv("RATE_LIMIT_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = float(os.getenv("RATE_LIMIT_BACKOFF_MAX", "30"))
+
+# provider -> (requests per second, burst)
+DEFAULT_LIMITS = {
+    "mixrank": (5.0, 10),
+    "exa": (5.0, 5),
+    "openai": (10.0, 20),
+    "gemini": (10.0, 10),
+    "ip-api": (0.75, 5),  # free tier: 45 requests/minute
+}
+
+THROTTLE_STATUSES = (429, 503)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket, implemented as a virtual-schedule (GCRA) so that a reservation is
+    a single arithmetic update under the lock and callers wait outside of it, in FIFO order.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._interval = 1.0 / rate
+        self._tolerance = (self.burst - 1) * self._interval
+        self._tat = 0.0  # theoretical arrival time of the next request
+        self._lock = threading.Lock()
+
+    def _reserve(self, blocking: bool = True) -> Optional[float]:
+        with self._lock:
+            now = time.monotonic()
+            tat = max(self._tat, now)
+            wait = tat - self._tolerance - now
+            if wait > 0 and not blocking:
+                return None
+            self._tat = tat + self._interval
+            return max(0.0, wait)
+
+    def acquire(self) -> None:
+        wait = self._reserve()
+        if wait:
+            time.sleep(wait)
+
+    async def acquire_async(self) -> None:
+        wait = self._reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+    def try_acquire(self) -> bool:
+        """Take a token only if one is available right now."""
+        return self._reserve(blocking=False) is not None
+
+    def penalize(self, delay: float) -> None:
+        """Hold back every caller of this provider for `delay` seconds (429 / Retry-After)."""
+        with self._lock:
+            self._tat = max(self._tat, time.monotonic() + delay + self._tolerance)
+
+
+def _env_limits(provider: str) -> Tuple[float, int]:
+    rate, burst = DEFAULT_LIMITS.get(provider, (5.0, 5))
+    key = provider.upper().replace("-", "_")
+    rate = float(os.getenv(f"RATE_LIMIT_{key}_RPS", rate))
+    burst = int(os.getenv(f"RATE_LIMIT_{key}_BURST", burst))
+    return rate, burst
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def limiter(provider: str) -> TokenBucket:
+    bucket = _buckets.get(provider)
+    if bucket is None:
+        with _buckets_lock:
+            bucket = _buckets.get(provider)
+            if bucket is None:
+                bucket = _buckets[provider] = TokenBucket(*_env_limits(provider))
+    return bucket
+
+
+def retry_after_seconds(value) -> Optional[float]:
+    """Parse a Retry-After header (delta-seconds or HTTP date)."""
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Full-jitter exponential backoff; Retry-After, when given, is a floor."""
+    if retry_after is not None:
+        return min(BACKOFF_MAX, retry_after) + random.uniform(0, BACKOFF_BASE)
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+def throttle_signal(outcome) -> Tuple[bool, Optional[float]]:
+    """
+    Work out whether a response or exception means "slow down".  Handles requests/httpx
+    responses, their HTTP errors, the OpenAI SDK (status_code) and google.api_core (code).
+    """
+    response = outcome if hasattr(outcome, "status_code") and hasattr(outcome, "headers") else None
+    if isinstance(outcome, BaseException):
+        response = getattr(outcome, "response", None)
+    status = getattr(outcome, "status_code", None) or getattr(outcome, "code", None)
+    if status is None and response is not None:
+        status = getattr(response, "status_code", None)
+    try:
+        status = int(status)
+    except (TypeError, ValueError):
+        return False, None
+    if status not in THROTTLE_STATUSES:
+        return False, None
+    headers = getattr(response, "headers", None) or {}
+    retry_after = retry_after_seconds(headers.get("Retry-After"))
+    if status == 503 and retry_after is None:
+        return False, None
+    return True, retry_after
+
+
+def _outcome(throttled: bool, result=None, failed: bool = False) -> str:
+    if throttled:
+        return "throttled"
+    status = getattr(result, "status_code", None)
+    return "error" if failed or (isinstance(status, int) and status >= 400) else "ok"
+
+
+def _observe(provider: str, started: float, outcome: str) -> None:
+    metrics.observe("delphi_provider_request_seconds", time.perf_counter() - started, provider=provider, outcome=outcome)
+
+
+def _failed(outcome: str, result=None) -> Optional[bool]:
+    """Breaker verdict: throttling says nothing about health, and neither do 4xx answers."""
+    if outcome == "throttled":
+        return None
+    if isinstance(result, BaseException) and getattr(result, "response", None) is not None:
+        result = result.response   # requests' Response is falsy for 4xx/5xx, so no `or` here
+    status = getattr(result, "status_code", None)
+    if isinstance(status, int):
+        return status >= 500
+    return outcome == "error"
+
+
+def call(provider: str, fn, *args, **kwargs):
+    """Run a blocking provider call under its bucket, retrying throttled attempts."""
+    bucket = limiter(provider)
+    breaker = resilience.breaker(provider)
+    for attempt in range(MAX_RETRIES + 1):
+        breaker.admit_blocking()
+        started = time.perf_counter()
+        bucket.acquire()
+        metrics.observe("delphi_provider_wait_seconds", time.perf_counter() - started, provider=provider)
+        started = time.perf_counter()
+        failed = None
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as exc:
+            throttled, retry_after = throttle_signal(exc)
+            outcome = _outcome(throttled, failed=True)
+            failed = _failed(outcome, exc)
+            _observe(provider, started, outcome)
+            if not throttled or attempt == MAX_RETRIES:
+                raise
+        else:
+            throttled, retry_after = throttle_signal(result)
+            outcome = _outcome(throttled, result)
+            failed = _failed(outcome, result)
+            _observe(provider, started, outcome)
+            if not throttled or attempt == MAX_RETRIES:
+                return result
+        finally:
+            breaker.record(failed, time.perf_counter() - started)
+        metrics.inc("delphi_provider_retries_total", provider=provider)
+        bucket.penalize(backoff_delay(attempt, retry_after))
+
+
+async def call_async(provider: str, fn, *args, **kwargs):
+    """Async twin of `call` for coroutine functions; fails fast while the breaker is open."""
+    bucket = limiter(provider)
+    breaker = resilience.breaker(provider)
+    for attempt in range(MAX_RETRIES + 1):
+        breaker.admit()
+        started = time.perf_counter()
+        try:
+            await bucket.acquire_async()
+        except BaseException:
+            breaker.record(None, 0.0)   # hand back a probe slot we never used
+            raise
+        metrics.observe("delphi_provider_wait_seconds", time.perf_counter() - started, provider=provider)
+        started = time.perf_counter()
+        failed = None
+        try:
+            result = await fn(*args, **kwargs)
+        except Exception as exc:
+            throttled, retry_after = throttle_signal(exc)
+            outcome = _outcome(throttled, failed=True)
+            failed = _failed(outcome, exc)
+            _observe(provider, started, outcome)
+            if not throttled or attempt == MAX_RETRIES:
+                raise
+        else:
+            throttled, retry_after = throttle_signal(result)
+            outcome = _outcome(throttled, result)
+            failed = _failed(outcome, result)
+            _observe(provider, started, outcome)
+            if not throttled or attempt == MAX_RETRIES:
+                return result
+        finally:
+            # cancelled calls (stage timeouts, lost hedges) report None: slow ones still count
+            breaker.record(failed, time.perf_counter() - started)
+        metrics.inc("delphi_provider_retries_total", provider=provider)
+        bucket.penalize(backoff_delay(attempt, retry_after))
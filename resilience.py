@@ -0,0 +1,298 @@
+"""
+Tail-latency protection for outbound provider calls.
+
+Circuit breakers: one per provider, consulted by `ratelimit.call` / `call_async`, so every
+provider call in the API and the batch enricher goes through one.  A breaker opens when at least
+BREAKER_FAILURE_RATE of the last BREAKER_WINDOW calls failed.  A failure is an exception, a 5xx,
+or a call slower than the provider's slow threshold.  While open, async callers (the API) fail at
+once with CircuitOpenError.  Sync callers (batch workers) wait up to BREAKER_MAX_WAIT for it to
+reopen, rather than burn through the backlog.  After BREAKER_COOLDOWN one probe call is let
+through, and its outcome closes the breaker or reopens it.
+
+Hedging: `hedged(provider, factory)` starts a second copy of an idempotent lookup when the first
+is still running after that provider's recent p95 latency, and takes whichever finishes first.
+Hedges are capped at HEDGE_MAX_RATIO of calls and only used for HEDGE_PROVIDERS.
+
+Deadlines: `deadline(seconds)` (or the `within(seconds)` decorator) sets a request-wide budget
+as a context variable, so it follows the request into the tasks it starts.  `stage_timeout` caps
+a stage's own timeout by what's left, and `optional()` runs a stage that can be skipped
+(geolocation, Exa corroboration), returning a fallback once the budget is gone instead of
+making the user wait.
+
+    BREAKER_WINDOW / BREAKER_MIN_CALLS     calls considered / needed before tripping (20 / 10)
+    BREAKER_FAILURE_RATE                   failure share that opens the breaker (0.5)
+    BREAKER_COOLDOWN                       seconds open before a probe (30)
+    BREAKER_SLOW_SECONDS                   a call this slow counts as failed (per-provider defaults)
+    BREAKER_MAX_WAIT                       seconds a sync caller waits on an open breaker (60)
+    BREAKER_<PROVIDER>_<SETTING>           per-provider override of any of the above
+    HEDGE_PROVIDERS                        comma-separated (default "exa")
+    HEDGE_MAX_RATIO                        hedged share of calls (default 0.1)
+    HEDGE_MIN_DELAY                        floor on the hedge delay, seconds (default 0.05)
+"""
+import asyncio
+import functools
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Optional
+
+import metrics
+
+
+# A call slower than this counts as a failure even if it succeeds.  Keep each at or below the
+# budget the API gives the stage: a call cut at the deadline is only counted if it was already slow.
+DEFAULT_SLOW_SECONDS = {
+    "ip-api": 1.0,    # GEO_STAGE_BUDGET is 1.5
+    "exa": 8.0,
+    "mixrank": 15.0,
+    "openai": 45.0,   # the search model behind URL resolution is slow by design
+    "gemini": 60.0,
+}
+
+HEDGE_PROVIDERS = {p.strip() for p in os.getenv("HEDGE_PROVIDERS", "exa").split(",") if p.strip()}
+HEDGE_MAX_RATIO = float(os.getenv("HEDGE_MAX_RATIO", "0.1"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.05"))
+HEDGE_MIN_SAMPLES = 20
+LATENCY_SAMPLES = 256
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, provider: str, retry_in: float):
+        super().__init__(f"{provider} is unavailable (circuit open, retry in {retry_in:.1f}s)")
+        self.provider = provider
+        self.retry_in = retry_in
+
+
+def _setting(provider: str, name: str, default: float) -> float:
+    key = provider.upper().replace("-", "_")
+    return float(os.getenv(f"BREAKER_{key}_{name}", os.getenv(f"BREAKER_{name}", default)))
+
+
+class CircuitBreaker:
+    def __init__(self, provider: str):
+        self.provider = provider
+        window = int(_setting(provider, "WINDOW", 20))
+        self.min_calls = int(_setting(provider, "MIN_CALLS", 10))
+        self.failure_rate = _setting(provider, "FAILURE_RATE", 0.5)
+        self.cooldown = _setting(provider, "COOLDOWN", 30)
+        self.slow_seconds = _setting(provider, "SLOW_SECONDS", DEFAULT_SLOW_SECONDS.get(provider, 10.0))
+        self.max_wait = _setting(provider, "MAX_WAIT", 60)
+        self.outcomes = deque(maxlen=window)            # True = failed
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)  # successful calls, for the hedge delay
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.calls = self.hedges = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _transition(self, state: str) -> None:
+        self.state = state
+        metrics.inc("delphi_breaker_transitions_total", provider=self.provider, state=state)
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        if state != HALF_OPEN:
+            self._probing = False
+        if state == CLOSED:
+            self.outcomes.clear()
+
+    def allow(self) -> float:
+        """0 when a call may go ahead now, else the seconds until the breaker might let one through."""
+        with self._lock:
+            if self.state == CLOSED:
+                return 0.0
+            if self.state == OPEN:
+                wait = self.opened_at + self.cooldown - time.monotonic()
+                if wait > 0:
+                    return wait
+                self._transition(HALF_OPEN)
+            if self._probing:
+                return min(self.slow_seconds, self.cooldown)
+            self._probing = True   # this caller is the probe
+            return 0.0
+
+    def admit(self) -> None:
+        """Fail fast (async callers): raise CircuitOpenError unless a call may go ahead now."""
+        wait = self.allow()
+        if wait:
+            metrics.inc("delphi_breaker_rejections_total", provider=self.provider)
+            raise CircuitOpenError(self.provider, wait)
+
+    def admit_blocking(self) -> None:
+        """Batch callers: wait (up to max_wait) for the provider to be tried again."""
+        waited = 0.0
+        while True:
+            wait = self.allow()
+            if not wait:
+                return
+            if waited + wait > self.max_wait:
+                metrics.inc("delphi_breaker_rejections_total", provider=self.provider)
+                raise CircuitOpenError(self.provider, wait)
+            time.sleep(wait)
+            waited += wait
+
+    def record(self, failed: Optional[bool], seconds: float) -> None:
+        """
+        Report an admitted call.  `failed=None` is a call that says nothing about health (throttled,
+        or cancelled by the caller) unless it had already run past the slow threshold.
+        """
+        slow = seconds >= self.slow_seconds
+        with self._lock:
+            self.calls += 1
+            if failed is False and not slow:
+                self.latencies.append(seconds)
+            if failed is None and not slow:
+                if self.state == HALF_OPEN:
+                    self._probing = False   # no verdict; let the next caller probe
+                return
+            failed = bool(failed) or slow
+            if self.state == HALF_OPEN:
+                self._transition(OPEN if failed else CLOSED)
+                return
+            if self.state == OPEN:
+                return   # a straggler from before the breaker opened
+            self.outcomes.append(failed)
+            if len(self.outcomes) >= self.min_calls and sum(self.outcomes) / len(self.outcomes) >= self.failure_rate:
+                self._transition(OPEN)
+
+    def hedge_delay(self) -> Optional[float]:
+        """Recent p95 latency, or None until there are enough samples to trust it."""
+        with self._lock:
+            samples = sorted(self.latencies)
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return max(HEDGE_MIN_DELAY, samples[int(0.95 * (len(samples) - 1))])
+
+    def take_hedge(self) -> bool:
+        with self._lock:
+            if self.hedges + 1 > HEDGE_MAX_RATIO * max(self.calls, 1):
+                return False
+            self.hedges += 1
+            return True
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker(provider: str) -> CircuitBreaker:
+    instance = _breakers.get(provider)
+    if instance is None:
+        with _breakers_lock:
+            instance = _breakers.get(provider)
+            if instance is None:
+                instance = _breakers[provider] = CircuitBreaker(provider)
+    return instance
+
+
+def _collect():
+    for provider, instance in list(_breakers.items()):
+        yield "delphi_breaker_state", {"provider": provider}, _STATE_VALUES[instance.state]
+
+
+metrics.register_collector(_collect)
+
+
+# ---------------------------------------------------------------------- #
+# Hedged requests
+# ---------------------------------------------------------------------- #
+async def hedged(provider: str, factory: Callable[[], Awaitable]):
+    """
+    `await factory()`, plus one duplicate if the first is slower than the provider's recent p95.
+    Only for idempotent calls: both may reach the provider.  The loser is cancelled.
+    """
+    instance = breaker(provider)
+    delay = instance.hedge_delay() if provider in HEDGE_PROVIDERS else None
+    left = remaining()
+    if delay is None or (left is not None and left <= delay):
+        return await factory()
+
+    first = asyncio.ensure_future(factory())
+    try:
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done or not instance.take_hedge():
+            return await first
+        second = asyncio.ensure_future(factory())
+        metrics.inc("delphi_hedges_total", provider=provider)
+        try:
+            pending = {first, second}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if not task.cancelled() and task.exception() is None:
+                        metrics.inc("delphi_hedge_wins_total", provider=provider,
+                                    winner="hedge" if task is second else "primary")
+                        return task.result()
+            return first.result()   # both failed: report the original error
+        finally:
+            if not second.done():
+                second.cancel()
+    finally:
+        if not first.done():
+            first.cancel()
+
+
+# ---------------------------------------------------------------------- #
+# Request deadlines
+# ---------------------------------------------------------------------- #
+_deadline: ContextVar[Optional[float]] = ContextVar("delphi_deadline", default=None)
+
+
+@contextmanager
+def deadline(seconds: float):
+    """Request-wide budget for everything awaited inside; a nested scope can only shorten it."""
+    expires = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(min(expires, current) if current is not None else expires)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def within(seconds: float):
+    """Decorator: run an async endpoint under `deadline(seconds)`."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with deadline(seconds):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def remaining() -> Optional[float]:
+    """Seconds left in the current request's budget (None outside a deadline scope)."""
+    expires = _deadline.get()
+    return None if expires is None else expires - time.monotonic()
+
+
+def stage_timeout(limit: float, reserve: float = 0.0) -> float:
+    """A stage's own timeout, cut to what the budget has left after `reserve` for later stages."""
+    left = remaining()
+    if left is None:
+        return limit
+    return max(0.0, min(limit, left - reserve))
+
+
+async def optional(stage: str, awaitable: Awaitable, fallback, limit: float = float("inf"), reserve: float = 0.0):
+    """Run a stage we can do without; `fallback` if it doesn't finish within its share of the budget."""
+    timeout = stage_timeout(limit, reserve)
+    if timeout == float("inf"):
+        return await awaitable
+    try:
+        if timeout <= 0:
+            raise asyncio.TimeoutError
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()   # never started
+        elif isinstance(awaitable, asyncio.Future):
+            awaitable.cancel()
+        metrics.inc("delphi_deadline_cuts_total", stage=stage)
+        return fallback
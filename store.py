@@ -0,0 +1,339 @@
+"""
+Enrichment persistence shared by the batch job and the API.
+
+The batch job writes through the Flask-SQLAlchemy models; the FastAPI backend has no Flask app,
+so `EnrichmentStore` reflects the same tables with SQLAlchemy Core and writes enrichments in the
+form the batch job already uses: Connection fields filled where empty (`mixrank.profile_fields`),
+a versioned `latest_enrichment` blob (`enrichment_blob`) and an Enrichment history row.
+
+The API serves any recent stored enrichment instead of re-enriching, the batch job's included:
+those have no summary, so the API writes one from the stored fields and adds it to the blob
+without a new version (`add_summary`).  The API doesn't tag either.  A connection it enriches
+for the first time is stored with `tagged: false`, so the batch job still picks it up to tag it.
+A connection the batch already enriched keeps its `tagged` and `content_hash` across the API's
+versions, so it isn't queued (or re-tagged on refresh) again.
+
+Profiles are looked up by their slug through an expression index on the connection table
+(`profile_slug`).  The index belongs in the app's migrations (`profile_index`).  With
+STORE_PROFILE_INDEX=1 the store builds it itself on first use, concurrently, so batch writers
+aren't blocked.  The rows it finds are then compared on the full canonical URL.
+
+The batch backlog predicates (`needs_enrichment`, `leased`, `in_shard`, `backlog_counts`) live here
+too, so enrichment.py and the tests use one definition.
+
+    DATABASE_URL                 same database as the Flask app; unset disables the store
+    CONNECTION_TABLE             default "connection"
+    ENRICHMENT_TABLE             default "enrichment"
+    STORED_ENRICHMENT_MAX_AGE    seconds a stored enrichment is served as-is (default 7 days)
+    STORE_PROFILE_INDEX          build the profile slug index at runtime if it is missing (default 0)
+"""
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Optional
+from urllib.parse import quote
+
+from sqlalchemy import DateTime, Index, MetaData, Table, and_, create_engine, false, func, or_, select, true
+from sqlalchemy.exc import SQLAlchemyError
+
+import mixrank
+from normalize import normalize_linkedin_url
+from payloads import field_hash
+
+
+STORED_ENRICHMENT_MAX_AGE = float(os.getenv("STORED_ENRICHMENT_MAX_AGE", str(7 * 24 * 3600)))
+STORE_PROFILE_INDEX = os.getenv("STORE_PROFILE_INDEX", "0") == "1"
+
+# Connection columns the latest_enrichment summary is built from
+SUMMARY_COLUMNS = ("headline", "current_company", "location", "skills", "education", "previous_companies")
+
+# Connection columns returned alongside tag search hits
+CARD_COLUMNS = ("full_name", "headline", "current_company", "location", "profile_url")
+
+logger = logging.getLogger("delphi.store")
+
+
+def profile_slug(column):
+    """
+    SQL for the slug of a stored profile URL ("…/in/Jane-Doe/?trk=x" -> "jane-doe").  The index is
+    built on exactly this expression, so lookups must use it too.
+    """
+    return func.substring(func.lower(column), r"/(?:in|pub)/([^/?#]+)")
+
+
+def profile_index(connection: Table) -> Index:
+    """
+    The slug index `_matching` looks profiles up through.  Built CONCURRENTLY, which can't run in
+    a transaction; from an Alembic migration:
+
+        with op.get_context().autocommit_block():
+            profile_index(Connection.__table__).create(op.get_bind(), checkfirst=True)
+    """
+    return Index(
+        f"ix_{connection.name}_profile_slug", profile_slug(connection.c.profile_url),
+        postgresql_concurrently=True,
+    )
+
+
+# ---------------------------------------------------------------------- #
+# Batch backlog.  `c` is anything with the Connection columns as attributes: the Flask model,
+# or a Core table's `.c`.  None of these may come out NULL, or the row would drop out of both
+# sides of a NOT (see backlog_counts).
+# ---------------------------------------------------------------------- #
+def unenriched(c):
+    # connections that haven't been enriched will have an empty latest_enrichment
+    return or_(c.latest_enrichment.is_(None), ~c.latest_enrichment.has_key("version"))
+
+
+def untagged(c):
+    # enriched by the API, which doesn't tag (see save); blobs without the key are tagged
+    return func.coalesce(c.latest_enrichment["tagged"].astext, "") == "false"
+
+
+def stale(c, refresh_before: Optional[datetime]):
+    # ISO-8601 timestamps compare correctly as strings; no timestamp counts as stale
+    if refresh_before is None:
+        return false()
+    return func.coalesce(c.latest_enrichment["timestamp"].astext, "") < refresh_before.isoformat()
+
+
+def needs_enrichment(c, refresh_before: Optional[datetime] = None):
+    return or_(unenriched(c), untagged(c), stale(c, refresh_before))
+
+
+def leased(c, now: datetime):
+    return and_(
+        c.is_enriching.is_(True),
+        c.enrichment_lease_expires_at.isnot(None),
+        c.enrichment_lease_expires_at >= now,
+    )
+
+
+def in_shard(c, shard: Optional[tuple]):
+    if not shard:
+        return true()
+    index, count = shard
+    return c.id % count == index
+
+
+def backlog_counts(db, connection: Table, refresh_before: Optional[datetime] = None,
+                   shard: Optional[tuple] = None) -> dict:
+    """{enriched, in_progress, pending} over `connection` in one query; `db` is a session or connection."""
+    now = datetime.utcnow()
+    c = connection.c
+    needed = needs_enrichment(c, refresh_before)
+    enriched, in_progress, pending = db.execute(
+        select(
+            func.count().filter(~needed),
+            func.count().filter(and_(needed, leased(c, now))),
+            func.count().filter(and_(needed, ~leased(c, now))),
+        )
+        .select_from(connection)
+        .where(in_shard(c, shard))
+    ).one()
+    return {"enriched": enriched, "in_progress": in_progress, "pending": pending}
+
+
+def stored_profile(row) -> dict:
+    """A connection's stored fields in the Mixrank shape `payloads.compact_mixrank` reads."""
+    return {
+        "full_name": row.get("full_name"),
+        "headline": row.get("headline"),
+        "location": row.get("location"),
+        "company_name": row.get("current_company"),
+        "experience": [{"company": company} for company in row.get("previous_companies") or []],
+        "education": row.get("education") or [],
+        "skills": row.get("skills") or [],
+    }
+
+
+def enrichment_blob(version: int, source: str, values: dict, **extra) -> dict:
+    """The Connection.latest_enrichment blob; `values` maps Connection columns to their values."""
+    def count(column):
+        return len(values.get(column) or [])
+
+    return {
+        "version": version,
+        "source": source,
+        "timestamp": datetime.utcnow().isoformat(),
+        "enrichment_summary": {
+            "headline": values.get("headline"),
+            "current_company": values.get("current_company"),
+            "location": values.get("location"),
+            "skills_count": count("skills"),
+            "education_count": count("education"),
+            "previous_companies_count": count("previous_companies"),
+        },
+        **extra,
+    }
+
+
+def is_fresh(blob: Optional[dict], max_age: float = STORED_ENRICHMENT_MAX_AGE) -> bool:
+    if not blob or "version" not in blob or not blob.get("timestamp"):
+        return False
+    try:
+        stored_at = datetime.fromisoformat(blob["timestamp"])
+    except (TypeError, ValueError):
+        return False
+    return datetime.utcnow() - stored_at <= timedelta(seconds=max_age)
+
+
+class EnrichmentStore:
+    def __init__(self, url: str, connection_table: str = "connection", enrichment_table: str = "enrichment"):
+        self.engine = create_engine(url, pool_pre_ping=True)
+        self._table_names = (connection_table, enrichment_table)
+        self._tables = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> Optional["EnrichmentStore"]:
+        url = os.getenv("DATABASE_URL")
+        if not url:
+            return None
+        # Heroku/Railway style URLs still say postgres://, which SQLAlchemy 2 rejects
+        if url.startswith("postgres://"):
+            url = "postgresql://" + url[len("postgres://"):]
+        return cls(
+            url,
+            os.getenv("CONNECTION_TABLE", "connection"),
+            os.getenv("ENRICHMENT_TABLE", "enrichment"),
+        )
+
+    @property
+    def tables(self):
+        # Reflected on first use so importing the API doesn't need the database up
+        with self._lock:
+            if self._tables is None:
+                metadata = MetaData()
+                self._tables = tuple(Table(name, metadata, autoload_with=self.engine) for name in self._table_names)
+                if STORE_PROFILE_INDEX:
+                    self._ensure_profile_index(self._tables[0])
+        return self._tables
+
+    def _ensure_profile_index(self, connection: Table) -> None:
+        index = profile_index(connection)
+        try:
+            # CONCURRENTLY can't run inside a transaction, and doesn't block writers
+            with self.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as db:
+                index.create(db, checkfirst=True)
+        except SQLAlchemyError:
+            # e.g. no CREATE privilege: lookups still work, they just scan
+            logger.warning("could not create index %s", index.name, exc_info=True)
+
+    def _matching(self, db, url: str, lock: bool = False) -> list:
+        """Connections whose profile_url is this profile, whatever form it was imported in."""
+        connection, _ = self.tables
+        canonical = normalize_linkedin_url(url)
+        slug = canonical.rsplit("/", 1)[-1]
+        # stored URLs may still be percent-encoded; normalize_linkedin_url decodes them
+        slugs = {slug, quote(slug).lower()}
+        query = select(connection).where(profile_slug(connection.c.profile_url).in_(slugs))
+        if lock:
+            query = query.with_for_update(skip_locked=True)
+        return [
+            row for row in db.execute(query).mappings()
+            if row["profile_url"] and normalize_linkedin_url(row["profile_url"]) == canonical
+        ]
+
+    def fresh_enrichment(self, url: str, max_age: float = STORED_ENRICHMENT_MAX_AGE) -> Optional[dict]:
+        """
+        The newest recent latest_enrichment for this profile, whoever wrote it.  One without a
+        summary (the batch job's) comes with the connection's fields as `profile` to write one from.
+        """
+        with self.engine.connect() as db:
+            rows = [row for row in self._matching(db, url) if is_fresh(row["latest_enrichment"], max_age)]
+        if not rows:
+            return None
+        # a summarised blob saves an LLM call, so it wins over a newer one without
+        row = max(rows, key=lambda r: (bool(r["latest_enrichment"].get("summary")), r["latest_enrichment"]["timestamp"]))
+        blob = dict(row["latest_enrichment"])
+        if not blob.get("summary"):
+            blob["profile"] = stored_profile(row)
+        return blob
+
+    def add_summary(self, url: str, summary: str, max_age: float = STORED_ENRICHMENT_MAX_AGE) -> int:
+        """Add a summary to this profile's fresh blobs in place (no new version); returns rows written."""
+        connection, _ = self.tables
+        written = 0
+        with self.engine.begin() as db:
+            for row in self._matching(db, url, lock=True):
+                blob = row["latest_enrichment"]
+                if is_fresh(blob, max_age) and not blob.get("summary"):
+                    db.execute(connection.update().where(connection.c.id == row["id"]).values(
+                        latest_enrichment={**blob, "summary": summary, "linkedin_url": normalize_linkedin_url(url)}
+                    ))
+                    written += 1
+        return written
+
+    def save(self, url: str, mixrank_data: dict, summary: Optional[str], source: str = "api",
+             tags: Optional[list] = None) -> int:
+        """
+        Store an enrichment on every connection for this profile.  Rows a batch worker holds a live
+        lease on (or has locked) are left to it.  Returns the number of connections written.
+        """
+        connection, enrichment = self.tables
+        fields = mixrank.profile_fields(mixrank_data)
+        now = datetime.utcnow()
+        written = 0
+        with self.engine.begin() as db:
+            for row in self._matching(db, url, lock=True):
+                lease = row.get("enrichment_lease_expires_at")
+                if row.get("is_enriching") and lease and lease >= now:
+                    continue
+                previous = row["latest_enrichment"] or {}
+                if is_fresh(previous):
+                    # recent enough already: keep its version, just make sure it has a summary
+                    if summary and not previous.get("summary"):
+                        db.execute(connection.update().where(connection.c.id == row["id"]).values(
+                            latest_enrichment={**previous, "summary": summary, "linkedin_url": normalize_linkedin_url(url)}
+                        ))
+                        written += 1
+                    continue
+                updates = {c: v for c, v in fields.items() if c in connection.c and not row[c]}
+                if "previous_companies" in updates:
+                    current = updates.get("current_company") or row.get("current_company")
+                    updates["previous_companies"] = [c for c in updates["previous_companies"] if c != current]
+                version = db.execute(
+                    select(func.coalesce(func.max(enrichment.c.version), 0))
+                    .where(enrichment.c.connection_id == row["id"])
+                ).scalar() + 1
+                # a connection the batch job already tagged stays tagged, and keeps its input hash
+                # so a refresh with the same inputs still skips re-tagging
+                carried = {"tagged": bool(tags) or ("version" in previous and previous.get("tagged") is not False)}
+                if previous.get("content_hash"):
+                    carried["content_hash"] = previous["content_hash"]
+                # columns filled from Mixrank here, a refresh may replace (enrichment._mapped_hashes)
+                mapped = {**(previous.get("mapped") or {}), **{c: field_hash(v) for c, v in updates.items()}}
+                if mapped:
+                    carried["mapped"] = mapped
+                updates["latest_enrichment"] = enrichment_blob(
+                    version, source, {**row, **updates}, summary=summary, linkedin_url=normalize_linkedin_url(url),
+                    **carried,
+                )
+                db.execute(connection.update().where(connection.c.id == row["id"]).values(**updates))
+                db.execute(enrichment.insert().values(
+                    **_required_defaults(enrichment, now), connection_id=row["id"], version=version, tags=tags or []
+                ))
+                written += 1
+        return written
+
+    def connection_cards(self, ids: list) -> dict:
+        """{id: {full_name, headline, current_company, location, profile_url}} for search results."""
+        connection, _ = self.tables
+        columns = [connection.c[name] for name in CARD_COLUMNS if name in connection.c]
+        with self.engine.connect() as db:
+            rows = db.execute(select(connection.c.id, *columns).where(connection.c.id.in_(ids))).mappings()
+            return {row["id"]: {k: v for k, v in row.items() if k != "id"} for row in rows}
+
+
+def _required_defaults(table: Table, now: datetime) -> dict:
+    # Python-side defaults (created_at=datetime.utcnow) live on the Flask models, not in the schema
+    return {
+        column.name: now
+        for column in table.columns
+        if not column.nullable and column.server_default is None and isinstance(column.type, DateTime)
+    }
+
+
+store = EnrichmentStore.from_env()
@@ -0,0 +1,285 @@
+"""
+In-memory inverted index over Enrichment.tags.
+
+Tags are folded to one canonical form (case, punctuation, hyphens, and synonyms such as
+"facebook" -> "meta"), and each folded tag maps to the set of connection IDs whose latest tagged
+Enrichment row carries it.  The index follows the enrichment table by its primary key: `sync()`
+reads only rows past the highest ID it has seen, so keeping up with the batch job is one
+indexed range query, and a process that writes tags itself can apply them straight away with
+`record()`.  Rows with no tags (the API's stored enrichments) leave a connection's tags alone.
+
+Queries are tags joined by AND (also "," or a "&" with spaces around it) and OR (also "|"), with
+parentheses; AND binds tighter.  A "&" inside a tag ("r&d", "m&a") is part of the tag, and tags
+are folded with the spaces around their "&" removed, so "R & D" is indexed and queried as "r&d".
+Results are ranked by the IDF-weighted query tags each connection matches, so rare tags count
+for more than "leadership".
+
+    software engineer AND (meta OR google)
+
+    TAG_SYNONYMS_PATH         JSON {"canonical": ["synonym", ...]} merged over the built-in groups
+    TAG_INDEX_SYNC_PAGE       enrichment rows read per sync query (default 5000)
+    TAG_INDEX_SYNC_OVERLAP    IDs below the watermark re-read on each sync (default 1000)
+"""
+import heapq
+import json
+import math
+import os
+import re
+import sys
+import threading
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import select
+
+
+TAG_INDEX_SYNC_PAGE = int(os.getenv("TAG_INDEX_SYNC_PAGE", "5000"))
+TAG_INDEX_SYNC_OVERLAP = int(os.getenv("TAG_INDEX_SYNC_OVERLAP", "1000"))
+
+# canonical -> synonyms; both sides are folded with _clean before use
+SYNONYMS = {
+    "meta": ["facebook", "meta platforms", "fb"],
+    "google": ["alphabet", "google llc"],
+    "amazon web services": ["aws"],
+    "google cloud": ["gcp", "google cloud platform"],
+    "microsoft azure": ["azure"],
+    "javascript": ["js"],
+    "typescript": ["ts"],
+    "python": ["python3"],
+    "golang": ["go lang"],
+    "kubernetes": ["k8s"],
+    "machine learning": ["ml"],
+    "artificial intelligence": ["ai"],
+    "natural language processing": ["nlp"],
+    "software engineer": ["swe", "software developer", "software engineering", "software development"],
+    "product manager": ["pm", "product management"],
+    "user experience": ["ux", "ux design"],
+    "venture capital": ["vc"],
+    "chief executive officer": ["ceo"],
+    "chief technology officer": ["cto"],
+    "new york": ["nyc", "new york city"],
+    "san francisco": ["sf", "san francisco bay area", "bay area"],
+    "los angeles": ["la"],
+}
+
+_OPERATORS = re.compile(r"(\(|\)|\bAND\b|\bOR\b|(?<!\S)&(?!\S)|\||,)")
+
+
+def _clean(tag: str) -> str:
+    tag = unicodedata.normalize("NFKC", tag).lower()
+    tag = re.sub(r"[-_/]+", " ", tag)
+    tag = re.sub(r"[^\w+#.& ]+", "", tag)   # keep c++, c#, node.js, r&d
+    tag = re.sub(r"\s*&\s*", "&", tag)
+    return " ".join(tag.split()).strip(".&")
+
+
+def _load_synonyms() -> Dict[str, str]:
+    groups = dict(SYNONYMS)
+    path = os.getenv("TAG_SYNONYMS_PATH")
+    if path:
+        with open(path) as f:
+            groups.update(json.load(f))
+    folded = {}
+    for canonical, synonyms in groups.items():
+        canonical = _clean(canonical)
+        for synonym in synonyms:
+            folded[_clean(synonym)] = canonical
+    return folded
+
+
+_synonyms = _load_synonyms()
+
+
+def fold(tag: str) -> str:
+    """The canonical form a tag is indexed and queried under ("" for junk); interned, as it's shared."""
+    tag = _clean(tag)
+    return sys.intern(_synonyms.get(tag, tag))
+
+
+def parse_query(query: str):
+    """
+    Parse into nested ("and" | "or", [children]) tuples with folded tags as leaves.
+    Raises ValueError on an empty or malformed query.
+    """
+    tokens = []
+    for part in _OPERATORS.split(query):
+        part = part.strip()
+        if not part:
+            continue
+        if part in ("AND", "&", ","):
+            tokens.append("AND")
+        elif part in ("OR", "|"):
+            tokens.append("OR")
+        elif part in ("(", ")"):
+            tokens.append(part)
+        else:
+            tag = fold(part)
+            if not tag:
+                raise ValueError(f"Not a searchable tag: {part!r}")
+            tokens.append(("tag", tag))
+    if not tokens:
+        raise ValueError("Empty query")
+    position = 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else None
+
+    def take():
+        nonlocal position
+        position += 1
+        return tokens[position - 1]
+
+    def expression(op, operand):
+        children = [operand()]
+        while peek() == op.upper():
+            take()
+            children.append(operand())
+        return children[0] if len(children) == 1 else (op, children)
+
+    def factor():
+        token = take() if peek() is not None else None
+        if token == "(":
+            node = expression("or", term)
+            if peek() != ")":
+                raise ValueError("Unbalanced parentheses")
+            take()
+            return node
+        if isinstance(token, tuple):
+            return token[1]
+        raise ValueError("Expected a tag")
+
+    def term():
+        return expression("and", factor)
+
+    tree = expression("or", term)
+    if peek() is not None:
+        raise ValueError(f"Unexpected {peek() if isinstance(peek(), str) else peek()[1]!r}")
+    return tree
+
+
+def query_tags(tree) -> List[str]:
+    if isinstance(tree, str):
+        return [tree]
+    return list(dict.fromkeys(tag for child in tree[1] for tag in query_tags(child)))
+
+
+class TagIndex:
+    def __init__(self):
+        self.postings: Dict[str, Set[int]] = {}
+        self._tags: Dict[int, tuple] = {}   # connection id -> its indexed tags, to undo on update
+        self.watermark = 0                 # highest Enrichment.id applied by sync()
+        self.ready = False
+        self.syncs = 0
+        self._lock = threading.Lock()
+
+    def _apply(self, connection_id: int, tags: Iterable[str]) -> None:
+        folded = tuple(dict.fromkeys(t for t in (fold(tag) for tag in tags if isinstance(tag, str)) if t))
+        if not folded:
+            return
+        for tag in self._tags.get(connection_id, ()):
+            ids = self.postings.get(tag)
+            if ids is not None:
+                ids.discard(connection_id)
+                if not ids:
+                    del self.postings[tag]
+        for tag in folded:
+            self.postings.setdefault(tag, set()).add(connection_id)
+        self._tags[connection_id] = folded
+
+    def record(self, connection_id: int, tags: Iterable[str]) -> None:
+        """Apply tags just written for a connection, ahead of the next sync()."""
+        with self._lock:
+            self._apply(connection_id, tags)
+
+    def sync(self, engine, enrichment_table, page: int = TAG_INDEX_SYNC_PAGE,
+             overlap: int = TAG_INDEX_SYNC_OVERLAP) -> int:
+        """Apply enrichment rows written since the last sync; returns how many were read."""
+        query = select(enrichment_table.c.id, enrichment_table.c.connection_id, enrichment_table.c.tags)
+        # Sequence values aren't committed in order, so a row just below the watermark can show
+        # up after it moved on; re-reading the last `overlap` IDs picks those up
+        cursor = max(self.watermark - overlap, 0) if self.ready else self.watermark
+        read = 0
+        while True:
+            with engine.connect() as db:
+                rows = db.execute(
+                    query.where(enrichment_table.c.id > cursor).order_by(enrichment_table.c.id).limit(page)
+                ).all()
+            with self._lock:
+                # ascending IDs, so a connection's later version overwrites the earlier one
+                for row_id, connection_id, tags in rows:
+                    if tags:
+                        self._apply(connection_id, tags)
+                    cursor = row_id
+                self.watermark = max(self.watermark, cursor)
+            read += len(rows)
+            if len(rows) < page:
+                break
+        with self._lock:
+            self.ready = True
+            self.syncs += 1
+        return read
+
+    def _evaluate(self, tree) -> Set[int]:
+        if isinstance(tree, str):
+            return self.postings.get(tree, set())
+        op, children = tree
+        if op == "or":
+            return set().union(*(self._evaluate(child) for child in children))
+        # smallest first, so the intersection shrinks as early as possible
+        sets = sorted((self._evaluate(child) for child in children), key=len)
+        result = set(sets[0])
+        for other in sets[1:]:
+            if not result:
+                break
+            result &= other
+        return result
+
+    def search(self, query: str, limit: int = 50, offset: int = 0) -> dict:
+        """
+        {"total": matches, "results": [{"connection_id", "score", "matched": [tags]}]} for one page,
+        best first (ties go to the most recently created connection).
+        """
+        tree = parse_query(query)
+        tags = query_tags(tree)
+        with self._lock:
+            matches = self._evaluate(tree)
+            total_connections = max(len(self._tags), 1)
+            weights = {
+                tag: math.log(1 + total_connections / len(self.postings[tag]))
+                for tag in tags if self.postings.get(tag)
+            }
+            scores: Dict[int, float] = dict.fromkeys(matches, 0.0)
+            for tag, weight in weights.items():
+                for connection_id in self.postings[tag] & matches:
+                    scores[connection_id] += weight
+            page = heapq.nlargest(offset + limit, scores.items(), key=lambda item: (item[1], item[0]))[offset:]
+            results = [
+                {
+                    "connection_id": connection_id,
+                    "score": round(score, 4),
+                    "matched": [tag for tag in tags if tag in self._tags.get(connection_id, ())],
+                }
+                for connection_id, score in page
+            ]
+        return {"total": len(matches), "results": results}
+
+    def tags_for(self, connection_id: int) -> Optional[tuple]:
+        return self._tags.get(connection_id)
+
+    def stats(self) -> dict:
+        return {
+            "tags": len(self.postings),
+            "connections": len(self._tags),
+            "watermark": self.watermark,
+            "syncs": self.syncs,
+        }
+
+
+# Process-wide index; the API keeps it in sync, the batch job feeds it whatever it writes
+index = TagIndex()
+
+
+def record(connection_id: int, tags: Iterable[str]) -> None:
+    """Hook for writers: a no-op until this process has loaded the index."""
+    if index.ready:
+        index.record(connection_id, tags)
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Shared modules live at the repo root, the API's under backend/ (which imports them by name)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "backend"))
@@ -0,0 +1,92 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("openai")
+pytest.importorskip("httpx")
+pytest.importorskip("dotenv")
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.pop("DATABASE_URL", None)
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import app as api  # noqa: E402  (backend/app.py)
+import mixrank  # noqa: E402
+
+PROFILE_URL = "https://www.linkedin.com/in/ada-lovelace"
+
+
+class FakeOpenAI:
+    """Answers the URL guess with JSON and anything else with a summary."""
+
+    def __init__(self):
+        self.requests = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, model, messages, **kwargs):
+        self.requests.append({"model": model, "messages": messages, **kwargs})
+        content = f'{{"linkedin_url": "{PROFILE_URL}"}}' if "search" in model else "Mathematician and writer."
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=None)
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    fake = FakeOpenAI()
+    monkeypatch.setattr(api, "client", fake)
+
+    async def profile(url, api_key=None):
+        return {"name": "Ada Lovelace", "headline": "Analyst", "locality": "London"}
+
+    async def search(query):
+        return [{"url": PROFILE_URL, "title": "Ada Lovelace | LinkedIn"}]
+
+    monkeypatch.setattr(mixrank, "fetch_profile_async", profile)
+    monkeypatch.setattr(api, "search_exa", search)
+    return fake
+
+
+def test_guess_prompt_builds_with_a_literal_json_example():
+    system, user = api.guess_linkedin_url_messages("Ada Lovelace", "Analyst", "https://example.com/ada")
+    assert '{"linkedin_url": "https://www.linkedin.com/in/johndoe"}' in system["content"]
+    assert "Name: Ada Lovelace" in user["content"]
+
+
+def test_full_profile_guesses_the_url_and_summarises(llm):
+    with TestClient(api.app) as client:
+        response = client.post("/api/full_profile", json={
+            "name": "Ada Lovelace", "summary": "Analyst in London", "url": "https://example.com/ada",
+        })
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body["linkedin_url"] == PROFILE_URL
+    assert body["summary"] == "Mathematician and writer."
+    assert body["corroborated"] is True
+    assert [r["model"] for r in llm.requests] == ["gpt-4o-mini-search-preview", "gpt-4o-mini"]
+
+
+class FakeStore:
+    """A batch-written enrichment: fresh, but without a summary."""
+
+    def __init__(self):
+        self.summaries = []
+
+    def fresh_enrichment(self, url):
+        return {"version": 1, "linkedin_url": PROFILE_URL, "profile": {"full_name": "Ada Lovelace"}}
+
+    def add_summary(self, url, summary):
+        self.summaries.append(summary)
+        return 1
+
+
+def test_confirm_profile_summarises_a_batch_enrichment(llm, monkeypatch):
+    store = FakeStore()
+    monkeypatch.setattr(api, "store", store)
+    with TestClient(api.app) as client:
+        response = client.post("/api/confirm_profile", json={"name": "Ada Lovelace", "linkedin_url": PROFILE_URL})
+    assert response.status_code == 200, response.text
+    assert response.json()["stored"] is True
+    assert store.summaries == ["Mathematician and writer."]
+    assert [r["model"] for r in llm.requests] == ["gpt-4o-mini"]
@@ -0,0 +1,55 @@
+import asyncio
+import sqlite3
+
+from cache import LRUCache, PersistentCache, SingleFlight
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+
+
+def test_disk_tier_survives_a_new_process(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    PersistentCache(path, ttl=60).set("k", {"v": 1})
+    fresh = PersistentCache(path, ttl=60)
+    assert asyncio.run(fresh.get_async("k")) == {"v": 1}
+    assert fresh.stats()["disk_hits"] == 1
+
+
+def test_locked_file_is_a_miss(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = PersistentCache(path, ttl=60)
+    cache.set("k", 1)
+    cache.memory.delete("k")
+    cache._conn().execute("PRAGMA busy_timeout = 50")
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN EXCLUSIVE")
+    try:
+        assert cache.get("k", "miss") == "miss"
+        cache.set("j", 2)   # dropped on disk, still served from memory
+        assert cache.get("j") == 2
+    finally:
+        other.execute("ROLLBACK")
+    assert cache.get("k") == 1
+
+
+def test_single_flight_shares_one_call():
+    calls = []
+
+    async def fetch(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return key.upper()
+
+    async def main():
+        flight = SingleFlight()
+        return await asyncio.gather(*(flight.do("k", fetch, "k") for _ in range(5)))
+
+    assert asyncio.run(main()) == ["K"] * 5
+    assert calls == ["k"]
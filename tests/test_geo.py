@@ -0,0 +1,47 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("requests")
+
+import geo  # noqa: E402  (backend/geo.py)
+
+
+@pytest.mark.parametrize("ip", ["8.8.8.8", "1.1.1.1", "2001:4860:4860::8888"])
+def test_public_addresses(ip):
+    assert geo.is_public_ip(ip)
+
+
+@pytest.mark.parametrize("ip", [
+    "10.0.0.1", "172.16.5.4", "192.168.1.1",   # private
+    "127.0.0.1", "::1",                          # loopback
+    "169.254.1.1", "fe80::1",                    # link-local
+    "100.64.0.1",                                # carrier-grade NAT
+    "0.0.0.0", "240.0.0.1",                      # reserved
+    "", "unknown", "8.8.8.8.8",
+])
+def test_non_routable_or_invalid_addresses(ip):
+    assert not geo.is_public_ip(ip)
+
+
+def test_client_ip_prefers_the_first_forwarded_hop():
+    request = SimpleNamespace(headers={"X-Forwarded-For": "8.8.8.8, 10.0.0.1"}, client=SimpleNamespace(host="10.0.0.2"))
+    assert geo.client_ip(request) == "8.8.8.8"
+    assert geo.client_ip(SimpleNamespace(headers={}, client=SimpleNamespace(host="1.1.1.1"))) == "1.1.1.1"
+    assert geo.client_ip(SimpleNamespace(headers={}, client=None)) == ""
+
+
+def test_range_table_lookup(tmp_path):
+    source = tmp_path / "ranges.csv"
+    source.write_text(
+        "network,city,regionName,country\n"
+        "8.8.8.0/24,Mountain View,California,United States\n"
+        "1.1.1.0/24,Sydney,New South Wales,Australia\n"
+    )
+    table = tmp_path / "geoip.bin"
+    assert geo.IPRangeDB.build(str(source), str(table)) == 2
+    db = geo.IPRangeDB(str(table))
+    assert db.lookup("8.8.8.8")["city"] == "mountain view"
+    assert db.lookup("1.1.1.255")["display"] == "Sydney, New South Wales, Australia"
+    assert db.lookup("9.9.9.9") is None
+    assert db.lookup("2001:4860::1") is None
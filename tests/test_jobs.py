@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from fastapi import HTTPException  # noqa: E402
+
+from cache import LRUCache  # noqa: E402
+from jobs import JobManager  # noqa: E402  (backend/jobs.py)
+
+
+class Enricher:
+    """Records who it was asked about; "Nobody" fails like a failed enrichment."""
+
+    def __init__(self, delay: float = 0.0):
+        self.calls = []
+        self.delay = delay
+
+    async def __call__(self, name, linkedin_url):
+        self.calls.append(name)
+        await asyncio.sleep(self.delay)
+        if name == "Nobody":
+            raise HTTPException(status_code=500, detail="Mixrank enrichment failed")
+        return {"summary": f"About {name}"}
+
+
+def manager(process, result_cache=None):
+    return JobManager(process, concurrency=2, max_jobs=10, ttl=60, result_cache=result_cache or LRUCache(100, 60))
+
+
+def test_job_lifecycle():
+    enricher = Enricher()
+    jobs = manager(enricher)
+
+    async def main():
+        job = jobs.create()
+        assert jobs.get(job.id) is job
+        await jobs.add(job, "Ada Lovelace", "https://www.linkedin.com/in/ada")
+        await jobs.add(job, "ada lovelace", "linkedin.com/in/ada/")     # the same person again
+        await jobs.add(job, "Nobody", "https://www.linkedin.com/in/nobody")
+        await jobs.add_invalid(job, "missing linkedin_url", name="Grace")
+        assert job.summary()["status"] == "running"
+        await job.close_input()
+        return job, [result async for result in job.follow()]
+
+    job, streamed = asyncio.run(main())
+    assert enricher.calls == ["Ada Lovelace", "Nobody"]
+    summary = job.summary()
+    assert summary["status"] == "done"
+    assert (summary["total"], summary["unique"], summary["completed"], summary["failed"]) == (4, 2, 4, 2)
+    by_index = {r["index"]: r for r in streamed}
+    assert by_index[0]["summary"] == by_index[1]["summary"] == "About Ada Lovelace"
+    assert by_index[1]["linkedin_url"] == "linkedin.com/in/ada/"
+    assert by_index[2] == {**by_index[2], "status": "error", "detail": "Mixrank enrichment failed"}
+    assert by_index[3]["status"] == "error"
+    assert job.summary(offset=3)["results"] == summary["results"][3:]
+
+
+def test_results_are_reused_across_jobs():
+    enricher = Enricher()
+    jobs = manager(enricher)
+
+    async def run_job():
+        job = jobs.create()
+        await jobs.add(job, "Ada Lovelace", "https://www.linkedin.com/in/ada")
+        await job.close_input()
+        return [result async for result in job.follow()]
+
+    asyncio.run(run_job())
+    (second,) = asyncio.run(run_job())
+    assert second["cached"] is True
+    assert enricher.calls == ["Ada Lovelace"]
+
+
+def test_concurrent_jobs_share_one_call_per_person():
+    enricher = Enricher(delay=0.05)
+    jobs = manager(enricher)
+
+    async def main():
+        first, second = jobs.create(), jobs.create()
+        await jobs.add(first, "Ada Lovelace", "https://www.linkedin.com/in/ada")
+        await jobs.add(second, "Ada Lovelace", "https://www.linkedin.com/in/ada")
+        for job in (first, second):
+            await job.close_input()
+        return [[r async for r in job.follow()] for job in (first, second)]
+
+    first, second = asyncio.run(main())
+    assert first[0]["summary"] == second[0]["summary"]
+    assert enricher.calls == ["Ada Lovelace"]
+
+
+def test_discarded_jobs_cancel_their_items():
+    enricher = Enricher(delay=10)
+    jobs = manager(enricher)
+
+    async def main():
+        job = jobs.create()
+        await jobs.add(job, "Ada Lovelace", "https://www.linkedin.com/in/ada")
+        await asyncio.sleep(0)
+        tasks = list(job._tasks)
+        jobs.discard(job)
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return job, tasks
+
+    job, tasks = asyncio.run(main())
+    assert jobs.get(job.id) is None
+    assert all(task.cancelled() for task in tasks)
+    assert not job.results
@@ -0,0 +1,95 @@
+import asyncio
+from types import SimpleNamespace
+from typing import List
+
+import pytest
+
+pytest.importorskip("pydantic")
+
+from pydantic import BaseModel, ValidationError  # noqa: E402
+
+import llm_json  # noqa: E402  (backend/llm_json.py)
+from llm_json import JSONArrayStreamParser, complete_structured, extract_json  # noqa: E402
+
+
+class Candidate(BaseModel):
+    name: str
+    score: float
+
+
+class Candidates(BaseModel):
+    candidates: List[Candidate]
+
+
+def test_stream_parser_emits_each_element_once_it_closes():
+    parser = JSONArrayStreamParser()
+    text = '```json\n{"candidates": [{"name": "Ada", "note": "a } in a string"}, {"name": "Grace", "tags": [{"x": 1}]}]}\n```'
+    emitted = [parser.feed(text[i:i + 7]) for i in range(0, len(text), 7)]
+    names = [obj["name"] for chunk in emitted for obj in chunk]
+    assert names == ["Ada", "Grace"]
+    # the first candidate is out before the second one has streamed in
+    first = next(i for i, chunk in enumerate(emitted) if chunk)
+    assert first < len(emitted) - 2
+
+
+def test_stream_parser_skips_broken_elements():
+    parser = JSONArrayStreamParser()
+    assert parser.feed('[{"a": 1}, {"b": tru}, {"c": 3}]') == [{"a": 1}, {"c": 3}]
+    assert parser.failures == 1
+
+
+def test_extract_json_repairs_fences_prose_and_trailing_commas():
+    assert extract_json('Sure! ```json\n{"a": [1, 2,],}\n```') == {"a": [1, 2]}
+    assert extract_json('Here you go: [{"a": 1},] hope that helps') == [{"a": 1}]
+    with pytest.raises(ValueError):
+        extract_json("no JSON here")
+
+
+class FakeCompletions:
+    def __init__(self, *answers):
+        self.answers = list(answers)
+        self.requests = []
+
+    async def create(self, **kwargs):
+        self.requests.append(kwargs)
+        content = self.answers.pop(0)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=None)
+
+
+def client(*answers):
+    return SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions(*answers)))
+
+
+def complete(fake):
+    messages = [{"role": "user", "content": "rank these"}]
+    return asyncio.run(complete_structured(fake, Candidates, messages))
+
+
+def test_complete_structured_accepts_a_bare_array_without_a_repair():
+    fake = client('[{"name": "Ada", "score": 0.9}]')
+    assert complete(fake).candidates[0].name == "Ada"
+    assert len(fake.chat.completions.requests) == 1
+
+
+def test_complete_structured_repairs_only_the_broken_output():
+    fake = client('{"candidates": [{"name": "Ada"}]}', '{"candidates": [{"name": "Ada", "score": 0.5}]}')
+    repaired = llm_json.stats["repaired"]
+    assert complete(fake).candidates[0].score == 0.5
+    assert llm_json.stats["repaired"] == repaired + 1
+    repair = fake.chat.completions.requests[1]
+    assert repair["model"] == "gpt-4o-mini"
+    assert repair["response_format"] == {"type": "json_object"}
+    assert "rank these" not in str(repair["messages"])     # the original prompt isn't re-sent
+    assert '{"name": "Ada"}' in repair["messages"][1]["content"]
+
+
+def test_complete_structured_raises_when_the_repair_fails_too():
+    fake = client("nope", "still nope")
+    with pytest.raises(ValueError):
+        complete(fake)
+
+
+def test_complete_structured_raises_validation_errors_from_the_repair():
+    fake = client("nope", '{"candidates": [{"name": "Ada"}]}')
+    with pytest.raises(ValidationError):
+        complete(fake)
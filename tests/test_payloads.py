@@ -0,0 +1,74 @@
+import json
+
+import pytest
+
+pytest.importorskip("requests")
+
+import payloads  # noqa: E402
+from payloads import CAP_LEVELS, compact_exa, compact_mixrank, compact_payload, content_hash  # noqa: E402
+
+PROFILE = {
+    "name": "Ada Lovelace",
+    "headline": "Analyst",
+    "locality": "London",
+    "picture_url_orig": "https://cdn.example.com/ada.jpg",
+    "linkedin_id": 123456,
+    "experience": [
+        {"title": "Analyst", "company": "Analytical Engines", "is_current": True, "description": "x " * 1000},
+        {"title": "Translator", "company": "Taylor's Memoirs", "end_date": "1843"},
+    ],
+    "education": [{"school_name": "Home", "degree": None}],
+    "skills": [f"skill {i}" for i in range(100)],
+}
+EXA = {"results": [
+    {"title": f"Result {i}", "url": f"https://example.com/{i}", "score": 0.5, "highlights": ["h1", "h2", "h3", "h4"]}
+    for i in range(10)
+]}
+
+
+def test_mixrank_projection_keeps_only_what_the_summary_uses():
+    compact = compact_mixrank(PROFILE)
+    assert compact["name"] == "Ada Lovelace" and compact["location"] == "London"
+    assert "picture_url_orig" not in compact and "linkedin_id" not in compact
+    assert compact["experience"][0]["end"] == "present"
+    assert len(compact["experience"][0]["description"]) == CAP_LEVELS[0]["text"]
+    assert compact["education"] == [{"school": "Home"}]   # empty fields are pruned
+    assert len(compact["skills"]) == CAP_LEVELS[0]["skills"]
+
+
+def test_mixrank_projection_reads_person_match_envelopes():
+    assert compact_mixrank({"linkedin": {"headline": "Analyst"}})["headline"] == "Analyst"
+    assert compact_mixrank(None) == {} and compact_mixrank({}) == {}
+
+
+def test_exa_projection_caps_results_and_highlights():
+    compact = compact_exa(EXA)
+    assert len(compact) == CAP_LEVELS[0]["results"]
+    assert compact[0] == {"title": "Result 0", "url": "https://example.com/0", "highlights": ["h1", "h2", "h3"]}
+    assert compact_exa([{"title": "t", "text": "body"}]) == [{"title": "t", "highlights": ["body"]}]
+
+
+def test_payload_tightens_caps_to_fit_the_budget():
+    roomy = compact_payload(PROFILE, EXA, token_budget=100_000)
+    tight = compact_payload(PROFILE, EXA, token_budget=300)
+    assert roomy.tokens > tight.tokens
+    assert json.loads(tight.mixrank)["skills"]          # still a whole, parseable projection
+    assert tight.saved_tokens > 0
+    assert compact_payload(PROFILE, None).exa == ""
+
+
+def test_payload_hard_trims_when_even_the_tightest_caps_are_too_big():
+    projection = compact_payload(PROFILE, EXA, token_budget=20)
+    assert projection.tokens <= 20
+
+
+def test_payload_totals_accumulate():
+    calls = payloads.totals["calls"]
+    compact_payload(PROFILE)
+    assert payloads.totals["calls"] == calls + 1
+
+
+def test_content_hash_ignores_exa_rank_but_not_content():
+    shuffled = {"results": list(reversed(EXA["results"][:3]))}
+    assert content_hash(PROFILE, {"results": EXA["results"][:3]}) == content_hash(PROFILE, shuffled)
+    assert content_hash(PROFILE, EXA) != content_hash({**PROFILE, "headline": "Countess"}, EXA)
@@ -0,0 +1,36 @@
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from people_index import PeopleIndex  # noqa: E402
+
+
+def people(*rows):
+    index = PeopleIndex()
+    for url, name, location in rows:
+        index.record(profile_url=url, full_name=name, location=location)
+    return index
+
+
+def test_no_city_is_never_confident():
+    index = people(("linkedin.com/in/john-smith-1a2b3c", "John Smith", "Austin, Texas"))
+    assert index.lookup("John Smith", "")[0][0] == 1.0
+    assert index.confident("John Smith", "") == []
+
+
+def test_confident_needs_the_city_to_match():
+    index = people(("linkedin.com/in/john-smith-1a2b3c", "John Smith", "Austin, Texas"))
+    assert [p.url for _, p in index.confident("John Smith", "Austin")] == [
+        "https://www.linkedin.com/in/john-smith-1a2b3c"
+    ]
+    assert index.confident("John Smith", "Denver") == []
+    assert index.confident("John Smith", "Austin", min_score=0.5) != []
+    assert index.confident("John Smith", "Denver", min_score=0.5) == []
+
+
+def test_as_result_ranks_like_a_search_hit():
+    index = people(("linkedin.com/in/jane-doe", "Jane Doe", "Boston"))
+    (_, person), = index.lookup("Jane Doe")
+    result = person.as_result()
+    assert result["url"] == "https://www.linkedin.com/in/jane-doe"
+    assert "Boston" in result["text"]
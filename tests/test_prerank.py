@@ -0,0 +1,37 @@
+from prerank import clear_winner, cluster_results, prerank
+
+
+def result(url, title, text=""):
+    return {"url": url, "title": title, "text": text, "highlights": []}
+
+
+def test_namesake_profiles_stay_separate():
+    results = [
+        result("https://www.linkedin.com/in/john-smith-1a2b3c", "John Smith | LinkedIn"),
+        result("https://www.linkedin.com/in/john-smith-98765", "John Smith | LinkedIn"),
+        result("https://www.linkedin.com/in/john-smith-4f5e6d", "John Smith | LinkedIn"),
+    ]
+    for city in ("", "austin"):
+        clusters = prerank(results, "John Smith", city)
+        assert len(clusters) == 3
+        assert clear_winner(clusters) is None
+
+
+def test_same_profile_merges_across_url_spellings():
+    clusters = cluster_results([
+        result("https://www.linkedin.com/in/jane-doe-1a2b3c", "Jane Doe - Engineer - Acme | LinkedIn"),
+        result("http://uk.linkedin.com/in/Jane-Doe-1a2b3c/", "Jane Doe - Engineer - Acme"),
+        result("https://www.linkedin.com/in/jane-doe-1a2b3c/en?trk=public", "Jane Doe"),
+    ])
+    assert len(clusters) == 1
+    assert len(clusters[0].results) == 3
+
+
+def test_pages_merge_only_on_matching_company():
+    clusters = cluster_results([
+        result("https://www.linkedin.com/in/jane-doe", "Jane Doe - Engineer - Acme | LinkedIn"),
+        result("https://acme.com/team/jane", "Jane Doe - Engineer - Acme"),
+        result("https://example.com/jane", "Jane Doe - Engineer - Initech"),
+        result("https://example.org/jane", "Jane Doe"),
+    ])
+    assert [len(c.results) for c in clusters] == [2, 1, 1]
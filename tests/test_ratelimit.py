@@ -0,0 +1,62 @@
+from types import SimpleNamespace
+
+import pytest
+
+import ratelimit
+from ratelimit import TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = SimpleNamespace(t=1000.0)
+    monkeypatch.setattr(ratelimit.time, "monotonic", lambda: now.t)
+    return now
+
+
+def test_bucket_allows_a_burst_then_one_per_interval(clock):
+    bucket = TokenBucket(rate=2.0, burst=3)
+    assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+    clock.t += 0.5
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+
+
+def test_bucket_queues_blocking_callers_in_order(clock):
+    bucket = TokenBucket(rate=4.0, burst=1)
+    waits = [bucket._reserve() for _ in range(3)]
+    assert waits == pytest.approx([0.0, 0.25, 0.5])
+
+
+def test_penalize_holds_back_every_caller(clock):
+    bucket = TokenBucket(rate=10.0, burst=5)
+    bucket.penalize(2.0)
+    assert not bucket.try_acquire()
+    clock.t += 2.0
+    assert bucket.try_acquire()
+
+
+def test_retry_after_parses_seconds_and_dates():
+    assert ratelimit.retry_after_seconds("3") == 3.0
+    assert ratelimit.retry_after_seconds("-1") == 0.0
+    assert ratelimit.retry_after_seconds("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert ratelimit.retry_after_seconds("soon") is None
+    assert ratelimit.retry_after_seconds(None) is None
+
+
+def test_throttle_signal():
+    def response(status, headers=None):
+        return SimpleNamespace(status_code=status, headers=headers or {})
+
+    assert ratelimit.throttle_signal(response(429)) == (True, None)
+    assert ratelimit.throttle_signal(response(429, {"Retry-After": "2"})) == (True, 2.0)
+    assert ratelimit.throttle_signal(response(503)) == (False, None)   # a plain 503 is an outage
+    assert ratelimit.throttle_signal(response(503, {"Retry-After": "1"})) == (True, 1.0)
+    assert ratelimit.throttle_signal(response(200)) == (False, None)
+
+
+def test_call_retries_throttled_answers(monkeypatch):
+    monkeypatch.setattr(ratelimit, "backoff_delay", lambda attempt, retry_after=None: 0.0)
+    answers = [SimpleNamespace(status_code=429, headers={}), SimpleNamespace(status_code=200, headers={})]
+    result = ratelimit.call("test-retries", answers.pop, 0)
+    assert result.status_code == 200
+    assert answers == []
@@ -0,0 +1,103 @@
+import asyncio
+import time
+
+import pytest
+
+import resilience
+from resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+GEO_STAGE_BUDGET = 1.5   # backend/app.py's default
+
+
+def test_geo_lookups_cut_at_the_stage_budget_open_the_breaker():
+    breaker = CircuitBreaker("ip-api")
+    assert breaker.slow_seconds <= GEO_STAGE_BUDGET
+    for _ in range(breaker.min_calls):
+        breaker.record(None, GEO_STAGE_BUDGET)   # cancelled by resilience.optional at the budget
+    assert breaker.state == OPEN
+
+
+def test_cancelled_fast_calls_give_no_verdict():
+    breaker = CircuitBreaker("ip-api")
+    for _ in range(breaker.min_calls * 2):
+        breaker.record(None, 0.01)
+    assert breaker.state == CLOSED
+    assert not breaker.outcomes
+    assert resilience.DEFAULT_SLOW_SECONDS["ip-api"] > 0.01
+
+
+def failing_breaker(monkeypatch, cooldown="0.01"):
+    monkeypatch.setenv("BREAKER_TEST_COOLDOWN", cooldown)
+    breaker = CircuitBreaker("test")
+    for _ in range(breaker.min_calls):
+        breaker.record(True, 0.01)
+    time.sleep(float(cooldown))
+    return breaker
+
+
+def test_breaker_opens_at_the_failure_rate(monkeypatch):
+    monkeypatch.setenv("BREAKER_TEST_COOLDOWN", "30")
+    breaker = CircuitBreaker("test")
+    for _ in range(breaker.min_calls):
+        breaker.record(True, 0.01)
+    assert breaker.state == OPEN
+    assert breaker.allow() > 0
+    with pytest.raises(resilience.CircuitOpenError):
+        breaker.admit()
+
+
+def test_breaker_stays_closed_below_the_failure_rate():
+    breaker = CircuitBreaker("test")
+    for failed in [True, False, False] * breaker.min_calls:
+        breaker.record(failed, 0.01)
+    assert breaker.state == CLOSED
+
+
+def test_one_probe_after_the_cooldown_decides(monkeypatch):
+    breaker = failing_breaker(monkeypatch)
+    assert breaker.allow() == 0.0            # the probe
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow() > 0               # everyone else waits for it
+    breaker.record(False, 0.01)
+    assert breaker.state == CLOSED
+
+    breaker = failing_breaker(monkeypatch)
+    breaker.allow()
+    breaker.record(True, 0.01)
+    assert breaker.state == OPEN
+
+
+def test_a_probe_without_a_verdict_frees_the_slot(monkeypatch):
+    breaker = failing_breaker(monkeypatch)
+    breaker.allow()
+    breaker.record(None, 0.0)                # throttled, or cancelled early
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow() == 0.0
+
+
+def test_deadline_caps_stage_timeouts():
+    assert resilience.remaining() is None
+    assert resilience.stage_timeout(10.0) == 10.0
+    with resilience.deadline(2.0):
+        assert resilience.stage_timeout(10.0) <= 2.0
+        assert resilience.stage_timeout(10.0, reserve=5.0) == 0.0
+        with resilience.deadline(60.0):      # a nested scope can't extend it
+            assert resilience.remaining() <= 2.0
+
+
+def test_optional_returns_the_fallback_when_the_budget_runs_out():
+    async def slow():
+        await asyncio.sleep(1)
+        return "late"
+
+    async def fast():
+        return "on time"
+
+    async def main():
+        with resilience.deadline(0.05):
+            first = await resilience.optional("test", slow(), "fallback")
+            # the budget is spent by now, so this one isn't even started
+            return first, await resilience.optional("test", fast(), "skipped")
+
+    assert asyncio.run(main()) == ("fallback", "skipped")
+    assert asyncio.run(resilience.optional("test", fast(), "fallback", limit=1.0)) == "on time"
@@ -0,0 +1,120 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("requests")
+
+from payloads import field_hash  # noqa: E402
+from store import EnrichmentStore, backlog_counts, enrichment_blob, is_fresh, stored_profile  # noqa: E402
+
+# The backlog predicates use JSONB operators, so these need a real (throwaway) Postgres
+DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+needs_postgres = pytest.mark.skipif(not DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+
+PROFILE = "https://www.linkedin.com/in/jane-doe"
+
+
+def test_is_fresh():
+    blob = enrichment_blob(1, "batch", {"headline": "Engineer"})
+    assert is_fresh(blob)
+    assert not is_fresh({**blob, "timestamp": (datetime.utcnow() - timedelta(days=30)).isoformat()}, max_age=3600)
+    assert not is_fresh({"timestamp": blob["timestamp"]})
+    assert not is_fresh(None)
+
+
+def test_stored_profile_is_mixrank_shaped():
+    profile = stored_profile({
+        "full_name": "Jane Doe",
+        "headline": "Engineer",
+        "current_company": "Acme",
+        "previous_companies": ["Initech"],
+        "skills": ["Python"],
+    })
+    assert profile["company_name"] == "Acme"
+    assert profile["experience"] == [{"company": "Initech"}]
+    assert profile["education"] == []
+
+
+@pytest.fixture
+def tables():
+    from sqlalchemy import create_engine, text
+
+    engine = create_engine(DATABASE_URL)
+    with engine.begin() as db:
+        db.execute(text("DROP TABLE IF EXISTS test_enrichment, test_connection"))
+        db.execute(text(
+            "CREATE TABLE test_connection (id serial PRIMARY KEY, profile_url text, full_name text,"
+            " headline text, location text, current_company text, previous_companies jsonb,"
+            " education jsonb, skills jsonb, latest_enrichment jsonb,"
+            " is_enriching boolean NOT NULL DEFAULT false, enrichment_lease_expires_at timestamp)"
+        ))
+        db.execute(text(
+            "CREATE TABLE test_enrichment (id serial PRIMARY KEY, connection_id integer NOT NULL,"
+            " version integer NOT NULL, tags jsonb, created_at timestamp NOT NULL)"
+        ))
+    yield EnrichmentStore(DATABASE_URL, "test_connection", "test_enrichment")
+    with engine.begin() as db:
+        db.execute(text("DROP TABLE test_enrichment, test_connection"))
+
+
+def insert(store, **values):
+    connection, _ = store.tables
+    with store.engine.begin() as db:
+        return db.execute(connection.insert().values(**values).returning(connection.c.id)).scalar()
+
+
+def blob_of(store, connection_id):
+    connection, _ = store.tables
+    with store.engine.connect() as db:
+        return db.execute(
+            connection.select().where(connection.c.id == connection_id)
+        ).mappings().one()["latest_enrichment"]
+
+
+@needs_postgres
+def test_backlog_counts(tables):
+    batch = enrichment_blob(1, "batch", {}, content_hash="abc")   # no "tagged" key: tagged
+    insert(tables, profile_url=PROFILE, latest_enrichment=batch)
+    insert(tables, profile_url=PROFILE, latest_enrichment={**batch, "tagged": True})
+    insert(tables, profile_url=PROFILE, latest_enrichment={**batch, "tagged": False})
+    insert(tables, profile_url=PROFILE, latest_enrichment=None)
+    insert(tables, profile_url=PROFILE, latest_enrichment={}, is_enriching=True,
+           enrichment_lease_expires_at=datetime.utcnow() + timedelta(minutes=5))
+    connection, _ = tables.tables
+    with tables.engine.connect() as db:
+        assert backlog_counts(db, connection) == {"enriched": 2, "in_progress": 1, "pending": 2}
+        assert backlog_counts(db, connection, refresh_before=datetime.utcnow() + timedelta(seconds=1)) == {
+            "enriched": 0, "in_progress": 1, "pending": 4,
+        }
+
+
+@needs_postgres
+def test_batch_enrichment_is_served_and_summarised_in_place(tables):
+    batch = enrichment_blob(1, "batch", {"headline": "Engineer"}, content_hash="abc")
+    connection_id = insert(tables, profile_url=PROFILE, full_name="Jane Doe", headline="Engineer",
+                           latest_enrichment=batch)
+    stored = tables.fresh_enrichment(PROFILE)
+    assert stored["version"] == 1 and stored["profile"]["full_name"] == "Jane Doe"
+    assert tables.add_summary(PROFILE, "Jane is an engineer.") == 1
+    blob = blob_of(tables, connection_id)
+    assert blob["summary"] == "Jane is an engineer." and blob["version"] == 1
+    assert tables.fresh_enrichment(PROFILE)["summary"] == "Jane is an engineer."
+
+
+@needs_postgres
+def test_save_keeps_the_batch_jobs_tags_and_hash(tables):
+    old = enrichment_blob(1, "batch", {}, content_hash="abc")
+    old["timestamp"] = (datetime.utcnow() - timedelta(days=60)).isoformat()
+    tagged_id = insert(tables, profile_url=PROFILE, latest_enrichment=old)
+    new_id = insert(tables, profile_url=PROFILE + "/")
+    assert tables.save(PROFILE, {"headline": "Engineer"}, "Jane is an engineer.") == 2
+    tagged, new = blob_of(tables, tagged_id), blob_of(tables, new_id)
+    assert tagged["tagged"] is True and tagged["content_hash"] == "abc"
+    assert new["tagged"] is False and "content_hash" not in new
+    # what the API filled in from Mixrank is marked as the provider's, for the next refresh
+    assert new["mapped"] == {"headline": field_hash("Engineer")}
+    connection, _ = tables.tables
+    with tables.engine.connect() as db:
+        assert backlog_counts(db, connection) == {"enriched": 1, "in_progress": 0, "pending": 1}
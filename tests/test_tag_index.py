@@ -0,0 +1,26 @@
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from tag_index import TagIndex, fold, parse_query  # noqa: E402
+
+
+def test_ampersand_inside_a_tag_is_searchable():
+    index = TagIndex()
+    index.record(1, ["R&D", "M & A"])
+    index.record(2, ["research", "development"])
+    assert [r["connection_id"] for r in index.search("r&d")["results"]] == [1]
+    assert [r["connection_id"] for r in index.search("m&a")["results"]] == [1]
+    assert index.search("R & D")["total"] == 0   # spaced "&" is AND: nobody is tagged "r" and "d"
+
+
+def test_spaced_ampersand_is_and():
+    assert parse_query("python & meta") == ("and", ["python", "meta"])
+    assert parse_query("r&d, facebook") == ("and", ["r&d", "meta"])
+
+
+def test_folded_tags_are_shared():
+    index = TagIndex()
+    index.record(1, ["Machine Learning"])
+    index.record(2, ["machine-learning", "ML"])
+    assert index.tags_for(1)[0] is index.tags_for(2)[0] is fold("ml")